@@ -0,0 +1,56 @@
+import argparse
+import os
+import tempfile
+
+import pandas as pd
+
+from benchmarks.common import timed, use_database, write_synthetic_csv
+from load_data import load_csv_to_db
+from src.analysis import category_mask, clear_frame_cache, get_cell_frequency_data
+
+
+def _object_frame(frame: pd.DataFrame) -> pd.DataFrame:
+    # The previous representation: object labels, int64 counts and float64 visit times.
+    legacy = frame.copy()
+    for column in legacy.columns:
+        if isinstance(legacy[column].dtype, pd.CategoricalDtype):
+            legacy[column] = legacy[column].astype(object)
+    return legacy.astype({"subject_pk": "int64", "visit_time": "float64", "count": "int64", "total_count": "int64"})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure frequency-frame memory and filter cost per representation.")
+    _ = parser.add_argument("--samples", type=int, default=200_000)
+    _ = parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        csv_path = os.path.join(workdir, "synthetic.csv")
+        write_synthetic_csv(csv_path, args.samples)
+        with use_database(os.path.join(workdir, "frame.db")):
+            _ = load_csv_to_db(csv_path, chunksize=100_000)
+            clear_frame_cache()
+            # A deep copy: deep memory accounting needs writeable buffers, and cached arrays are read-only.
+            compact = get_cell_frequency_data().copy()
+
+    frames = {"object": _object_frame(compact), "compact": compact}
+    results: dict[str, dict[str, float]] = {}
+    for name, frame in frames.items():
+        timings: dict[str, float] = {"bytes_per_row": frame.memory_usage(deep=True).sum() / len(frame)}
+        with timed("filter", timings):
+            for _ in range(args.repeats):
+                if name == "object":
+                    _ = frame.loc[frame["condition"].str.lower() == "melanoma"]
+                else:
+                    _ = frame.loc[category_mask(frame["condition"], "melanoma")]
+        timings["filter"] /= args.repeats
+        results[name] = timings
+
+    print(f"\n=== Frequency frame memory: {len(compact)} rows ===")
+    print(f"{'frame':>8} {'bytes/row':>10} {'filter s':>10}")
+    for name, timings in results.items():
+        print(f"{name:>8} {timings['bytes_per_row']:10.1f} {timings['filter']:10.4f}")
+
+
+if __name__ == "__main__":
+    main()
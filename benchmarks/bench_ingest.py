@@ -0,0 +1,31 @@
+import argparse
+import os
+import tempfile
+
+from benchmarks.common import timed, use_database, write_synthetic_csv
+from load_data import load_csv_to_db
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare default and bulk-load ingestion on a synthetic CSV.")
+    _ = parser.add_argument("--samples", type=int, default=1_000_000)
+    _ = parser.add_argument("--chunksize", type=int, default=200_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        csv_path = os.path.join(workdir, "synthetic.csv")
+        write_synthetic_csv(csv_path, args.samples)
+
+        timings: dict[str, float] = {}
+        for mode, bulk in (("default", False), ("bulk", True)):
+            with use_database(os.path.join(workdir, f"{mode}.db")), timed(mode, timings):
+                _ = load_csv_to_db(csv_path, chunksize=args.chunksize, bulk=bulk)
+
+    print(f"\n=== Ingest benchmark: {args.samples} samples ===")
+    for mode, seconds in timings.items():
+        print(f"{mode:>8}: {seconds:8.2f}s")
+    print(f" speedup: {timings['default'] / timings['bulk']:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import argparse
+import os
+import tempfile
+
+from benchmarks.common import timed, use_database, write_synthetic_csv
+from load_data import load_csv_to_db
+from src.analysis import clear_frame_cache, get_cell_frequency_data
+from src.database import migrate_cell_count_layout
+from src.queries import get_subset_stats
+
+
+def _measure(db_path: str, layout: str, repeats: int) -> dict[str, float]:
+    timings: dict[str, float] = {"size_mb": os.path.getsize(db_path) / 1e6}
+    with timed("frequency_frame", timings):
+        for _ in range(repeats):
+            clear_frame_cache()
+            _ = get_cell_frequency_data()
+    with timed("subset_stats", timings):
+        for _ in range(repeats):
+            _ = get_subset_stats("melanoma", "miraclib", "PBMC", "baseline_only")
+    timings["frequency_frame"] /= repeats
+    timings["subset_stats"] /= repeats
+    print(f"-> {layout}: measured {db_path}")
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare the long and wide cell-count layouts on a synthetic CSV.")
+    _ = parser.add_argument("--samples", type=int, default=200_000)
+    _ = parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        csv_path = os.path.join(workdir, "synthetic.csv")
+        write_synthetic_csv(csv_path, args.samples)
+
+        results: dict[str, dict[str, float]] = {}
+        db_path = os.path.join(workdir, "layout.db")
+        with use_database(db_path):
+            _ = load_csv_to_db(csv_path, chunksize=100_000, layout="long")
+            results["long"] = _measure(db_path, "long", args.repeats)
+            migrate_cell_count_layout("wide")
+            results["wide"] = _measure(db_path, "wide", args.repeats)
+
+    print(f"\n=== Cell-count layout benchmark: {args.samples} samples ===")
+    print(f"{'layout':>8} {'size MB':>10} {'frequency s':>12} {'subset s':>10}")
+    for layout, timings in results.items():
+        print(
+            f"{layout:>8} {timings['size_mb']:10.1f} {timings['frequency_frame']:12.3f} {timings['subset_stats']:10.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
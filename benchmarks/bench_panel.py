@@ -0,0 +1,65 @@
+import argparse
+import os
+import tempfile
+
+from benchmarks.common import timed, use_database, write_synthetic_csv
+from load_data import load_csv_to_db
+from src.analysis import (
+    clear_frame_cache,
+    get_cell_types,
+    get_filtered_data,
+    load_sqlite_count_matrix,
+)
+from src.database import cell_count_layout, read_connection
+from src.matrix_cache import write_count_matrix
+from src.statistics import compare_responders
+
+
+def _directory_mb(directory: str) -> float:
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)) / 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load and analyse a synthetic high-dimensional cytometry panel.")
+    _ = parser.add_argument("--samples", type=int, default=100_000)
+    _ = parser.add_argument("--populations", type=int, default=300)
+    _ = parser.add_argument("--zero-fraction", type=float, default=0.9)
+    args = parser.parse_args()
+
+    populations = [f"pop_{index:03d}" for index in range(args.populations)]
+    timings: dict[str, float] = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        csv_path = os.path.join(workdir, "panel.csv")
+        write_synthetic_csv(csv_path, args.samples, populations=populations, zero_fraction=args.zero_fraction)
+
+        db_path = os.path.join(workdir, "panel.db")
+        with use_database(db_path):
+            with timed("load", timings):
+                _ = load_csv_to_db(csv_path, chunksize=20_000, bulk=True)
+            with read_connection() as conn:
+                layout = cell_count_layout(conn)
+            assert len(get_cell_types()) == args.populations
+
+            clear_frame_cache()
+            with timed("cohort_frame", timings):
+                _ = get_filtered_data()
+            with timed("compare_subject", timings):
+                _ = compare_responders()
+            with timed("compare_sample_clr", timings):
+                _ = compare_responders(unit="sample", transform="clr", time_filter="all")
+
+            matrix_dir = os.path.join(workdir, "matrix")
+            write_count_matrix(*load_sqlite_count_matrix(), matrix_dir)
+            db_mb = os.path.getsize(db_path) / 1e6
+            matrix_mb = _directory_mb(matrix_dir)
+            dense_mb = args.samples * args.populations * 8 / 1e6
+
+    print(f"\n=== Panel benchmark: {args.samples} samples x {args.populations} populations ===")
+    print(f"zero fraction {args.zero_fraction:.2f} | layout {layout} | SQLite {db_mb:.1f} MB")
+    print(f"count matrix {matrix_mb:.1f} MB on disk (dense int64 would be {dense_mb:.1f} MB)")
+    for label, seconds in timings.items():
+        print(f"{label:>20} {seconds:8.2f} s")
+
+
+if __name__ == "__main__":
+    main()
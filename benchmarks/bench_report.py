@@ -0,0 +1,121 @@
+import argparse
+import os
+import tempfile
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+from benchmarks.common import timed
+from src.config import CELL_TYPES
+from src.reporting import (
+    PLOTLY_ASSET,
+    build_html_report,
+    build_pdf_report,
+    write_html_archive,
+    write_plotly_asset,
+)
+
+SUMMARY = {
+    "test_label": "Mann-Whitney U",
+    "correction_label": "BH-FDR",
+    "unit": "sample",
+    "metric": "percentage",
+    "transform_label": "Raw",
+}
+
+
+def _legacy_table_pdf(frame: pd.DataFrame) -> bytes:
+    # The previous layout: the whole table as a single ax.table on one page.
+    from matplotlib.backends.backend_pdf import PdfPages
+    from matplotlib.figure import Figure
+
+    buffer = BytesIO()
+    with PdfPages(buffer) as pdf:
+        fig = Figure(figsize=(11.69, 8.27))
+        ax = fig.subplots()
+        ax.axis("off")
+        table = ax.table(
+            cellText=frame.fillna("").astype(str).values.tolist(), colLabels=frame.columns.tolist(), loc="center"
+        )
+        table.auto_set_font_size(False)
+        table.set_fontsize(8)
+        pdf.savefig(fig, bbox_inches="tight")
+    return buffer.getvalue()
+
+
+def _stats_frame(rng: np.random.Generator, n_rows: int) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "cell_type": [f"gated_{i:04d}" for i in range(n_rows)],
+            "n_yes": rng.integers(10, 500, n_rows),
+            "n_no": rng.integers(10, 500, n_rows),
+            "median_diff": rng.normal(size=n_rows),
+            "direction": rng.choice(["higher in responders", "lower in responders"], n_rows),
+            "ci_95_low": rng.normal(size=n_rows),
+            "ci_95_high": rng.normal(size=n_rows),
+            "effect": rng.normal(size=n_rows),
+            "p_value": rng.uniform(size=n_rows),
+            "q_value": rng.uniform(size=n_rows),
+            "significant": rng.uniform(size=n_rows) < 0.1,
+        }
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare full and lean HTML report size and build time.")
+    _ = parser.add_argument("--units", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000])
+    _ = parser.add_argument("--pdf-rows", type=int, nargs="+", default=[50, 300, 3_000])
+    _ = parser.add_argument("--legacy-max-rows", type=int, default=300, help="Skip the single-table PDF above this.")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    stats_df = pd.DataFrame({"cell_type": CELL_TYPES, "q_value": rng.uniform(size=len(CELL_TYPES))})
+    flow_df = pd.DataFrame({"step": ["All samples"], "n_samples": [0], "n_subjects": [0]})
+
+    print(f"\n=== HTML report: full vs lean ({len(CELL_TYPES)} populations) ===")
+    print(f"{'units':>10} {'full MB':>9} {'full s':>8} {'lean KB':>9} {'lean s':>8}")
+    with tempfile.TemporaryDirectory() as workdir:
+        asset_kb = os.path.getsize(write_plotly_asset(workdir)) / 1e3
+        for n_units in args.units:
+            n_rows = n_units * len(CELL_TYPES)
+            plot_df = pd.DataFrame(
+                {
+                    "cell_type": np.tile(CELL_TYPES, n_units),
+                    "metric_value": rng.gamma(2.0, 10.0, n_rows),
+                    "response": np.repeat(rng.choice(["yes", "no"], n_units), len(CELL_TYPES)),
+                }
+            )
+            fig = px.box(plot_df, x="cell_type", y="metric_value", color="response", points="all")
+            counts = {"n_samples": n_units, "n_subjects": n_units}
+            timings: dict[str, float] = {}
+            sizes: dict[str, int] = {}
+            with timed("full", timings):
+                sizes["full"] = len(build_html_report("synthetic", counts, SUMMARY, stats_df, flow_df, fig))
+            with timed("lean", timings):
+                path = write_html_archive(workdir, f"units_{n_units}", "synthetic", counts, SUMMARY, stats_df, flow_df, fig)
+            sizes["lean"] = os.path.getsize(path)
+            print(
+                f"{n_units:>10} {sizes['full'] / 1e6:9.2f} {timings['full']:8.3f} "
+                f"{sizes['lean'] / 1e3:9.1f} {timings['lean']:8.3f}"
+            )
+    print(f"lean reports share one {PLOTLY_ASSET} per directory: {asset_kb:.0f} KB")
+
+    print("\n=== PDF stats table: paginated text vs single ax.table ===")
+    print(f"{'rows':>8} {'paged s':>9} {'paged KB':>9} {'legacy s':>9}")
+    for n_rows in args.pdf_rows:
+        stats_table = _stats_frame(rng, n_rows)
+        pdf_timings: dict[str, float] = {}
+        with timed("paged", pdf_timings):
+            report = build_pdf_report("synthetic", {"n_samples": 0, "n_subjects": 0}, SUMMARY, stats_table, flow_df)
+        legacy = "-"
+        if n_rows <= args.legacy_max_rows:
+            with timed("legacy", pdf_timings):
+                _ = _legacy_table_pdf(stats_table)
+            legacy = f"{pdf_timings['legacy']:.3f}"
+        print(f"{n_rows:>8} {pdf_timings['paged']:9.3f} {len(report) / 1e3:9.1f} {legacy:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable
+from datetime import UTC, datetime
+from typing import Any
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+from benchmarks.common import use_database, write_synthetic_csv
+from load_data import load_csv_to_db
+from src.analysis import (
+    clear_frame_cache,
+    get_cell_frequency_data,
+    get_cohort_counts,
+    get_filtered_data,
+)
+from src.config import CELL_COUNT_LAYOUT, STORAGE_BACKEND
+from src.queries import build_cohort_flow, get_subset_stats
+from src.reporting import build_html_report, build_pdf_report
+from src.statistics import compare_responders
+
+COHORT = {"condition": "melanoma", "treatment": "miraclib", "sample_type": "PBMC", "time_filter": "all"}
+TESTS = ("mannwhitney", "welch_t", "permutation")
+TRANSFORMS = ("none", "clr")
+UNITS = ("subject", "sample")
+# Differences below these floors are timer and allocator noise, whatever the ratio.
+MIN_SECONDS = 0.05
+MIN_PEAK_MB = 1.0
+# Reference results for the default ladder; refresh it with --output benchmarks/baseline.json --baseline ""
+# after an intended performance change.
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+def _measure(run: Callable[[], object], repeats: int) -> dict[str, float]:
+    # Each run starts from a cold frame cache. Timed runs go without tracemalloc, whose allocation hooks
+    # slow Python-heavy code several-fold; one extra traced run records peak Python and NumPy memory.
+    seconds = []
+    for _ in range(repeats):
+        clear_frame_cache()
+        started = time.perf_counter()
+        _ = run()
+        seconds.append(time.perf_counter() - started)
+    clear_frame_cache()
+    tracemalloc.start()
+    try:
+        _ = run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": min(seconds), "peak_mb": peak / 1e6}
+
+
+def _report_inputs() -> dict[str, Any]:
+    stats_df, plot_df, summary = compare_responders(**COHORT)
+    return {
+        "filters_text": " | ".join(f"{key}={value}" for key, value in COHORT.items()),
+        "cohort_counts": get_cohort_counts(get_filtered_data(**COHORT)),
+        "summary": summary,
+        "stats_df": stats_df,
+        "flow_df": build_cohort_flow(**COHORT),
+        "fig": px.box(plot_df, x="cell_type", y="metric_value", color="response", points="outliers"),
+    }
+
+
+def _run_size(workdir: str, n_samples: int, repeats: int, permutation_iterations: int) -> list[dict[str, Any]]:
+    csv_path = os.path.join(workdir, f"synthetic_{n_samples}.csv")
+    write_synthetic_csv(csv_path, n_samples)
+
+    def load() -> None:
+        # load_csv_to_db rebuilds the database on every call; its progress lines are not part of the result.
+        with contextlib.redirect_stdout(io.StringIO()):
+            _ = load_csv_to_db(csv_path)
+
+    operations: list[tuple[str, Callable[[], object]]] = [
+        ("load_csv_to_db", load),
+        ("get_cell_frequency_data", get_cell_frequency_data),
+        ("get_filtered_data", lambda: get_filtered_data(**COHORT)),
+    ]
+    for test, transform, unit in itertools.product(TESTS, TRANSFORMS, UNITS):
+        operations.append(
+            (
+                f"compare_responders[{test},{transform},{unit}]",
+                lambda test=test, transform=transform, unit=unit: compare_responders(
+                    **COHORT, unit=unit, transform=transform, test=test, permutation_iterations=permutation_iterations
+                ),
+            )
+        )
+    operations.append(("get_subset_stats", lambda: get_subset_stats(**COHORT)))
+    operations.append(("build_cohort_flow", lambda: build_cohort_flow(**COHORT)))
+
+    results: list[dict[str, Any]] = []
+    with use_database(os.path.join(workdir, f"suite_{n_samples}.db")):
+        for name, run in operations:
+            results.append({"samples": n_samples, "name": name, **_measure(run, repeats)})
+            print(f"-> {n_samples:>9} {name:<48} {results[-1]['seconds']:9.3f}s {results[-1]['peak_mb']:9.1f} MB")
+        # The report builders are measured on prepared inputs, so only rendering is timed.
+        inputs = _report_inputs()
+        pdf_inputs = {key: value for key, value in inputs.items() if key != "fig"}
+        for name, run in (
+            ("build_html_report", lambda: build_html_report(**inputs)),
+            ("build_pdf_report", lambda: build_pdf_report(**pdf_inputs)),
+        ):
+            results.append({"samples": n_samples, "name": name, **_measure(run, repeats)})
+            print(f"-> {n_samples:>9} {name:<48} {results[-1]['seconds']:9.3f}s {results[-1]['peak_mb']:9.1f} MB")
+    os.remove(csv_path)
+    return results
+
+
+def find_regressions(
+    results: list[dict[str, Any]],
+    baseline: list[dict[str, Any]],
+    tolerance: float,
+    min_seconds: float = MIN_SECONDS,
+    min_peak_mb: float = MIN_PEAK_MB,
+) -> list[str]:
+    # A measurement regresses when it exceeds the baseline by more than tolerance (a fraction) and by
+    # more than the noise floor; entries missing from either side are not compared.
+    previous = {(entry["samples"], entry["name"]): entry for entry in baseline}
+    regressions = []
+    for entry in results:
+        base = previous.get((entry["samples"], entry["name"]))
+        if base is None:
+            continue
+        for field, floor, unit in (("seconds", min_seconds, "s"), ("peak_mb", min_peak_mb, " MB")):
+            limit = base[field] * (1 + tolerance)
+            if entry[field] > limit and entry[field] - base[field] > floor:
+                regressions.append(
+                    f"{entry['name']} @ {entry['samples']} samples: {field} {base[field]:.3f}{unit} -> "
+                    f"{entry[field]:.3f}{unit} ({entry[field] / base[field] - 1:+.0%})"
+                )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Time and memory-profile ETL, analysis, statistics, queries and reporting over synthetic sizes."
+    )
+    _ = parser.add_argument("--samples", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    _ = parser.add_argument("--repeats", type=int, default=3, help="Timed runs per operation; the fastest is kept.")
+    _ = parser.add_argument(
+        "--permutation-iterations",
+        type=int,
+        default=1_000,
+        help="Iterations for the permutation test cases (the library default is 10000).",
+    )
+    _ = parser.add_argument("--output", default="bench_results.json", help="JSON file to write the results to.")
+    _ = parser.add_argument(
+        "--baseline",
+        default=BASELINE_FILE,
+        help="Results JSON to compare against (default: the committed benchmarks/baseline.json; '' to skip).",
+    )
+    _ = parser.add_argument(
+        "--tolerance", type=float, default=0.25, help="Allowed slowdown or memory growth over the baseline (fraction)."
+    )
+    args = parser.parse_args()
+
+    results: list[dict[str, Any]] = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for n_samples in args.samples:
+            results.extend(_run_size(workdir, n_samples, args.repeats, args.permutation_iterations))
+
+    document = {
+        "meta": {
+            "created_at": datetime.now(UTC).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "storage_backend": STORAGE_BACKEND,
+            "cell_count_layout": CELL_COUNT_LAYOUT,
+            "repeats": args.repeats,
+            "permutation_iterations": args.permutation_iterations,
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as handle:
+        json.dump(document, handle, indent=2)
+    print(f"\nWrote {len(results)} measurements to {args.output}.")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as handle:
+            baseline = json.load(handle)
+        if baseline["meta"].get("platform") != document["meta"]["platform"]:
+            print(f"Warning: the baseline was recorded on {baseline['meta'].get('platform')}.")
+        regressions = find_regressions(results, baseline["results"], args.tolerance)
+        if regressions:
+            print(f"\n=== {len(regressions)} regression(s) against {args.baseline} ===")
+            for line in regressions:
+                print(line)
+            sys.exit(1)
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%}).")
+
+
+if __name__ == "__main__":
+    main()
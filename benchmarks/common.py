@@ -0,0 +1,49 @@
+import os
+import time
+from collections.abc import Iterator, Sequence
+from contextlib import contextmanager
+
+import src.database
+import src.report_queue
+import src.storage
+from src.config import CELL_TYPES
+from src.synthetic import generate_cohort, write_cohort_csv
+
+
+def write_synthetic_csv(
+    path: str,
+    n_samples: int,
+    seed: int = 0,
+    populations: Sequence[str] = CELL_TYPES,
+    zero_fraction: float = 0.0,
+) -> None:
+    frames = generate_cohort(n_samples, projects=5, populations=populations, zero_fraction=zero_fraction, seed=seed)
+    _ = write_cohort_csv(path, frames)
+
+
+@contextmanager
+def use_database(path: str) -> Iterator[None]:
+    # Snapshots and the report cache move next to the benchmark database too, so a run under the
+    # parquet or matrix backend never overwrites the repository's own PARQUET_DIR / MATRIX_DIR.
+    stem = os.path.splitext(path)[0]
+    targets = [
+        (src.database, "DB_PATH", path),
+        (src.storage, "PARQUET_DIR", f"{stem}_parquet"),
+        (src.storage, "MATRIX_DIR", f"{stem}_matrix"),
+        (src.report_queue, "REPORT_CACHE_DIR", f"{stem}_reports"),
+    ]
+    previous = [(module, name, getattr(module, name)) for module, name, _ in targets]
+    for module, name, value in targets:
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for module, name, value in previous:
+            setattr(module, name, value)
+
+
+@contextmanager
+def timed(label: str, results: dict[str, float]) -> Iterator[None]:
+    started = time.perf_counter()
+    yield
+    results[label] = time.perf_counter() - started
@@ -4,6 +4,7 @@ from typing import cast
 import pandas as pd
 import plotly.express as px
 import streamlit as st
+from streamlit.delta_generator import DeltaGenerator
 
 from src.config import DB_PATH
 
@@ -13,11 +14,32 @@ if not os.path.exists(DB_PATH):
 
     load_csv_to_db()
 
-from src.analysis import get_cohort_counts, get_filter_options, get_filtered_data, get_part2_frequency_table
-from src.config import CELL_TYPES
+from src.analysis import (
+    get_cell_types,
+    get_cohort_counts,
+    get_filter_options,
+    get_filtered_data,
+    get_part2_frequency_table,
+)
 from src.queries import build_cohort_flow, get_subset_stats
-from src.reporting import build_html_report, build_pdf_report
-from src.statistics import compare_responders
+from src.report_queue import (
+    report_result,
+    report_status,
+    retry_report,
+    submit_html_report,
+    submit_pdf_report,
+)
+from src.statistics import compare_responders, compare_responders_scenarios
+
+# Wide panels (spectral flow / CyTOF) plot only the most significant populations; the stats table
+# and CSV downloads still cover every population.
+MAX_PLOTTED_POPULATIONS = 30
+REPORT_POLL_SECONDS = 0.5
+
+
+@st.cache_data(show_spinner=False)
+def cached_cell_types() -> list[str]:
+    return get_cell_types()
 
 
 @st.cache_data(show_spinner=False)
@@ -70,6 +92,23 @@ def cached_compare_responders(
     )
 
 
+@st.cache_data(show_spinner=False)
+def cached_sensitivity_scenarios(
+    condition: str,
+    treatment: str,
+    sample_type: str,
+    metric: str,
+    scenarios: tuple[tuple[str, str, str, str, str], ...],
+) -> list[tuple[pd.DataFrame, pd.DataFrame, dict[str, str]]]:
+    return compare_responders_scenarios(
+        list(scenarios),
+        condition=condition,
+        treatment=treatment,
+        sample_type=sample_type,
+        metric=metric,
+    )
+
+
 @st.cache_data(show_spinner=False)
 def cached_subset_stats(
     condition: str,
@@ -100,6 +139,43 @@ def cached_cohort_flow(
     )
 
 
+def report_slot(column: DeltaGenerator, key: str, label: str, file_name: str, mime: str) -> str:
+    status = report_status(key)
+    report = report_result(key) if status == "ready" else None
+    if report is not None:
+        column.download_button(f"Generate report ({label})", data=report, file_name=file_name, mime=mime)
+    elif status in ("ready", "pending"):
+        column.button(f"Building report ({label})...", disabled=True, key=f"{key}_pending")
+    else:
+        reason = "could not be built" if status == "failed" else "is no longer cached"
+        column.error(f"The {label} report {reason}.")
+        if column.button(f"Retry report ({label})", key=f"{key}_retry"):
+            # A failed build is resubmitted here; a report without a recorded build is resubmitted by
+            # the full rerun that restarts polling.
+            _ = retry_report(key)
+            status = "pending"
+    return status
+
+
+def report_buttons(html_key: str, pdf_key: str, polling: bool) -> None:
+    r1, r2 = st.columns(2)
+    statuses = (
+        report_slot(r1, html_key, "HTML", "analysis_report.html", "text/html"),
+        report_slot(r2, pdf_key, "PDF", "analysis_report.pdf", "application/pdf"),
+    )
+    # A full rerun registers the fragment again with or without the poll timer.
+    if ("pending" in statuses) != polling:
+        st.rerun()
+
+
+def report_downloads(html_key: str, pdf_key: str) -> None:
+    # Reports build on the queue's worker threads. While one is queued only this fragment reruns, on a
+    # timer; failed or evicted reports stop the polling and wait for a retry.
+    polling = "pending" in (report_status(html_key), report_status(pdf_key))
+    fragment = st.fragment(report_buttons, run_every=REPORT_POLL_SECONDS if polling else None)
+    fragment(html_key, pdf_key, polling)
+
+
 def to_csv_bytes(df: pd.DataFrame) -> bytes:
     return df.to_csv(index=False).encode("utf-8")
 
@@ -271,29 +347,41 @@ with tab_part3:
             mime="text/csv",
         )
 
+        # stats_df is sorted by q-value, so the head holds the most significant populations.
+        plotted_stats = stats_df.head(MAX_PLOTTED_POPULATIONS)
+        plotted_cells = set(plotted_stats["cell_type"].astype(str))
+        if len(stats_df) > MAX_PLOTTED_POPULATIONS:
+            st.caption(f"Showing the {MAX_PLOTTED_POPULATIONS} most significant of {len(stats_df)} populations.")
+        box_df = plot_df.loc[plot_df["cell_type"].astype(str).isin(plotted_cells)]
+        cell_order = [cell for cell in cached_cell_types() if cell in plotted_cells]
+
         fig = px.box(
-            plot_df,
+            box_df,
             x="cell_type",
             y="metric_value",
             color="response",
             points=point_mode,
-            category_orders={"cell_type": CELL_TYPES, "response": ["no", "yes"]},
+            category_orders={"cell_type": cell_order, "response": ["no", "yes"]},
             color_discrete_map={"yes": "#1f9d55", "no": "#d64545"},
             labels={"metric_value": metric_label, "response": "Response", "cell_type": "Cell Type"},
             title="Distribution by Response Group",
         )
 
-        max_by_cell = plot_df.groupby("cell_type")["metric_value"].max().to_dict()
-        max_global = float(plot_df["metric_value"].max()) if len(plot_df) > 0 else 0.0
+        max_by_cell = box_df.groupby("cell_type", observed=True)["metric_value"].max()
+        max_global = float(box_df["metric_value"].max()) if len(box_df) > 0 else 0.0
         offset = max(1.0, max_global * 0.08)
 
-        for _, stat_row in stats_df.iterrows():
-            cell = str(stat_row["cell_type"])
-            q_obj = stat_row["q_value"]
-            q_val = float(q_obj) if isinstance(q_obj, (int, float)) else None
-            text = f"q={q_val:.3g}" if q_val is not None else "q=NA"
-            y = float(max_by_cell.get(cell, max_global)) + offset
-            fig.add_annotation(x=cell, y=y, text=text, showarrow=False, font={"size": 11})
+        # One text trace labels every population, instead of one layout annotation per population.
+        q_values = pd.to_numeric(plotted_stats["q_value"], errors="coerce")
+        fig.add_scatter(
+            x=plotted_stats["cell_type"].astype(str),
+            y=plotted_stats["cell_type"].astype(str).map(max_by_cell).fillna(max_global).astype(float) + offset,
+            text=[f"q={q:.3g}" if pd.notna(q) else "q=NA" for q in q_values],
+            mode="text",
+            textfont={"size": 11},
+            showlegend=False,
+            hoverinfo="skip",
+        )
 
         if max_global > 0:
             fig.update_yaxes(range=[0, max_global + 2 * offset])
@@ -301,7 +389,7 @@ with tab_part3:
         st.plotly_chart(fig, use_container_width=True)
 
         flow_for_report = cached_cohort_flow(condition, treatment, sample_type, time_filter)
-        html_report = build_html_report(
+        html_key = submit_html_report(
             filters_text=active_filters_text,
             cohort_counts=cohort_counts,
             summary=summary,
@@ -309,27 +397,14 @@ with tab_part3:
             flow_df=flow_for_report,
             fig=fig,
         )
-        pdf_report = build_pdf_report(
+        pdf_key = submit_pdf_report(
             filters_text=active_filters_text,
             cohort_counts=cohort_counts,
             summary=summary,
             stats_df=stats_df,
             flow_df=flow_for_report,
         )
-
-        r1, r2 = st.columns(2)
-        r1.download_button(
-            "Generate report (HTML)",
-            data=html_report,
-            file_name="analysis_report.html",
-            mime="text/html",
-        )
-        r2.download_button(
-            "Generate report (PDF)",
-            data=pdf_report,
-            file_name="analysis_report.pdf",
-            mime="application/pdf",
-        )
+        report_downloads(html_key, pdf_key)
 
 with tab_part4:
     st.header("Baseline / Cohort Characterization")
@@ -390,10 +465,10 @@ with tab_part4:
     with st.expander("Show Query Logic"):
         st.code(
             """
-WHERE LOWER(sub.condition)=<condition>
-  AND LOWER(sub.treatment)=<treatment>
-  AND LOWER(s.sample_type)=<sample_type>
-  AND (s.visit_time=0 when Time=Baseline only)
+WHERE sub.condition_id = (SELECT id FROM dim_condition WHERE code = LOWER(<condition>))
+  AND sub.treatment_id = (SELECT id FROM dim_treatment WHERE code = LOWER(<treatment>))
+  AND s.sample_type_id = (SELECT id FROM dim_sample_type WHERE code = LOWER(<sample_type>))
+  AND (s.visit_time = 0 when Time=Baseline only)
             """.strip(),
             language="sql",
         )
@@ -411,20 +486,17 @@ with tab_sensitivity:
         ("Baseline | MW | None", "baseline_only", "mannwhitney", "none"),
     ]
 
+    scenario_results = cached_sensitivity_scenarios(
+        condition,
+        treatment,
+        sample_type,
+        metric,
+        tuple((sc_time, sc_test, sc_corr, unit, transform) for _, sc_time, sc_test, sc_corr in scenario_configs),
+    )
+
     scenario_sig: dict[str, dict[str, bool]] = {}
     scenario_q: dict[str, dict[str, float | None]] = {}
-    for label, sc_time, sc_test, sc_corr in scenario_configs:
-        s_df, _, _ = cached_compare_responders(
-            condition=condition,
-            treatment=treatment,
-            sample_type=sample_type,
-            time_filter=sc_time,
-            unit=unit,
-            metric=metric,
-            transform=transform,
-            test=sc_test,
-            correction=sc_corr,
-        )
+    for (label, _, _, _), (s_df, _, _) in zip(scenario_configs, scenario_results):
         scenario_sig[label] = {
             str(row["cell_type"]): bool(row["significant"]) for _, row in s_df.iterrows()
         }
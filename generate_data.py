@@ -0,0 +1,87 @@
+import argparse
+import time
+from collections.abc import Iterator
+
+import pandas as pd
+
+from load_data import load_frames_to_db
+from src.config import CELL_TYPES
+from src.database import CELL_COUNT_LAYOUTS
+from src.synthetic import (
+    DEFAULT_CHUNK_SAMPLES,
+    DEFAULT_VISITS,
+    generate_cohort,
+    population_names,
+    write_cohort_csv,
+)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate a synthetic cohort in the cell-count.csv schema.")
+    _ = parser.add_argument("--samples", type=int, required=True, help="Number of samples (CSV rows).")
+    _ = parser.add_argument("--output", default=None, help="CSV path to write.")
+    _ = parser.add_argument(
+        "--load",
+        action="store_true",
+        help="Stream the generated chunks straight into the SQLite database instead of (or as well as) a CSV.",
+    )
+    _ = parser.add_argument("--projects", type=int, default=3)
+    _ = parser.add_argument(
+        "--visits",
+        type=int,
+        nargs="+",
+        default=list(DEFAULT_VISITS),
+        help="Days from treatment start of each subject's samples; one sample per visit.",
+    )
+    _ = parser.add_argument(
+        "--populations",
+        type=int,
+        default=len(CELL_TYPES),
+        help="Panel width: the bundled populations first, then gated_NNN populations.",
+    )
+    _ = parser.add_argument("--response-rate", type=float, default=0.5, help="Share of treated subjects responding.")
+    _ = parser.add_argument(
+        "--effect-size",
+        type=float,
+        default=0.0,
+        help="Log fold change of the effect populations' share in responders.",
+    )
+    _ = parser.add_argument(
+        "--effect-populations",
+        nargs="+",
+        default=None,
+        help="Populations shifted in responders (default: the first population).",
+    )
+    _ = parser.add_argument("--zero-fraction", type=float, default=0.0, help="Share of counts set to zero.")
+    _ = parser.add_argument("--chunk-samples", type=int, default=DEFAULT_CHUNK_SAMPLES)
+    _ = parser.add_argument("--seed", type=int, default=0)
+    _ = parser.add_argument("--bulk", action="store_true", help="With --load: use the bulk-load path.")
+    _ = parser.add_argument("--layout", choices=CELL_COUNT_LAYOUTS, default=None, help="With --load: storage layout.")
+    args = parser.parse_args()
+    if args.output is None and not args.load:
+        parser.error("pass --output, --load or both")
+
+    def frames() -> Iterator[pd.DataFrame]:
+        return generate_cohort(
+            args.samples,
+            projects=args.projects,
+            visits=args.visits,
+            populations=population_names(args.populations),
+            response_rate=args.response_rate,
+            effect_size=args.effect_size,
+            effect_populations=args.effect_populations,
+            zero_fraction=args.zero_fraction,
+            chunk_samples=args.chunk_samples,
+            seed=args.seed,
+        )
+
+    if args.output:
+        started = time.perf_counter()
+        n_rows = write_cohort_csv(args.output, frames())
+        print(f"Wrote {n_rows} samples to {args.output} in {time.perf_counter() - started:.1f}s.")
+    if args.load:
+        _ = load_frames_to_db(frames(), bulk=args.bulk, layout=args.layout)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,100 +1,585 @@
+import argparse
+import glob
+import itertools
 import os
+import sqlite3
+import time
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import cast
 
+import numpy as np
 import pandas as pd
 
-from src.config import CELL_TYPES, CSV_FILE
-from src.database import get_db_connection, init_db
+from src.analysis import load_sqlite_count_matrix, load_sqlite_frequency_data
+from src.config import CSV_FILE, WIDE_PANEL_MIN_POPULATIONS
+from src.database import (
+    CELL_COUNT_LAYOUTS,
+    DIMENSIONS,
+    add_wide_count_columns,
+    bump_data_version,
+    cell_count_layout,
+    configure_bulk_load,
+    end_bulk_load,
+    finish_bulk_load,
+    init_db,
+    migrate_cell_count_layout,
+    writer_connection,
+)
+from src.storage import (
+    remove_snapshot,
+    snapshot_errors,
+    storage_backend,
+    write_count_snapshot,
+    write_frequency_snapshot,
+)
 
+SUBJECT_COLUMNS = {
+    "subject": "subject_id",
+    "project": "project_id",
+    "condition": "condition",
+    "age": "age",
+    "sex": "sex",
+    "treatment": "treatment",
+    "response": "response",
+}
 
-def load_csv_to_db() -> None:
-    if not os.path.exists(CSV_FILE):
-        print(f"Error: {CSV_FILE} not found.")
-        return
+SAMPLE_COLUMNS = {
+    "sample": "sample_id",
+    "project": "project_id",
+    "subject": "subject_id",
+    "time_from_treatment_start": "visit_time",
+    "sample_type": "sample_type",
+}
 
-    print(f"Reading data from {CSV_FILE}...")
-    df = pd.read_csv(CSV_FILE)
 
-    init_db()
-    conn = get_db_connection()
+# Column names of the subjects table, with dimension attributes stored as lookup-table keys.
+SUBJECT_DB_COLUMNS = [f"{column}_id" if column in DIMENSIONS else column for column in SUBJECT_COLUMNS.values()]
 
-    try:
-        print("Processing Subjects...")
-        subject_cols = {
-            "subject": "subject_id",
-            "project": "project_id",
-            "condition": "condition",
-            "age": "age",
-            "sex": "sex",
-            "treatment": "treatment",
-            "response": "response",
+
+def population_columns(df: pd.DataFrame) -> list[str]:
+    # Every numeric column that is not subject/sample metadata is a gated population, so panels of any
+    # width (5 hand-gated populations or hundreds from spectral flow / CyTOF) load without configuration.
+    metadata = set(SUBJECT_COLUMNS) | set(SAMPLE_COLUMNS)
+    return [
+        str(column)
+        for column in df.columns
+        if column not in metadata and pd.api.types.is_numeric_dtype(df[column])
+    ]
+
+
+def _records(df: pd.DataFrame) -> list[tuple[object, ...]]:
+    # Series.tolist() yields native Python scalars, which sqlite3 can bind (NaN is stored as NULL).
+    return list(zip(*(df[column].tolist() for column in df.columns)))
+
+
+def _prepare_chunk(df: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    subjects_df = df.loc[:, list(SUBJECT_COLUMNS.keys())].rename(columns=SUBJECT_COLUMNS)
+    subjects_df = subjects_df.drop_duplicates(subset=["project_id", "subject_id"])
+
+    samples_df = df.loc[:, list(SAMPLE_COLUMNS.keys())].rename(columns=SAMPLE_COLUMNS)
+    samples_df = samples_df.drop_duplicates(subset=["sample_id"])
+
+    # Sample-major order keeps inserts into the (sample_id, cell_type) unique index near-sequential.
+    # Empty cells mean the population was not measured for that sample and produce no row.
+    populations = population_columns(df)
+    counts = df.loc[:, populations].to_numpy(dtype=float).ravel()
+    measured = ~np.isnan(counts)
+    counts_df = pd.DataFrame(
+        {
+            "sample_id": np.repeat(df["sample"].to_numpy(), len(populations))[measured],
+            "cell_type": np.tile(np.array(populations, dtype=object), len(df))[measured],
+            "count": counts[measured].astype("int64"),
         }
-        subjects_df = df.loc[:, list(subject_cols.keys())].copy()
-        subjects_df.columns = [subject_cols[column] for column in subjects_df.columns]
-        subjects_df = subjects_df.drop_duplicates(subset=["project_id", "subject_id"])
+    )
+
+    return subjects_df, samples_df, counts_df
+
+
+def _encode_dimension(conn: sqlite3.Connection, dimension: str, values: pd.Series) -> pd.Series:
+    # Factorizing first means only the handful of distinct spellings in the chunk touch SQLite;
+    # missing values keep the -1 sentinel and map to NULL.
+    codes, uniques = pd.factorize(values)
+    labels = [str(value) for value in uniques]
+    _ = conn.executemany(
+        f"INSERT INTO dim_{dimension} (code, label) VALUES (?, ?) ON CONFLICT (code) DO NOTHING",
+        [(label.lower(), label) for label in labels],
+    )
+    lookup = dict(conn.execute(f"SELECT code, id FROM dim_{dimension}").fetchall())
+    ids = np.array([lookup[label.lower()] for label in labels] + [None], dtype=object)
+    return pd.Series(ids[codes], index=values.index, dtype=object)
+
+
+def _encode_dimensions(conn: sqlite3.Connection, df: pd.DataFrame) -> pd.DataFrame:
+    encoded = df.copy()
+    for column in df.columns:
+        if column in DIMENSIONS:
+            encoded[column] = _encode_dimension(conn, column, df[column])
+    return encoded.rename(columns={column: f"{column}_id" for column in DIMENSIONS})
+
+
+def _new_report() -> dict[str, dict[str, int]]:
+    return {
+        table: {"inserted": 0, "updated": 0, "skipped": 0}
+        for table in ("subjects", "samples", "cell_counts")
+    }
+
+
+def _stage_keys(conn: sqlite3.Connection, table: str, keys_df: pd.DataFrame) -> None:
+    columns = ", ".join(keys_df.columns)
+    _ = conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS {table} ({columns})")
+    _ = conn.execute(f"DELETE FROM {table}")
+    _ = conn.executemany(
+        f"INSERT INTO {table} ({columns}) VALUES ({', '.join('?' for _ in keys_df.columns)})",
+        _records(keys_df),
+    )
+
 
-        conn.execute("DELETE FROM cell_counts")
-        conn.execute("DELETE FROM samples")
-        conn.execute("DELETE FROM subjects")
+def _existing_subjects(conn: sqlite3.Connection, keys_df: pd.DataFrame) -> pd.DataFrame:
+    _stage_keys(conn, "incoming_subject_keys", keys_df)
+    query = f"""
+    SELECT sub.subject_pk, {", ".join(f"sub.{column}" for column in SUBJECT_DB_COLUMNS)}
+    FROM incoming_subject_keys k
+    JOIN subjects sub ON sub.project_id = k.project_id AND sub.subject_id = k.subject_id
+    """
+    return pd.read_sql_query(query, conn)
 
-        subjects_df.to_sql("subjects", conn, if_exists="append", index=False)
-        print(f"-> Loaded {len(subjects_df)} subjects.")
 
-        subject_keys = pd.read_sql_query(
+def _existing_sample_ids(conn: sqlite3.Connection, sample_ids: pd.Series) -> set[str]:
+    _stage_keys(conn, "incoming_sample_ids", sample_ids.to_frame("sample_id"))
+    rows = conn.execute(
+        "SELECT s.sample_id FROM incoming_sample_ids k JOIN samples s ON s.sample_id = k.sample_id"
+    ).fetchall()
+    return {row[0] for row in rows}
+
+
+def _upsert_existing_subjects(
+    conn: sqlite3.Connection,
+    candidates: pd.DataFrame,
+    subject_keys: dict[tuple[str, str], int],
+    report: dict[str, dict[str, int]],
+) -> pd.DataFrame:
+    existing = _existing_subjects(conn, candidates.loc[:, ["project_id", "subject_id"]])
+    if len(existing) == 0:
+        return candidates
+
+    merged = candidates.merge(existing, on=["project_id", "subject_id"], how="left", suffixes=("", "_db"))
+    found = merged["subject_pk"].notna()
+    attributes = [column for column in SUBJECT_DB_COLUMNS if column not in {"project_id", "subject_id"}]
+    unchanged = pd.Series(True, index=merged.index)
+    for column in attributes:
+        incoming = merged[column]
+        stored = merged[f"{column}_db"]
+        unchanged &= (incoming == stored) | (incoming.isna() & stored.isna())
+
+    changed = merged.loc[found & ~unchanged]
+    _ = conn.executemany(
+        f"""
+        UPDATE subjects
+        SET {", ".join(f"{column} = ?" for column in attributes)}
+        WHERE subject_pk = ?
+        """,
+        _records(changed.loc[:, [*attributes, "subject_pk"]].astype({"subject_pk": int})),
+    )
+    report["subjects"]["updated"] += len(changed)
+    report["subjects"]["skipped"] += int((found & unchanged).sum())
+
+    matched = merged.loc[found]
+    subject_keys.update(
+        zip(
+            zip(matched["project_id"].tolist(), matched["subject_id"].tolist()),
+            matched["subject_pk"].astype(int).tolist(),
+        )
+    )
+    return cast(pd.DataFrame, candidates.loc[~found.to_numpy()])
+
+
+def _write_chunk(
+    conn: sqlite3.Connection,
+    subjects_df: pd.DataFrame,
+    samples_df: pd.DataFrame,
+    counts_df: pd.DataFrame,
+    subject_keys: dict[tuple[str, str], int],
+    report: dict[str, dict[str, int]],
+    *,
+    incremental: bool = False,
+) -> None:
+    is_unseen = [
+        key not in subject_keys
+        for key in zip(subjects_df["project_id"].tolist(), subjects_df["subject_id"].tolist())
+    ]
+    new_subjects = _encode_dimensions(conn, subjects_df.loc[is_unseen])
+    if incremental and len(new_subjects) > 0:
+        new_subjects = _upsert_existing_subjects(conn, new_subjects, subject_keys, report)
+
+    # Honour AUTOINCREMENT's high-water mark so keys of deleted subjects are never reused.
+    next_pk = int(
+        conn.execute(
+            """
+            SELECT MAX(
+                COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'subjects'), 0),
+                COALESCE((SELECT MAX(subject_pk) FROM subjects), 0)
+            ) + 1
             """
-            SELECT subject_pk, project_id, subject_id
-            FROM subjects
-            """,
-            conn,
+        ).fetchone()[0]
+    )
+    new_subjects = new_subjects.copy()
+    new_subjects.insert(0, "subject_pk", range(next_pk, next_pk + len(new_subjects)))
+    _ = conn.executemany(
+        """
+        INSERT INTO subjects (subject_pk, subject_id, project_id, condition_id, age, sex_id, treatment_id, response_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        _records(new_subjects.loc[:, ["subject_pk", *SUBJECT_DB_COLUMNS]]),
+    )
+    subject_keys.update(
+        zip(
+            zip(new_subjects["project_id"].tolist(), new_subjects["subject_id"].tolist()),
+            new_subjects["subject_pk"].tolist(),
         )
+    )
+    report["subjects"]["inserted"] += len(new_subjects)
 
-        print("Processing Samples...")
-        sample_cols = {
-            "sample": "sample_id",
-            "project": "project_id",
-            "subject": "subject_id",
-            "time_from_treatment_start": "visit_time",
-            "sample_type": "sample_type",
-        }
-        samples_df = df.loc[:, list(sample_cols.keys())].copy()
-        samples_df.columns = [sample_cols[column] for column in samples_df.columns]
-        samples_df = samples_df.drop_duplicates(subset=["sample_id"])
-
-        samples_df = samples_df.merge(
-            subject_keys,
-            on=["project_id", "subject_id"],
-            how="left",
-            validate="many_to_one",
+    if incremental:
+        known_samples = _existing_sample_ids(conn, samples_df["sample_id"])
+        is_known_sample = samples_df["sample_id"].isin(known_samples)
+        is_known_count = counts_df["sample_id"].isin(known_samples)
+        report["samples"]["skipped"] += int(is_known_sample.sum())
+        report["cell_counts"]["skipped"] += int(is_known_count.sum())
+        samples_df = samples_df.loc[~is_known_sample]
+        counts_df = counts_df.loc[~is_known_count]
+
+    subject_pks = [
+        subject_keys.get(key)
+        for key in zip(samples_df["project_id"].tolist(), samples_df["subject_id"].tolist())
+    ]
+    missing = sum(pk is None for pk in subject_pks)
+    if missing:
+        raise ValueError(f"Missing subject mapping for {missing} sample rows")
+
+    samples_out = _encode_dimensions(conn, samples_df.loc[:, ["sample_id", "visit_time", "sample_type"]])
+    samples_out.insert(1, "subject_pk", subject_pks)
+    _ = conn.executemany(
+        "INSERT INTO samples (sample_id, subject_pk, visit_time, sample_type_id) VALUES (?, ?, ?, ?)",
+        _records(samples_out),
+    )
+    report["samples"]["inserted"] += len(samples_out)
+
+    counts_out = _encode_dimensions(conn, counts_df.loc[:, ["sample_id", "cell_type", "count"]])
+    if cell_count_layout(conn) == "wide":
+        _insert_sample_counts(conn, counts_out)
+    else:
+        _ = conn.executemany(
+            "INSERT INTO cell_counts (sample_id, cell_type_id, count) VALUES (?, ?, ?)",
+            _records(counts_out),
+        )
+    report["cell_counts"]["inserted"] += len(counts_df)
+
+
+def _insert_sample_counts(conn: sqlite3.Connection, counts_df: pd.DataFrame) -> None:
+    # Pivot the long rows to one row per sample; pivot rejects duplicate (sample, cell type) pairs
+    # just as the long layout's UNIQUE constraint does. Absent cell types are stored as NULL.
+    wide = counts_df.astype({"cell_type_id": "int64"}).pivot(index="sample_id", columns="cell_type_id", values="count")
+    add_wide_count_columns(conn, wide.columns.tolist())
+    totals = wide.sum(axis=1).astype("int64")
+    wide.columns = [f"c{cell_type_id}" for cell_type_id in wide.columns]
+    wide.insert(0, "total_count", totals)
+    rows = wide.reset_index()
+    _ = conn.executemany(
+        f"INSERT INTO sample_counts ({', '.join(rows.columns)}) VALUES ({', '.join('?' for _ in rows.columns)})",
+        _records(rows),
+    )
+
+
+def _print_report(report: dict[str, dict[str, int]]) -> None:
+    for table, counts in report.items():
+        print(
+            f"-> {table}: {counts['inserted']} inserted, {counts['updated']} updated, "
+            f"{counts['skipped']} skipped."
         )
-        if samples_df["subject_pk"].isna().any():
-            missing = int(samples_df["subject_pk"].isna().sum())
-            raise ValueError(f"Missing subject mapping for {missing} sample rows")
 
-        samples_df = samples_df.loc[:, ["sample_id", "subject_pk", "visit_time", "sample_type"]].copy()
-        samples_df["subject_pk"] = samples_df["subject_pk"].astype(int)
 
-        samples_df.to_sql("samples", conn, if_exists="append", index=False)
-        print(f"-> Loaded {len(samples_df)} samples.")
+def _panel_layout(header: pd.DataFrame, layout: str | None, incremental: bool) -> str | None:
+    # A rebuild of a high-dimensional panel defaults to the wide layout: one row per sample instead of
+    # one per (sample, population), and a zero count costs a single byte of row header.
+    if layout is not None or incremental:
+        return layout
+    return "wide" if len(population_columns(header)) >= WIDE_PANEL_MIN_POPULATIONS else None
 
-        print("Processing Cell Counts...")
-        counts_df = df.melt(
-            id_vars=["sample"],
-            value_vars=CELL_TYPES,
-            var_name="cell_type",
-            value_name="count",
-        ).rename(columns={"sample": "sample_id"})
 
-        counts_df.to_sql("cell_counts", conn, if_exists="append", index=False)
-        print(f"-> Loaded {len(counts_df)} cell count records.")
+@contextmanager
+def _open_writer(incremental: bool, bulk: bool, layout: str | None) -> Iterator[sqlite3.Connection]:
+    # A bulk rebuild creates the secondary indexes once after the data is in, instead of
+    # maintaining them row by row on every insert.
+    init_db(reset=not incremental, defer_indexes=bulk and not incremental, layout=layout)
+    with writer_connection() as conn:
+        if bulk:
+            configure_bulk_load(conn)
+        yield conn
 
-        conn.commit()
-        print("Data ingestion complete successfully.")
 
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        conn.rollback()
+def _write_snapshot() -> None:
+    # SQLite stays the system of record (upserts, constraints); the Parquet dataset or count matrix
+    # is a read-optimized snapshot of the loaded counts, rewritten after each load.
+    backend = storage_backend()
+    if backend == "matrix":
+        write_count_snapshot(*load_sqlite_count_matrix())
+    elif backend == "parquet":
+        write_frequency_snapshot(load_sqlite_frequency_data())
+
+
+def _commit_load(conn: sqlite3.Connection, bulk: bool) -> None:
+    if bulk:
+        finish_bulk_load(conn)
+    _ = bump_data_version(conn)
+    conn.commit()
+    if bulk:
+        # Before the snapshot export opens a reader on the database, which would keep it in WAL mode.
+        end_bulk_load(conn)
+    try:
+        _write_snapshot()
+    except snapshot_errors() as e:
+        # The load is already committed. Dropping the now stale snapshot sends reads back to SQLite
+        # until the next successful export, instead of serving data the database no longer holds.
+        remove_snapshot()
+        print(f"Snapshot export failed, reads fall back to SQLite: {e}")
+    except BaseException:
+        # Any other error is a bug and propagates, but the stale snapshot is dropped either way.
+        remove_snapshot()
+        raise
+    print("Data ingestion complete successfully.")
+
+
+def _resolve_csv_paths(source: str) -> list[str]:
+    pattern = os.path.join(source, "*.csv") if os.path.isdir(source) else source
+    return sorted(glob.glob(pattern))
+
+
+ParsedFile = tuple[tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame], int, float]
+
+
+def _parse_csv_file(csv_path: str) -> ParsedFile:
+    started = time.perf_counter()
+    df = pd.read_csv(csv_path)
+    prepared = _prepare_chunk(df)
+    return prepared, len(df), time.perf_counter() - started
+
+
+@contextmanager
+def _parser_pool(workers: int | None) -> Iterator[ProcessPoolExecutor | None]:
+    if workers == 1:
+        yield None
+        return
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        yield pool
     finally:
-        conn.close()
+        # Files still queued when the load stops are dropped instead of parsed for nothing.
+        pool.shutdown(cancel_futures=True)
+
+
+def _parse_in_order(pool: ProcessPoolExecutor | None, csv_paths: list[str], window: int) -> Iterator[ParsedFile]:
+    # At most `window` files are parsed ahead of the writer, so prepared frames never pile up in this
+    # process when parsing outpaces the single SQLite writer; each consumed result frees a slot.
+    if pool is None:
+        yield from map(_parse_csv_file, csv_paths)
+        return
+    pending: deque[Future[ParsedFile]] = deque()
+    for csv_path in csv_paths:
+        pending.append(pool.submit(_parse_csv_file, csv_path))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def load_csv_to_db(
+    csv_path: str = CSV_FILE,
+    chunksize: int | None = None,
+    incremental: bool = False,
+    bulk: bool = False,
+    layout: str | None = None,
+) -> dict[str, dict[str, int]] | None:
+    if not os.path.exists(csv_path):
+        print(f"Error: {csv_path} not found.")
+        return None
+
+    print(f"Reading data from {csv_path}...")
+    # In streaming mode only one chunk of the CSV is held in memory at a time; subject keys are
+    # resolved incrementally through an in-memory (project_id, subject_id) -> subject_pk map.
+    chunks: Iterable[pd.DataFrame] = (
+        pd.read_csv(csv_path, chunksize=chunksize) if chunksize else [pd.read_csv(csv_path)]
+    )
+    layout = _panel_layout(pd.read_csv(csv_path, nrows=100), layout, incremental)
+    return _load_chunks(chunks, incremental, bulk, layout, progress=bool(chunksize))
+
+
+def load_frames_to_db(
+    frames: Iterable[pd.DataFrame],
+    incremental: bool = False,
+    bulk: bool = False,
+    layout: str | None = None,
+) -> dict[str, dict[str, int]] | None:
+    # Frames in the cell-count.csv schema (e.g. from src.synthetic) are loaded as they arrive,
+    # without a CSV round trip.
+    iterator = iter(frames)
+    first = next(iterator, None)
+    if first is None:
+        print("Error: no rows to load.")
+        return None
+    layout = _panel_layout(first, layout, incremental)
+    return _load_chunks(itertools.chain([first], iterator), incremental, bulk, layout, progress=True)
+
+
+def _load_chunks(
+    chunks: Iterable[pd.DataFrame],
+    incremental: bool,
+    bulk: bool,
+    layout: str | None,
+    progress: bool,
+) -> dict[str, dict[str, int]] | None:
+    # Incremental loads keep existing rows: subjects are upserted on (project_id, subject_id) and
+    # only unseen sample_ids (with their cell counts) are inserted, so cost tracks the delta.
+    with _open_writer(incremental, bulk, layout) as conn:
+        try:
+            subject_keys: dict[tuple[str, str], int] = {}
+            report = _new_report()
+            for chunk_idx, chunk in enumerate(chunks, start=1):
+                _write_chunk(conn, *_prepare_chunk(chunk), subject_keys, report, incremental=incremental)
+                if progress:
+                    print(f"-> Chunk {chunk_idx}: {len(chunk)} rows ({report['samples']['inserted']} samples so far).")
+
+            _print_report(report)
+
+            _commit_load(conn, bulk)
+            return report
+
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            conn.rollback()
+            return None
+
+
+def load_csv_files(
+    source: str,
+    workers: int | None = None,
+    incremental: bool = False,
+    bulk: bool = False,
+    layout: str | None = None,
+) -> list[dict[str, object]] | None:
+    csv_paths = _resolve_csv_paths(source)
+    if not csv_paths:
+        print(f"Error: no CSV files match {source}.")
+        return None
+
+    print(f"Loading {len(csv_paths)} CSV files from {source}...")
+
+    header = pd.read_csv(csv_paths[0], nrows=100)
+    with _open_writer(incremental, bulk, _panel_layout(header, layout, incremental)) as conn:
+        try:
+            # Files are parsed and reshaped in worker processes; the prepared batches are funnelled to
+            # this single writer connection in path order, so subject keys are assigned deterministically.
+            with _parser_pool(workers) as pool:
+                window = 2 * (workers or os.cpu_count() or 1)
+                subject_keys: dict[tuple[str, str], int] = {}
+                totals = _new_report()
+                file_reports: list[dict[str, object]] = []
+                for csv_path, (prepared, n_rows, parse_seconds) in zip(
+                    csv_paths, _parse_in_order(pool, csv_paths, window)
+                ):
+                    started = time.perf_counter()
+                    report = _new_report()
+                    _write_chunk(conn, *prepared, subject_keys, report, incremental=incremental)
+                    write_seconds = time.perf_counter() - started
+
+                    for table, counts in report.items():
+                        for outcome, value in counts.items():
+                            totals[table][outcome] += value
+                    file_reports.append(
+                        {
+                            "file": csv_path,
+                            "rows": n_rows,
+                            "parse_seconds": parse_seconds,
+                            "write_seconds": write_seconds,
+                            **report,
+                        }
+                    )
+                    print(
+                        f"-> {os.path.basename(csv_path)}: {n_rows} rows | parse {parse_seconds:.2f}s | "
+                        f"write {write_seconds:.2f}s | {report['samples']['inserted']} samples inserted"
+                    )
+
+            _print_report(totals)
+
+            _commit_load(conn, bulk)
+            return file_reports
+
+        except Exception as e:
+            print(f"An error occurred: {e}")
+            conn.rollback()
+            return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load a cell-count CSV into the SQLite database.")
+    _ = parser.add_argument("--csv", default=CSV_FILE, help="Path to the cell-count CSV file.")
+    _ = parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=None,
+        help="Stream the CSV in chunks of this many rows to keep memory flat for very large files.",
+    )
+    _ = parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Upsert subjects and insert only new samples instead of rebuilding the database.",
+    )
+    _ = parser.add_argument(
+        "--files",
+        default=None,
+        help="Directory or glob of per-project CSV files to parse in parallel (overrides --csv).",
+    )
+    _ = parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of parser processes for --files (default: one per CPU).",
+    )
+    _ = parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="Use write-optimized pragmas (WAL, large cache), build indexes after the load and ANALYZE.",
+    )
+    _ = parser.add_argument(
+        "--layout",
+        choices=CELL_COUNT_LAYOUTS,
+        default=None,
+        help="Cell-count storage layout for a rebuild (default: CELL_COUNT_LAYOUT in src/config.py).",
+    )
+    _ = parser.add_argument(
+        "--migrate-layout",
+        choices=CELL_COUNT_LAYOUTS,
+        default=None,
+        help="Convert the existing database's cell counts to this layout instead of loading a CSV.",
+    )
+    args = parser.parse_args()
+    if args.migrate_layout:
+        migrate_cell_count_layout(args.migrate_layout)
+    elif args.files:
+        _ = load_csv_files(
+            args.files, workers=args.workers, incremental=args.incremental, bulk=args.bulk, layout=args.layout
+        )
+    else:
+        _ = load_csv_to_db(
+            args.csv,
+            chunksize=args.chunksize,
+            incremental=args.incremental,
+            bulk=args.bulk,
+            layout=args.layout,
+        )
 
 
 if __name__ == "__main__":
-    load_csv_to_db()
+    main()
@@ -1,10 +1,23 @@
+import itertools
 import json
 from pathlib import Path
 from typing import cast
 
+import pandas as pd
+
 from src.analysis import get_part2_frequency_table
 from src.queries import get_subset_stats
-from src.statistics import compare_responders
+from src.statistics import compare_responders, compare_responders_scenarios
+
+SENSITIVITY_GRID = list(
+    itertools.product(
+        ["baseline_only", "all"],
+        ["mannwhitney", "welch_t"],
+        ["bh_fdr", "none"],
+        ["subject", "sample"],
+        ["none", "clr"],
+    )
+)
 
 
 def main() -> None:
@@ -70,6 +83,28 @@ def main() -> None:
     if significant_count == 0:
         print("-> No significant populations found at q<0.05.")
 
+    print(f"\n=== Part 3: Sensitivity Grid ({len(SENSITIVITY_GRID)} scenarios) ===")
+    scenario_frames = []
+    for (time_filter, test, correction, unit, transform), (scenario_df, _, _) in zip(
+        SENSITIVITY_GRID,
+        compare_responders_scenarios(SENSITIVITY_GRID),
+    ):
+        scenario_frames.append(
+            scenario_df.assign(
+                time_filter=time_filter,
+                test=test,
+                correction=correction,
+                unit=unit,
+                transform=transform,
+            )
+        )
+    sensitivity_df = pd.concat(scenario_frames, ignore_index=True)
+    sensitivity_df.to_csv(output_dir / "part3_sensitivity.csv", index=False)
+    if len(sensitivity_df) > 0:
+        robustness = sensitivity_df.groupby("cell_type")["significant"].sum().astype(int)
+        for cell_type, n_significant in robustness.sort_values(ascending=False).items():
+            print(f"{cell_type}: significant in {n_significant}/{len(SENSITIVITY_GRID)} scenarios")
+
     part4 = get_subset_stats(
         condition="melanoma",
         treatment="miraclib",
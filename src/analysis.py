@@ -1,49 +1,262 @@
+import sqlite3
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
 from typing import cast
 
 import numpy as np
 import pandas as pd
+from scipy import sparse
 
-from src.database import get_db_connection
+from src.database import cell_count_layout, read_connection, wide_count_columns
+from src.matrix_cache import (
+    MISSING_COUNT,
+    SAMPLE_COLUMNS,
+    cohort_rows,
+    count_matrix_from_frame,
+    sample_frame,
+)
+from src.storage import (
+    data_version,
+    get_count_matrix,
+    read_frequency_snapshot,
+    uses_count_matrix,
+    uses_snapshot,
+)
 
+_FRAME_CACHE_SIZE = 16
+_frame_cache: OrderedDict[Hashable, tuple[tuple[str, int, int], pd.DataFrame]] = OrderedDict()
+_frame_cache_lock = threading.Lock()
 
-def get_cell_frequency_data() -> pd.DataFrame:
-    conn = get_db_connection()
-    query = """
-    SELECT
-        s.sample_id,
-        sub.subject_pk,
-        sub.subject_id,
-        sub.project_id,
-        sub.treatment,
-        sub.response,
-        sub.condition,
-        sub.sex,
-        s.sample_type,
-        s.visit_time,
-        c.cell_type,
-        c.count
-    FROM samples s
-    JOIN subjects sub ON s.subject_pk = sub.subject_pk
-    JOIN cell_counts c ON s.sample_id = c.sample_id
-    """
-
-    df = cast(pd.DataFrame, pd.read_sql_query(query, conn))
-    conn.close()
-
-    df["total_count"] = df.groupby("sample_id")["count"].transform("sum")
+
+_FREQUENCY_QUERY = """
+SELECT
+    s.sample_id,
+    sub.subject_pk,
+    sub.subject_id,
+    sub.project_id,
+    tr.label AS treatment,
+    rs.label AS response,
+    co.label AS condition,
+    sx.label AS sex,
+    st.label AS sample_type,
+    s.visit_time,
+    ct.label AS cell_type,
+    c.count
+FROM samples s
+JOIN subjects sub ON s.subject_pk = sub.subject_pk
+JOIN cell_counts c ON s.sample_id = c.sample_id
+JOIN dim_condition co ON co.id = sub.condition_id
+JOIN dim_treatment tr ON tr.id = sub.treatment_id
+JOIN dim_sample_type st ON st.id = s.sample_type_id
+JOIN dim_cell_type ct ON ct.id = c.cell_type_id
+LEFT JOIN dim_sex sx ON sx.id = sub.sex_id
+LEFT JOIN dim_response rs ON rs.id = sub.response_id
+"""
+
+# Wide layout: one sample_counts row per sample with a precomputed total, so no per-sample regrouping.
+_WIDE_FREQUENCY_QUERY = """
+SELECT
+    s.sample_id,
+    sub.subject_pk,
+    sub.subject_id,
+    sub.project_id,
+    tr.label AS treatment,
+    rs.label AS response,
+    co.label AS condition,
+    sx.label AS sex,
+    st.label AS sample_type,
+    s.visit_time,
+    w.total_count{count_columns}
+FROM samples s
+JOIN subjects sub ON s.subject_pk = sub.subject_pk
+JOIN sample_counts w ON s.sample_id = w.sample_id
+JOIN dim_condition co ON co.id = sub.condition_id
+JOIN dim_treatment tr ON tr.id = sub.treatment_id
+JOIN dim_sample_type st ON st.id = s.sample_type_id
+LEFT JOIN dim_sex sx ON sx.id = sub.sex_id
+LEFT JOIN dim_response rs ON rs.id = sub.response_id
+"""
+
+_FILTER_COLUMNS = {
+    "condition": "sub.condition_id",
+    "treatment": "sub.treatment_id",
+    "sample_type": "s.sample_type_id",
+}
+
+
+# Repeated labels become categoricals: one copy of each label plus an integer code per row.
+_CATEGORY_COLUMNS = ["project_id", "treatment", "response", "condition", "sex", "sample_type", "cell_type"]
+_INTEGER_COLUMNS = {"subject_pk": "int32", "visit_time": "int16", "count": "int32", "total_count": "int32"}
+
+
+def _cohort_where_clause(
+    condition: str,
+    treatment: str,
+    sample_type: str,
+    time_filter: str,
+) -> tuple[str, list[str | float]]:
+    clauses: list[str] = []
+    params: list[str | float] = []
+
+    for column, value in (("condition", condition), ("treatment", treatment), ("sample_type", sample_type)):
+        if not value or value == "all":
+            continue
+        # The lookup tables hold lower-cased codes, so a case-insensitive filter becomes an equality
+        # on an indexed integer key; an unknown value yields NULL and matches nothing.
+        clauses.append(f"{_FILTER_COLUMNS[column]} = (SELECT id FROM dim_{column} WHERE code = ?)")
+        params.append(value.lower())
+
+    if time_filter == "baseline_only":
+        clauses.append("s.visit_time = ?")
+        params.append(0.0)
+
+    if not clauses:
+        return "", params
+    return "WHERE " + " AND ".join(clauses), params
+
+
+def unpivot_wide_counts(wide: pd.DataFrame, count_columns: dict[str, str]) -> pd.DataFrame:
+    # One long row per measured (sample, cell type); NULL cells (cell types a sample was never
+    # measured for) are dropped rather than read as zero. Other columns are repeated per row.
+    counts = wide.loc[:, list(count_columns)].to_numpy(dtype=float).ravel()
+    present = ~np.isnan(counts)
+    rows = np.repeat(np.arange(len(wide)), len(count_columns))[present]
+    keep = [column for column in wide.columns if column not in count_columns]
+    # Drop the count columns before repeating rows, or every repeated row would copy the whole panel.
+    df = cast(pd.DataFrame, wide.loc[:, keep].iloc[rows].reset_index(drop=True))
+    cell_type_codes = np.tile(np.arange(len(count_columns)), len(wide))[present]
+    df["cell_type"] = pd.Categorical.from_codes(cell_type_codes, categories=list(count_columns.values()))
+    df["count"] = counts[present].astype("int64")
+    return df
+
+
+def _read_wide_samples(
+    conn: sqlite3.Connection, where: str, params: list[str | float]
+) -> tuple[pd.DataFrame, dict[str, str]]:
+    count_columns = wide_count_columns(conn)
+    query = _WIDE_FREQUENCY_QUERY.format(count_columns="".join(f", w.{column}" for column in count_columns))
+    wide = cast(pd.DataFrame, pd.read_sql_query(f"{query} {where}", conn, params=params))
+    # Labels are categorized once per sample, so unpivoting repeats integer codes rather than strings.
+    for column in _CATEGORY_COLUMNS:
+        if column in wide.columns:
+            wide[column] = _categorical(wide[column], lower=column == "response")
+    return wide, count_columns
+
+
+def _read_wide_counts(conn: sqlite3.Connection, where: str, params: list[str | float]) -> pd.DataFrame:
+    df = unpivot_wide_counts(*_read_wide_samples(conn, where, params))
+    df["total_count"] = df.pop("total_count")
+    return df
+
+
+def _read_frequency_frame(conn: sqlite3.Connection, where: str = "", params: list[str | float] | None = None) -> pd.DataFrame:
+    if cell_count_layout(conn) == "wide":
+        df = _read_wide_counts(conn, where, params or [])
+    else:
+        df = cast(pd.DataFrame, pd.read_sql_query(f"{_FREQUENCY_QUERY} {where}", conn, params=params or []))
+        df["total_count"] = df.groupby("sample_id")["count"].transform("sum")
+    return _finish_frequency_frame(df)
+
+
+def _categorical(values: pd.Series, lower: bool = False) -> pd.Categorical:
+    # Labels are stringified (missing -> "None") and normalized once per distinct value, not per row.
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    labels = pd.Index(uniques, dtype=object).astype(str)
+    if lower:
+        labels = labels.str.lower()
+    categories = pd.Index(sorted(set(labels)))
+    return pd.Categorical.from_codes(categories.get_indexer(labels)[codes], categories=categories)
+
+
+def _compact_integers(values: pd.Series, dtype: str) -> pd.Series:
+    array = values.to_numpy()
+    with np.errstate(invalid="ignore", over="ignore"):
+        compact = array.astype(dtype)
+    # Columns that would not round-trip (fractional visit times, NaN, overflow) keep their dtype.
+    if not np.array_equal(compact, array):
+        return values
+    return pd.Series(compact, index=values.index, name=values.name)
+
+
+def _finish_frequency_frame(df: pd.DataFrame) -> pd.DataFrame:
     df["percentage"] = (df["count"] / df["total_count"]) * 100
 
-    df["condition"] = df["condition"].astype(str)
-    df["treatment"] = df["treatment"].astype(str)
-    df["sample_type"] = df["sample_type"].astype(str)
-    df["response"] = df["response"].astype(str).str.lower()
-    df["sex"] = df["sex"].astype(str)
+    for column in _CATEGORY_COLUMNS:
+        df[column] = _categorical(df[column], lower=column == "response")
+    for column, dtype in _INTEGER_COLUMNS.items():
+        df[column] = _compact_integers(df[column], dtype)
 
     return df
 
 
+def category_mask(values: pd.Series, value: str) -> np.ndarray:
+    # Case-insensitive equality resolved against the categories, then compared on the integer codes.
+    matches = [code for code, label in enumerate(values.cat.categories) if str(label).lower() == value.lower()]
+    return np.isin(values.cat.codes.to_numpy(), matches)
+
+
+def _freeze(df: pd.DataFrame) -> pd.DataFrame:
+    columns: dict[str, np.ndarray | pd.Series] = {}
+    for column in df.columns:
+        if isinstance(df[column].dtype, np.dtype):
+            values = df[column].to_numpy()
+            values.flags.writeable = False
+            columns[column] = values
+        else:
+            columns[column] = df[column]
+    return pd.DataFrame(columns, index=df.index, copy=False)
+
+
+def _cached_frame(key: Hashable, load: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+    version = data_version()
+    with _frame_cache_lock:
+        entry = _frame_cache.get(key)
+        if entry is not None and entry[0] == version:
+            _frame_cache.move_to_end(key)
+            return entry[1].copy(deep=False)
+
+    frame = _freeze(load())
+    with _frame_cache_lock:
+        _frame_cache[key] = (version, frame)
+        _frame_cache.move_to_end(key)
+        while len(_frame_cache) > _FRAME_CACHE_SIZE:
+            _ = _frame_cache.popitem(last=False)
+    # Callers get a shallow view over read-only arrays: adding columns or filtering is free,
+    # while in-place writes raise instead of silently corrupting the shared cached frame.
+    return frame.copy(deep=False)
+
+
+def clear_frame_cache() -> None:
+    with _frame_cache_lock:
+        _frame_cache.clear()
+
+
+def load_sqlite_frequency_data() -> pd.DataFrame:
+    with read_connection() as conn:
+        return _read_frequency_frame(conn)
+
+
+def _load_cell_frequency_data() -> pd.DataFrame:
+    if uses_snapshot():
+        return _finish_frequency_frame(read_frequency_snapshot())
+    return load_sqlite_frequency_data()
+
+
+def get_cell_frequency_data() -> pd.DataFrame:
+    return _cached_frame(("cell_frequency",), _load_cell_frequency_data)
+
+
+def get_sample_frame() -> pd.DataFrame:
+    # One row per sample: every cell-type row of a sample carries the same metadata.
+    return _cached_frame(
+        ("samples",),
+        lambda: cast(pd.DataFrame, get_cell_frequency_data().drop_duplicates("sample_id").reset_index(drop=True)),
+    )
+
+
 def get_part2_frequency_table() -> pd.DataFrame:
-    df = get_cell_frequency_data().copy()
+    df = get_cell_frequency_data()
     out = df.loc[:, ["sample_id", "total_count", "cell_type", "count", "percentage"]].copy()
     out = out.rename(columns={"sample_id": "sample", "cell_type": "population"})
     return cast(pd.DataFrame, out.loc[:, ["sample", "total_count", "population", "count", "percentage"]])
@@ -55,19 +268,59 @@ def get_filtered_data(
     sample_type: str = "PBMC",
     time_filter: str = "all",
 ) -> pd.DataFrame:
-    df = get_cell_frequency_data()
-    mask = pd.Series(True, index=df.index)
-
-    if condition and condition != "all":
-        mask &= df["condition"].str.lower() == condition.lower()
-    if treatment and treatment != "all":
-        mask &= df["treatment"].str.lower() == treatment.lower()
-    if sample_type and sample_type != "all":
-        mask &= df["sample_type"].str.lower() == sample_type.lower()
-    if time_filter == "baseline_only":
-        mask &= df["visit_time"] == 0
+    def load() -> pd.DataFrame:
+        if uses_snapshot():
+            return _finish_frequency_frame(read_frequency_snapshot(condition, treatment, sample_type, time_filter))
+        with read_connection() as conn:
+            where, params = _cohort_where_clause(condition, treatment, sample_type, time_filter)
+            # Filters only select whole samples, so per-sample totals computed on the reduced set are unchanged.
+            return _read_frequency_frame(conn, where, params)
+
+    return _cached_frame(("filtered", condition, treatment, sample_type, time_filter), load)
+
+
+def get_cohort_count_matrix(
+    condition: str = "melanoma",
+    treatment: str = "miraclib",
+    sample_type: str = "PBMC",
+    time_filter: str = "all",
+) -> tuple[pd.DataFrame, np.ndarray | sparse.csr_matrix, list[str]]:
+    # Samples x cell types counts with aligned sample metadata; MISSING_COUNT marks cell types a
+    # sample was never measured for. Mostly-zero panels come back as CSR from the matrix backend.
+    if uses_count_matrix():
+        matrix = get_count_matrix()
+        rows = cohort_rows(matrix, condition, treatment, sample_type, time_filter)
+        # A slice of the memory map is a view, so prefix cohorts share pages instead of copying counts.
+        return sample_frame(matrix, rows), matrix.counts[rows], matrix.cell_types
+
+    if uses_snapshot():
+        return count_matrix_from_frame(get_filtered_data(condition, treatment, sample_type, time_filter))
+    where, params = _cohort_where_clause(condition, treatment, sample_type, time_filter)
+    return _read_count_matrix(where, params)
+
+
+def _read_count_matrix(where: str = "", params: list[str | float] | None = None) -> tuple[pd.DataFrame, np.ndarray, list[str]]:
+    with read_connection() as conn:
+        if cell_count_layout(conn) != "wide":
+            return count_matrix_from_frame(_read_frequency_frame(conn, where, params))
+        # The wide layout already is a samples x cell types matrix; no long frame is built.
+        wide, count_columns = _read_wide_samples(conn, where, params or [])
+    counts = wide.loc[:, list(count_columns)].to_numpy(dtype=float)
+    samples = wide.loc[:, SAMPLE_COLUMNS]
+    for column, dtype in _INTEGER_COLUMNS.items():
+        if column in samples.columns:
+            samples[column] = _compact_integers(samples[column], dtype)
+    return samples, np.where(np.isnan(counts), MISSING_COUNT, counts).astype("int64"), list(count_columns.values())
+
+
+def load_sqlite_count_matrix() -> tuple[pd.DataFrame, np.ndarray, list[str]]:
+    return _read_count_matrix()
+
 
-    return cast(pd.DataFrame, df.loc[mask].copy())
+def get_cell_types() -> list[str]:
+    # The registry of loaded populations, in the order they were first seen by the loader.
+    with read_connection() as conn:
+        return [row[0] for row in conn.execute("SELECT label FROM dim_cell_type ORDER BY id")]
 
 
 def get_filter_options() -> dict[str, list[str]]:
@@ -103,7 +356,7 @@ def prepare_unit_level_data(
         return cast(pd.DataFrame, output)
 
     if unit == "subject":
-        grouped = df.groupby(["subject_pk", "response", "cell_type"], as_index=False)[value_col].median()
+        grouped = df.groupby(["subject_pk", "response", "cell_type"], as_index=False, observed=True)[value_col].median()
         grouped.columns = ["unit_id", "response", "cell_type", "metric_value"]
         return cast(pd.DataFrame, grouped)
 
@@ -113,7 +366,7 @@ def prepare_unit_level_data(
 def apply_clr_transform(unit_df: pd.DataFrame, pseudocount: float = 1e-6) -> pd.DataFrame:
     pivot = cast(
         pd.DataFrame,
-        unit_df.pivot_table(index="unit_id", columns="cell_type", values="metric_value", aggfunc="mean"),
+        unit_df.pivot_table(index="unit_id", columns="cell_type", values="metric_value", aggfunc="mean", observed=True),
     )
     adjusted = cast(pd.DataFrame, pivot.fillna(0.0) + pseudocount)
 
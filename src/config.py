@@ -1,10 +1,26 @@
 import os
 
-
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DB_NAME = "immune_cells.db"
 DB_PATH = os.path.join(ROOT_DIR, DB_NAME)
 CSV_FILE = os.path.join(ROOT_DIR, "cell-count.csv")
+# "sqlite" reads the analysis frames from DB_PATH. "parquet" reads a partitioned Parquet copy of the
+# joined frequency rows that load_data.py writes to PARQUET_DIR after every load; "matrix" reads a
+# memory-mapped samples x cell-types count matrix written to MATRIX_DIR the same way.
+STORAGE_BACKEND = "sqlite"
+PARQUET_DIR = os.path.join(ROOT_DIR, "immune_cells_parquet")
+MATRIX_DIR = os.path.join(ROOT_DIR, "immune_cells_matrix")
+# Finished dashboard reports, keyed by a hash of their inputs; the newest REPORT_CACHE_SIZE are kept.
+REPORT_CACHE_DIR = os.path.join(ROOT_DIR, "report_cache")
+REPORT_CACHE_SIZE = 256
+REPORT_WORKERS = 2
+# "long": one cell_counts row per (sample, cell type). "wide": one WITHOUT ROWID sample_counts row per
+# sample with a column per cell type and a precomputed total_count.
+CELL_COUNT_LAYOUT = "long"
+# Rebuilds from a CSV with at least this many population columns use the wide layout regardless.
+WIDE_PANEL_MIN_POPULATIONS = 20
 
 
+# Populations of the bundled cell-count.csv. The loader detects population columns on its own, and
+# analysis code reads the loaded panel from the dim_cell_type registry (analysis.get_cell_types).
 CELL_TYPES = ["b_cell", "cd8_t_cell", "cd4_t_cell", "nk_cell", "monocyte"]
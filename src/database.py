@@ -1,64 +1,374 @@
+import os
 import sqlite3
+import threading
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
 
-from src.config import DB_PATH
+from src.config import CELL_COUNT_LAYOUT, DB_PATH
 
+# Size of each connection's compiled-statement LRU. The analysis queries are parameterized with
+# fixed SQL text, so repeated dashboard interactions skip re-parsing and re-planning.
+STATEMENT_CACHE_SIZE = 256
 
-def get_db_connection() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
+_reader_local = threading.local()
+_writer_lock = threading.RLock()
+_writers: dict[str, tuple[sqlite3.Connection, int]] = {}
+# Journal mode of each writer before configure_bulk_load switched it to WAL, for end_bulk_load.
+_bulk_journal_modes: dict[sqlite3.Connection, str] = {}
+
+
+def _connect(path: str, check_same_thread: bool = True) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, cached_statements=STATEMENT_CACHE_SIZE, check_same_thread=check_same_thread)
     conn.row_factory = sqlite3.Row
     _ = conn.execute("PRAGMA foreign_keys = ON;")
     return conn
 
 
-def init_db() -> None:
-    conn = get_db_connection()
+def _file_id(path: str) -> int:
+    return os.stat(path).st_ino if os.path.exists(path) else -1
+
+
+def get_db_connection() -> sqlite3.Connection:
+    return _connect(DB_PATH)
+
+
+def _pooled(pool: dict[str, tuple[sqlite3.Connection, int]], check_same_thread: bool) -> sqlite3.Connection:
+    # A pooled connection is only reused while it still points at the file on disk; a database
+    # that was deleted and rebuilt under the same path gets a fresh connection.
+    entry = pool.get(DB_PATH)
+    if entry is not None and entry[1] == _file_id(DB_PATH):
+        return entry[0]
+    if entry is not None:
+        entry[0].close()
+    conn = _connect(DB_PATH, check_same_thread=check_same_thread)
+    pool[DB_PATH] = (conn, _file_id(DB_PATH))
+    return conn
+
+
+@contextmanager
+def read_connection() -> Iterator[sqlite3.Connection]:
+    # Each thread (e.g. each Streamlit script run) keeps one reader per database path, so queries
+    # reuse an open connection and its statement cache instead of reconnecting every call.
+    if not hasattr(_reader_local, "pool"):
+        _reader_local.pool = {}
+    conn = _pooled(_reader_local.pool, check_same_thread=True)
+    try:
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.rollback()
+
+
+@contextmanager
+def writer_connection() -> Iterator[sqlite3.Connection]:
+    # All writes share one connection per database path, serialized by a process-wide lock.
+    # Connection-level pragmas changed by a bulk load are reset when the writer is handed back.
+    with _writer_lock:
+        conn = _pooled(_writers, check_same_thread=False)
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            end_bulk_load(conn)
+            _ = conn.execute("PRAGMA foreign_keys = ON;")
+            _ = conn.execute("PRAGMA synchronous = FULL;")
+            _ = conn.execute("PRAGMA cache_size = -2000;")
+            _ = conn.execute("PRAGMA temp_store = DEFAULT;")
+
+
+def close_pooled_connections() -> None:
+    for conn, _ in getattr(_reader_local, "pool", {}).values():
+        conn.close()
+    _reader_local.pool = {}
+    with _writer_lock:
+        for conn, _ in _writers.values():
+            conn.close()
+        _writers.clear()
+
+
+def get_data_version() -> tuple[str, int, int]:
+    with read_connection() as conn:
+        load_generation = int(conn.execute("PRAGMA user_version;").fetchone()[0])
+    # The inode distinguishes a deleted-and-rebuilt database whose generation restarted from zero.
+    return DB_PATH, os.stat(DB_PATH).st_ino, load_generation
+
+
+def bump_data_version(conn: sqlite3.Connection) -> int:
+    load_generation = int(conn.execute("PRAGMA user_version;").fetchone()[0]) + 1
+    _ = conn.execute(f"PRAGMA user_version = {load_generation};")
+    return load_generation
+
+
+# Categorical columns are dictionary-encoded into dim_<name>(id, code, label) lookup tables: `code` is
+# the lower-cased value used for case-insensitive filtering, `label` the first spelling loaded.
+DIMENSIONS = ("condition", "treatment", "sample_type", "sex", "response", "cell_type")
+
+CELL_COUNT_LAYOUTS = ("long", "wide")
+
+INDEX_DDL = [
+    "CREATE INDEX IF NOT EXISTS idx_subjects_project ON subjects(project_id)",
+    "CREATE INDEX IF NOT EXISTS idx_subjects_condition_treatment ON subjects(condition_id, treatment_id)",
+    "CREATE INDEX IF NOT EXISTS idx_subjects_response_sex ON subjects(response_id, sex_id)",
+    "CREATE INDEX IF NOT EXISTS idx_samples_subject_pk ON samples(subject_pk)",
+    "CREATE INDEX IF NOT EXISTS idx_samples_type_time ON samples(sample_type_id, visit_time)",
+]
+
+# The wide layout needs no secondary indexes: sample_counts is clustered on its sample_id key.
+LONG_LAYOUT_INDEX_DDL = [
+    "CREATE INDEX IF NOT EXISTS idx_cell_counts_sample ON cell_counts(sample_id)",
+    "CREATE INDEX IF NOT EXISTS idx_cell_counts_type ON cell_counts(cell_type_id)",
+]
+
+_LONG_CELL_COUNTS_DDL = """
+CREATE TABLE IF NOT EXISTS cell_counts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sample_id TEXT NOT NULL,
+    cell_type_id INTEGER NOT NULL REFERENCES dim_cell_type (id),
+    count INTEGER NOT NULL CHECK (count >= 0),
+    FOREIGN KEY (sample_id) REFERENCES samples (sample_id) ON DELETE CASCADE,
+    UNIQUE (sample_id, cell_type_id)
+)
+"""
+
+
+def _wide_sample_counts_ddl(cell_type_ids: Iterable[int]) -> str:
+    count_columns = "".join(f",\n    c{cell_type_id} INTEGER CHECK (c{cell_type_id} >= 0)" for cell_type_id in cell_type_ids)
+    return f"""
+CREATE TABLE IF NOT EXISTS sample_counts (
+    sample_id TEXT PRIMARY KEY REFERENCES samples (sample_id) ON DELETE CASCADE,
+    total_count INTEGER NOT NULL CHECK (total_count >= 0){count_columns}
+) WITHOUT ROWID
+"""
+
+
+def cell_count_layout(conn: sqlite3.Connection) -> str:
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sample_counts'").fetchone()
+    return "wide" if row else "long"
+
+
+def _wide_cell_type_ids(conn: sqlite3.Connection) -> set[int]:
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(sample_counts)")]
+    return {int(column[1:]) for column in columns if column.startswith("c") and column[1:].isdigit()}
+
+
+def wide_count_columns(conn: sqlite3.Connection) -> dict[str, str]:
+    # Maps each c<cell_type_id> column of sample_counts to its cell-type label, in id order.
+    present = _wide_cell_type_ids(conn)
+    rows = conn.execute("SELECT id, label FROM dim_cell_type ORDER BY id").fetchall()
+    return {f"c{cell_type_id}": label for cell_type_id, label in rows if cell_type_id in present}
+
+
+def _create_cell_counts_view(conn: sqlite3.Connection) -> None:
+    # In the wide layout cell_counts is a read-only view that unpivots sample_counts, so SQL written
+    # against the long layout keeps working unchanged.
+    branches = [
+        f"SELECT sample_id, {column[1:]} AS cell_type_id, {column} AS count FROM sample_counts WHERE {column} IS NOT NULL"
+        for column in wide_count_columns(conn)
+    ]
+    body = "\nUNION ALL\n".join(branches) or "SELECT sample_id, NULL AS cell_type_id, NULL AS count FROM sample_counts WHERE 0"
+    _ = conn.execute("DROP VIEW IF EXISTS cell_counts")
+    _ = conn.execute(f"CREATE VIEW cell_counts AS\n{body}")
+
+
+def add_wide_count_columns(conn: sqlite3.Connection, cell_type_ids: Iterable[int]) -> None:
+    missing = sorted({int(cell_type_id) for cell_type_id in cell_type_ids} - _wide_cell_type_ids(conn))
+    for cell_type_id in missing:
+        _ = conn.execute(f"ALTER TABLE sample_counts ADD COLUMN c{cell_type_id} INTEGER CHECK (c{cell_type_id} >= 0)")
+    if missing:
+        _create_cell_counts_view(conn)
+
+
+def create_indexes(conn: sqlite3.Connection) -> None:
+    statements = INDEX_DDL + (LONG_LAYOUT_INDEX_DDL if cell_count_layout(conn) == "long" else [])
+    for statement in statements:
+        _ = conn.execute(statement)
+
+
+def configure_bulk_load(conn: sqlite3.Connection) -> None:
+    # WAL keeps readers unblocked during the load; with WAL, synchronous=NORMAL only syncs at
+    # checkpoints and stays corruption-safe. A large page cache and in-memory temp B-trees keep
+    # index builds and sorts off disk. Foreign keys are validated once in finish_bulk_load.
+    _ = conn.execute("PRAGMA foreign_keys = OFF;")
+    _bulk_journal_modes[conn] = str(conn.execute("PRAGMA journal_mode;").fetchone()[0])
+    _ = conn.execute("PRAGMA journal_mode = WAL;")
+    _ = conn.execute("PRAGMA synchronous = NORMAL;")
+    _ = conn.execute("PRAGMA cache_size = -262144;")
+    _ = conn.execute("PRAGMA temp_store = MEMORY;")
+
+
+def finish_bulk_load(conn: sqlite3.Connection) -> None:
+    violations = conn.execute("PRAGMA foreign_key_check;").fetchall()
+    if violations:
+        raise sqlite3.IntegrityError(f"Bulk load left {len(violations)} rows with dangling foreign keys")
+    create_indexes(conn)
+    _ = conn.execute("ANALYZE;")
+
+
+def end_bulk_load(conn: sqlite3.Connection) -> None:
+    # Unlike the pragmas writer_connection resets, the journal mode is stored in the database file, so
+    # the mode from before configure_bulk_load is put back once the load is committed. Leaving WAL
+    # needs the only open connection; while another process (e.g. the dashboard) has the database
+    # open, the file stays in WAL mode, which every SQLite reader handles.
+    journal_mode = _bulk_journal_modes.pop(conn, None)
+    if journal_mode is None or journal_mode == "wal":
+        return
+    try:
+        _ = conn.execute(f"PRAGMA journal_mode = {journal_mode};")
+    except sqlite3.OperationalError as e:
+        print(f"Database left in WAL mode, could not restore journal_mode={journal_mode}: {e}")
+
+
+def init_db(reset: bool = True, defer_indexes: bool = False, layout: str | None = None) -> None:
+    if layout is not None and layout not in CELL_COUNT_LAYOUTS:
+        raise ValueError(f"Unknown cell-count layout: {layout}")
+    with writer_connection() as conn:
+        _create_schema(conn, reset, defer_indexes, layout)
+    print(f"Database initialized at {DB_PATH}")
+
+
+def _create_schema(conn: sqlite3.Connection, reset: bool, defer_indexes: bool, layout: str | None) -> None:
     cursor = conn.cursor()
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE name IN ('cell_counts', 'sample_counts')")}
+    existing_layout = "wide" if "sample_counts" in existing else "long" if "cell_counts" in existing else None
+
+    if reset:
+        drop_counts = (
+            "DROP VIEW IF EXISTS cell_counts;\n        DROP TABLE IF EXISTS sample_counts;"
+            if existing_layout == "wide"
+            else "DROP TABLE IF EXISTS cell_counts;"
+        )
+        existing_layout = None
+        _ = cursor.executescript(
+            f"""
+        {drop_counts}
+        DROP TABLE IF EXISTS samples;
+        DROP TABLE IF EXISTS subjects;
+        DROP TABLE IF EXISTS dim_condition;
+        DROP TABLE IF EXISTS dim_treatment;
+        DROP TABLE IF EXISTS dim_sample_type;
+        DROP TABLE IF EXISTS dim_sex;
+        DROP TABLE IF EXISTS dim_response;
+        DROP TABLE IF EXISTS dim_cell_type;
+        """
+        )
 
     _ = cursor.executescript(
         """
-    DROP TABLE IF EXISTS cell_counts;
-    DROP TABLE IF EXISTS samples;
-    DROP TABLE IF EXISTS subjects;
+    CREATE TABLE IF NOT EXISTS dim_condition (
+        id INTEGER PRIMARY KEY,
+        code TEXT NOT NULL UNIQUE,
+        label TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS dim_treatment (
+        id INTEGER PRIMARY KEY,
+        code TEXT NOT NULL UNIQUE,
+        label TEXT NOT NULL
+    );
 
-    CREATE TABLE subjects (
+    CREATE TABLE IF NOT EXISTS dim_sample_type (
+        id INTEGER PRIMARY KEY,
+        code TEXT NOT NULL UNIQUE,
+        label TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS dim_sex (
+        id INTEGER PRIMARY KEY,
+        code TEXT NOT NULL UNIQUE,
+        label TEXT NOT NULL CHECK (label IN ('M', 'F'))
+    );
+
+    CREATE TABLE IF NOT EXISTS dim_response (
+        id INTEGER PRIMARY KEY,
+        code TEXT NOT NULL UNIQUE,
+        label TEXT NOT NULL CHECK (label IN ('yes', 'no'))
+    );
+
+    CREATE TABLE IF NOT EXISTS dim_cell_type (
+        id INTEGER PRIMARY KEY,
+        code TEXT NOT NULL UNIQUE,
+        label TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS subjects (
         subject_pk INTEGER PRIMARY KEY AUTOINCREMENT,
         subject_id TEXT NOT NULL,
         project_id TEXT NOT NULL,
-        condition TEXT NOT NULL,
+        condition_id INTEGER NOT NULL REFERENCES dim_condition (id),
         age INTEGER,
-        sex TEXT CHECK (sex IN ('M', 'F')),
-        treatment TEXT NOT NULL,
-        response TEXT CHECK (response IN ('yes', 'no')),
+        sex_id INTEGER REFERENCES dim_sex (id),
+        treatment_id INTEGER NOT NULL REFERENCES dim_treatment (id),
+        response_id INTEGER REFERENCES dim_response (id),
         UNIQUE (project_id, subject_id)
     );
 
-    CREATE TABLE samples (
+    CREATE TABLE IF NOT EXISTS samples (
         sample_id TEXT PRIMARY KEY,
         subject_pk INTEGER NOT NULL,
         visit_time REAL NOT NULL,
-        sample_type TEXT NOT NULL,
+        sample_type_id INTEGER NOT NULL REFERENCES dim_sample_type (id),
         FOREIGN KEY (subject_pk) REFERENCES subjects (subject_pk) ON DELETE CASCADE
     );
-
-    CREATE TABLE cell_counts (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        sample_id TEXT NOT NULL,
-        cell_type TEXT NOT NULL,
-        count INTEGER NOT NULL CHECK (count >= 0),
-        FOREIGN KEY (sample_id) REFERENCES samples (sample_id) ON DELETE CASCADE,
-        UNIQUE (sample_id, cell_type)
-    );
-
-    CREATE INDEX idx_subjects_project ON subjects(project_id);
-    CREATE INDEX idx_subjects_condition_treatment ON subjects(condition, treatment);
-    CREATE INDEX idx_subjects_response_sex ON subjects(response, sex);
-    CREATE INDEX idx_samples_subject_pk ON samples(subject_pk);
-    CREATE INDEX idx_samples_type_time ON samples(sample_type, visit_time);
-    CREATE INDEX idx_cell_counts_sample ON cell_counts(sample_id);
-    CREATE INDEX idx_cell_counts_type ON cell_counts(cell_type);
     """
     )
 
+    # An existing database keeps its layout; only a fresh schema picks the requested/configured one.
+    if (existing_layout or layout or CELL_COUNT_LAYOUT) == "wide":
+        _ = cursor.execute(_wide_sample_counts_ddl([]))
+        _create_cell_counts_view(conn)
+    else:
+        _ = cursor.execute(_LONG_CELL_COUNTS_DDL)
+    if not defer_indexes:
+        create_indexes(conn)
+    if reset:
+        _ = bump_data_version(conn)
+
     conn.commit()
-    conn.close()
-    print(f"Database initialized at {DB_PATH}")
+
+
+def migrate_cell_count_layout(layout: str) -> None:
+    if layout not in CELL_COUNT_LAYOUTS:
+        raise ValueError(f"Unknown cell-count layout: {layout}")
+
+    with writer_connection() as conn:
+        current = cell_count_layout(conn)
+        if current == layout:
+            print(f"Cell counts already use the {layout} layout.")
+            return
+
+        if layout == "wide":
+            cell_type_ids = [row[0] for row in conn.execute("SELECT DISTINCT cell_type_id FROM cell_counts ORDER BY 1")]
+            _ = conn.execute(_wide_sample_counts_ddl(cell_type_ids))
+            pivot = ", ".join(f"MAX(CASE WHEN cell_type_id = {cell_type_id} THEN count END)" for cell_type_id in cell_type_ids)
+            columns = "".join(f", c{cell_type_id}" for cell_type_id in cell_type_ids)
+            _ = conn.execute(
+                f"""
+                INSERT INTO sample_counts (sample_id, total_count{columns})
+                SELECT sample_id, SUM(count){", " + pivot if pivot else ""}
+                FROM cell_counts
+                GROUP BY sample_id
+                """
+            )
+            _ = conn.execute("DROP TABLE cell_counts")
+            _create_cell_counts_view(conn)
+        else:
+            _ = conn.execute("CREATE TEMP TABLE migrated_counts AS SELECT sample_id, cell_type_id, count FROM cell_counts")
+            _ = conn.execute("DROP VIEW cell_counts")
+            _ = conn.execute("DROP TABLE sample_counts")
+            _ = conn.execute(_LONG_CELL_COUNTS_DDL)
+            _ = conn.execute(
+                """
+                INSERT INTO cell_counts (sample_id, cell_type_id, count)
+                SELECT sample_id, cell_type_id, count FROM temp.migrated_counts ORDER BY sample_id, cell_type_id
+                """
+            )
+            _ = conn.execute("DROP TABLE temp.migrated_counts")
+
+        create_indexes(conn)
+        _ = bump_data_version(conn)
+        conn.commit()
+        # Reclaim the pages freed by the dropped layout so the file size reflects the new one.
+        _ = conn.execute("VACUUM")
+
+    print(f"Migrated cell counts from the {current} to the {layout} layout.")
@@ -0,0 +1,190 @@
+import json
+import os
+from typing import NamedTuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# Per-sample string columns are dictionary-encoded (int32 codes + categories in the manifest) so
+# every array is a plain fixed-width .npy that np.load can memory-map.
+SAMPLE_COLUMNS = [
+    "sample_id",
+    "subject_pk",
+    "subject_id",
+    "project_id",
+    "treatment",
+    "response",
+    "condition",
+    "sex",
+    "sample_type",
+    "visit_time",
+]
+NUMERIC_COLUMNS = {"subject_pk": "int64", "visit_time": "float64"}
+STRING_COLUMNS = [column for column in SAMPLE_COLUMNS if column not in NUMERIC_COLUMNS]
+
+# Samples are stored sorted on these keys (case-insensitively for the strings), so a cohort that
+# fixes a prefix of them is one contiguous row range and slices the memory map without copying.
+SORT_COLUMNS = ["condition", "treatment", "sample_type", "visit_time"]
+
+MISSING_COUNT = -1
+
+# Panels where at least this share of counts is zero (rare gated populations) are stored as CSR
+# arrays; MISSING_COUNT entries are non-zero, so they stay explicit.
+SPARSE_ZERO_FRACTION = 0.5
+
+
+class CountMatrix(NamedTuple):
+    counts: np.ndarray | sparse.csr_matrix
+    totals: np.ndarray
+    cell_types: list[str]
+    columns: dict[str, np.ndarray]
+    categories: dict[str, list[str]]
+
+
+def count_matrix_from_frame(frame: pd.DataFrame) -> tuple[pd.DataFrame, np.ndarray, list[str]]:
+    # `frame` is the long frequency frame: one row per (sample, cell type).
+    samples = frame.drop_duplicates("sample_id").loc[:, SAMPLE_COLUMNS].reset_index(drop=True)
+    cell_types = [str(cell_type) for cell_type in pd.unique(frame["cell_type"])]
+    wide = frame.pivot(index="sample_id", columns="cell_type", values="count")
+    wide.columns = wide.columns.astype(str)
+    counts = wide.reindex(index=samples["sample_id"], columns=cell_types).to_numpy(dtype=float)
+    return samples, np.where(np.isnan(counts), MISSING_COUNT, counts).astype("int64"), cell_types
+
+
+def write_count_matrix(samples: pd.DataFrame, counts: np.ndarray, cell_types: list[str], directory: str) -> None:
+    categories: dict[str, list[str]] = {}
+    codes: dict[str, np.ndarray] = {}
+    for column in STRING_COLUMNS:
+        values = samples[column].astype(str)
+        # Spellings are ordered case-insensitively, so all spellings of one value get adjacent codes.
+        categories[column] = sorted(values.unique().tolist(), key=lambda value: (value.lower(), value))
+        codes[column] = pd.Categorical(values, categories=categories[column]).codes.astype("int32")
+
+    # np.lexsort treats its last key as the primary one; sample_id breaks the remaining ties.
+    sort_keys = [codes[column] if column in codes else samples[column].to_numpy() for column in SORT_COLUMNS]
+    order = np.lexsort([codes["sample_id"], *reversed(sort_keys)])
+    stored = counts[order]
+    present = stored != MISSING_COUNT
+
+    os.makedirs(directory, exist_ok=True)
+    layout = "csr" if stored.size and np.count_nonzero(stored == 0) >= SPARSE_ZERO_FRACTION * stored.size else "dense"
+    if layout == "csr":
+        csr = sparse.csr_matrix(stored)
+        for name in ("data", "indices", "indptr"):
+            np.save(os.path.join(directory, f"counts_{name}.npy"), getattr(csr, name))
+    else:
+        np.save(os.path.join(directory, "counts.npy"), stored)
+    np.save(os.path.join(directory, "totals.npy"), np.where(present, stored, 0).sum(axis=1).astype("int64"))
+    for column in STRING_COLUMNS:
+        np.save(os.path.join(directory, f"{column}.npy"), codes[column][order])
+    for column, dtype in NUMERIC_COLUMNS.items():
+        np.save(os.path.join(directory, f"{column}.npy"), samples[column].to_numpy(dtype=dtype)[order])
+    with open(os.path.join(directory, "manifest.json"), "w") as handle:
+        json.dump({"cell_types": cell_types, "categories": categories, "layout": layout}, handle)
+
+
+def read_count_matrix(directory: str) -> CountMatrix:
+    with open(os.path.join(directory, "manifest.json")) as handle:
+        manifest = json.load(handle)
+
+    def load(name: str) -> np.ndarray:
+        # Read-only memory maps: pages are shared by every process that maps the same file. An
+        # empty array has nothing to map and is read normally.
+        path = os.path.join(directory, f"{name}.npy")
+        try:
+            return np.load(path, mmap_mode="r")
+        except ValueError:
+            return np.load(path)
+
+    totals = load("totals")
+    counts: np.ndarray | sparse.csr_matrix
+    if manifest["layout"] == "csr":
+        shape = (len(totals), len(manifest["cell_types"]))
+        counts = sparse.csr_matrix((load("counts_data"), load("counts_indices"), load("counts_indptr")), shape=shape)
+    else:
+        counts = load("counts")
+    return CountMatrix(
+        counts=counts,
+        totals=totals,
+        cell_types=manifest["cell_types"],
+        columns={column: load(column) for column in SAMPLE_COLUMNS},
+        categories=manifest["categories"],
+    )
+
+
+def _matching_codes(matrix: CountMatrix, column: str, value: str) -> tuple[int, int] | None:
+    matches = [code for code, label in enumerate(matrix.categories[column]) if label.lower() == value.lower()]
+    if not matches:
+        return None
+    return matches[0], matches[-1]
+
+
+def cohort_rows(
+    matrix: CountMatrix,
+    condition: str = "all",
+    treatment: str = "all",
+    sample_type: str = "all",
+    time_filter: str = "all",
+) -> slice | np.ndarray:
+    # Narrow a contiguous [start, stop) range while the filters follow the sort order; any filter
+    # after a gap in that order falls back to a boolean mask over the remaining range.
+    bounds: list[tuple[str, float, float] | None] = []
+    for column, value in (("condition", condition), ("treatment", treatment), ("sample_type", sample_type)):
+        if not value or value == "all":
+            bounds.append(None)
+            continue
+        codes = _matching_codes(matrix, column, value)
+        if codes is None:
+            return slice(0, 0)
+        bounds.append((column, *codes))
+    if time_filter == "baseline_only":
+        bounds.append(("visit_time", 0.0, 0.0))
+
+    start, stop = 0, len(matrix.totals)
+    contiguous = True
+    mask: np.ndarray | None = None
+    for bound in bounds:
+        if bound is None:
+            contiguous = False
+            continue
+        column, low, high = bound
+        keys = matrix.columns[column][start:stop]
+        if contiguous:
+            offset = start
+            start = offset + int(np.searchsorted(keys, low, side="left"))
+            stop = offset + int(np.searchsorted(keys, high, side="right"))
+            # Within a range spanning several spellings the next key is no longer globally sorted.
+            contiguous = low == high
+        else:
+            term = (keys >= low) & (keys <= high)
+            mask = term if mask is None else mask & term
+
+    if mask is None:
+        return slice(start, stop)
+    return np.flatnonzero(mask) + start
+
+
+def sample_frame(matrix: CountMatrix, rows: slice | np.ndarray) -> pd.DataFrame:
+    data: dict[str, np.ndarray] = {}
+    for column in SAMPLE_COLUMNS:
+        values = matrix.columns[column][rows]
+        if column in matrix.categories:
+            values = np.asarray(matrix.categories[column], dtype=object)[values]
+        data[column] = np.asarray(values)
+    return pd.DataFrame(data)
+
+
+def long_frame(matrix: CountMatrix, rows: slice | np.ndarray) -> pd.DataFrame:
+    # Rebuild the long frequency rows (before `percentage`) for a cohort of samples.
+    samples = sample_frame(matrix, rows)
+    block = matrix.counts[rows]
+    counts = block.toarray() if sparse.issparse(block) else np.asarray(block)
+    present = (counts != MISSING_COUNT).ravel()
+    repeat = np.repeat(np.arange(len(samples)), len(matrix.cell_types))[present]
+
+    df = samples.iloc[repeat].reset_index(drop=True)
+    df["cell_type"] = np.tile(np.asarray(matrix.cell_types, dtype=object), len(samples))[present]
+    df["count"] = counts.ravel()[present]
+    df["total_count"] = np.asarray(matrix.totals[rows])[repeat]
+    return df
@@ -1,16 +1,20 @@
+import sqlite3
 from typing import cast
 
+import numpy as np
 import pandas as pd
 
-from src.analysis import get_cell_frequency_data
-from src.database import get_db_connection
+from src.analysis import category_mask, get_sample_frame, unpivot_wide_counts
+from src.database import cell_count_layout, read_connection, wide_count_columns
 
 
 def _subset_where_clause(time_filter: str) -> str:
+    # Filters compare indexed integer keys against the case-normalized lookup-table codes, so the
+    # subjects(condition_id, treatment_id) and samples(sample_type_id, visit_time) indexes apply.
     base = """
-    WHERE LOWER(sub.condition) = ?
-      AND LOWER(sub.treatment) = ?
-      AND LOWER(s.sample_type) = ?
+    WHERE sub.condition_id = (SELECT id FROM dim_condition WHERE code = ?)
+      AND sub.treatment_id = (SELECT id FROM dim_treatment WHERE code = ?)
+      AND s.sample_type_id = (SELECT id FROM dim_sample_type WHERE code = ?)
     """
     if time_filter == "baseline_only":
         base += " AND s.visit_time = ?"
@@ -29,131 +33,72 @@ def _subset_params(
     return params
 
 
-def count_samples_by_project(
-    condition: str,
-    treatment: str,
-    sample_type: str,
-    time_filter: str,
-) -> pd.Series:
-    conn = get_db_connection()
-    query = f"""
-    SELECT sub.project_id, COUNT(DISTINCT s.sample_id) AS n_samples
-    FROM samples s
-    JOIN subjects sub ON s.subject_pk = sub.subject_pk
-    {_subset_where_clause(time_filter)}
-    GROUP BY sub.project_id
-    """
-    params = _subset_params(condition, treatment, sample_type, time_filter)
-    df = cast(pd.DataFrame, pd.read_sql_query(query, conn, params=params))
-    conn.close()
-    if len(df) == 0:
-        return pd.Series(dtype="int64")
-    return cast(pd.Series, df.set_index("project_id")["n_samples"])
-
-
-def count_subjects_by_project(
-    condition: str,
-    treatment: str,
-    sample_type: str,
-    time_filter: str,
-) -> pd.Series:
-    conn = get_db_connection()
-    query = f"""
-    SELECT sub.project_id, COUNT(DISTINCT sub.subject_pk) AS n_subjects
-    FROM samples s
-    JOIN subjects sub ON s.subject_pk = sub.subject_pk
-    {_subset_where_clause(time_filter)}
-    GROUP BY sub.project_id
-    """
-    params = _subset_params(condition, treatment, sample_type, time_filter)
-    df = cast(pd.DataFrame, pd.read_sql_query(query, conn, params=params))
-    conn.close()
-    if len(df) == 0:
-        return pd.Series(dtype="int64")
-    return cast(pd.Series, df.set_index("project_id")["n_subjects"])
-
-
-def count_subjects_by_response_and_sex(
-    condition: str,
-    treatment: str,
-    sample_type: str,
-    time_filter: str,
-) -> pd.DataFrame:
-    conn = get_db_connection()
-    query = f"""
-    SELECT response, sex, COUNT(*) AS n_subjects
-    FROM (
-        SELECT DISTINCT sub.subject_pk, LOWER(sub.response) AS response, sub.sex AS sex
-        FROM samples s
-        JOIN subjects sub ON s.subject_pk = sub.subject_pk
-        {_subset_where_clause(time_filter)}
-    ) dedup
-    GROUP BY response, sex
-    """
-    params = _subset_params(condition, treatment, sample_type, time_filter)
-    df = cast(pd.DataFrame, pd.read_sql_query(query, conn, params=params))
-    conn.close()
+_SUBSET_QUERY = """
+SELECT
+    sub.project_id,
+    sub.subject_pk,
+    s.sample_id,
+    sub.subject_id,
+    rs.code AS response,
+    sx.label AS sex,
+    s.visit_time,
+    ct.label AS cell_type,
+    c.count
+FROM samples s
+JOIN subjects sub ON s.subject_pk = sub.subject_pk
+LEFT JOIN dim_response rs ON rs.id = sub.response_id
+LEFT JOIN dim_sex sx ON sx.id = sub.sex_id
+LEFT JOIN cell_counts c ON s.sample_id = c.sample_id
+LEFT JOIN dim_cell_type ct ON ct.id = c.cell_type_id
+"""
+
+# The unpivoting cell_counts view is materialized in full when joined, so the wide layout reads
+# sample_counts directly and unpivots in memory.
+_WIDE_SUBSET_QUERY = """
+SELECT
+    sub.project_id,
+    sub.subject_pk,
+    s.sample_id,
+    sub.subject_id,
+    rs.code AS response,
+    sx.label AS sex,
+    s.visit_time{count_columns}
+FROM samples s
+JOIN subjects sub ON s.subject_pk = sub.subject_pk
+LEFT JOIN dim_response rs ON rs.id = sub.response_id
+LEFT JOIN dim_sex sx ON sx.id = sub.sex_id
+LEFT JOIN sample_counts w ON s.sample_id = w.sample_id
+"""
+
+
+def _fetch_wide_subset(conn: sqlite3.Connection, where: str, params: list[str | float]) -> pd.DataFrame:
+    count_columns = wide_count_columns(conn)
+    query = _WIDE_SUBSET_QUERY.format(count_columns="".join(f", w.{column}" for column in count_columns))
+    wide = cast(pd.DataFrame, pd.read_sql_query(f"{query} {where}", conn, params=params))
+    df = unpivot_wide_counts(wide, count_columns)
+
+    # Keep samples without any counts as a single NULL row, matching the long layout's LEFT JOIN.
+    uncounted = ~wide.loc[:, list(count_columns)].notna().any(axis=1)
+    if bool(uncounted.any()):
+        df = pd.concat([df, wide.loc[uncounted, [*df.columns[:-2]]]], ignore_index=True)
     return df
 
 
-def avg_b_cell_male_responders_baseline(
-    condition: str,
-    treatment: str,
-    sample_type: str,
-    time_filter: str,
-) -> float | None:
-    conn = get_db_connection()
-    query = f"""
-    WITH per_subject AS (
-        SELECT sub.subject_pk, AVG(c.count) AS subject_mean_b
-        FROM samples s
-        JOIN subjects sub ON s.subject_pk = sub.subject_pk
-        JOIN cell_counts c ON s.sample_id = c.sample_id
-        {_subset_where_clause(time_filter)}
-          AND sub.sex = 'M'
-          AND LOWER(sub.response) = 'yes'
-          AND c.cell_type = 'b_cell'
-        GROUP BY sub.subject_pk
-    )
-    SELECT AVG(subject_mean_b) AS avg_b FROM per_subject
-    """
-    params = _subset_params(condition, treatment, sample_type, time_filter)
-    row = cast(pd.DataFrame, pd.read_sql_query(query, conn, params=params))
-    conn.close()
-    if len(row) == 0 or pd.isna(row.loc[0, "avg_b"]):
-        return None
-    return float(row.loc[0, "avg_b"])
-
-
 def _fetch_subset(
     condition: str,
     treatment: str,
     sample_type: str,
     time_filter: str,
 ) -> pd.DataFrame:
-    conn = get_db_connection()
-
-    query = f"""
-    SELECT
-        sub.project_id,
-        sub.subject_pk,
-        s.sample_id,
-        sub.subject_id,
-        LOWER(sub.response) AS response,
-        sub.sex,
-        s.visit_time,
-        c.cell_type,
-        c.count
-    FROM samples s
-    JOIN subjects sub ON s.subject_pk = sub.subject_pk
-    JOIN cell_counts c ON s.sample_id = c.sample_id
-    {_subset_where_clause(time_filter)}
-    """
-
+    # LEFT JOIN keeps samples that have no cell_counts rows, so the sample/subject tallies derived
+    # from this frame count every filtered sample; those rows are dropped from df_raw.
+    where = _subset_where_clause(time_filter)
     params = _subset_params(condition, treatment, sample_type, time_filter)
 
-    df = cast(pd.DataFrame, pd.read_sql_query(query, conn, params=params))
-    conn.close()
+    with read_connection() as conn:
+        if cell_count_layout(conn) == "wide":
+            return _fetch_wide_subset(conn, where, params)
+        df = cast(pd.DataFrame, pd.read_sql_query(f"{_SUBSET_QUERY} {where}", conn, params=params))
     return df
 
 
@@ -163,32 +108,49 @@ def get_subset_stats(
     sample_type: str,
     time_filter: str,
 ) -> dict[str, pd.Series | pd.DataFrame | int | float | None]:
+    # One scan of the filtered join; every tally below is an in-memory aggregation of that frame,
+    # so latency no longer grows with one round trip per breakdown.
     df = _fetch_subset(condition, treatment, sample_type, time_filter)
 
-    by_project_samples = count_samples_by_project(condition, treatment, sample_type, time_filter)
-    by_project_subjects = count_subjects_by_project(condition, treatment, sample_type, time_filter)
-    by_response_sex = count_subjects_by_response_and_sex(condition, treatment, sample_type, time_filter)
+    has_counts = df["cell_type"].notna()
+    df_raw = df
+    if not bool(has_counts.all()):
+        df_raw = cast(pd.DataFrame, df.loc[has_counts].astype({"count": "int64"}).reset_index(drop=True))
 
-    if len(by_response_sex) == 0:
+    if len(df) == 0:
+        by_project_samples = pd.Series(dtype="int64")
+        by_project_subjects = pd.Series(dtype="int64")
         by_response = pd.Series(dtype="int64")
         by_sex = pd.Series(dtype="int64")
-        n_subjects = 0
     else:
-        by_response = cast(pd.Series, by_response_sex.groupby("response", as_index=True)["n_subjects"].sum())
-        by_sex = cast(pd.Series, by_response_sex.groupby("sex", as_index=True)["n_subjects"].sum())
-        n_subjects = int(by_response.sum())
-
-    avg_b_cell = avg_b_cell_male_responders_baseline(condition, treatment, sample_type, time_filter)
+        by_project = df.groupby("project_id")
+        by_project_samples = cast(pd.Series, by_project["sample_id"].nunique().rename("n_samples"))
+        by_project_subjects = cast(pd.Series, by_project["subject_pk"].nunique().rename("n_subjects"))
+
+        subjects = df.drop_duplicates("subject_pk")
+        by_response = cast(pd.Series, subjects.groupby("response").size().rename("n_subjects"))
+        by_sex = cast(pd.Series, subjects.groupby("sex").size().rename("n_subjects"))
+
+    # sex and cell_type hold the first spelling loaded; like the cohort filters, match on the
+    # lower-cased code so a differently cased label still selects the same rows.
+    male_responder_b = df_raw.loc[
+        (df_raw["sex"].str.lower() == "m")
+        & (df_raw["response"] == "yes")
+        & (df_raw["cell_type"].str.lower() == "b_cell")
+    ]
+    avg_b_cell = None
+    if len(male_responder_b) > 0:
+        avg_b_cell = float(male_responder_b.groupby("subject_pk")["count"].mean().mean())
 
     return {
-        "df_raw": df,
+        "df_raw": df_raw,
         "by_project_samples": by_project_samples,
         "by_project_subjects": by_project_subjects,
         "by_response": by_response,
         "by_sex": by_sex,
         "n_projects": int(by_project_samples.index.nunique()),
         "n_samples": int(by_project_samples.sum()) if len(by_project_samples) > 0 else 0,
-        "n_subjects": n_subjects,
+        "n_subjects": int(by_response.sum()) if len(by_response) > 0 else 0,
         "avg_b_cell_male_responders": avg_b_cell,
     }
 
@@ -218,43 +180,35 @@ def build_cohort_flow(
     sex: str = "all",
     response: str = "all",
 ) -> pd.DataFrame:
-    frame = get_cell_frequency_data()
+    samples = get_sample_frame()
+    subject_col = "subject_pk" if "subject_pk" in samples.columns else "subject_id"
+    subject_codes, subjects = pd.factorize(samples[subject_col])
+
+    steps: list[tuple[str, np.ndarray]] = [
+        ("All samples", np.ones(len(samples), dtype=bool)),
+        (f"Condition={condition}", category_mask(samples["condition"], condition)),
+        (f"SampleType={sample_type}", category_mask(samples["sample_type"], sample_type)),
+        (f"Treatment={treatment}", category_mask(samples["treatment"], treatment)),
+    ]
+    if time_filter == "baseline_only":
+        steps.append(("Time=Baseline", samples["visit_time"].to_numpy() == 0))
+    else:
+        steps.append(("Time=All", np.ones(len(samples), dtype=bool)))
+    if sex != "all":
+        steps.append((f"Sex={sex}", np.asarray(samples["sex"] == sex)))
+    if response != "all":
+        steps.append((f"Response={response}", category_mask(samples["response"], response)))
 
+    # Each step narrows a running mask over the per-sample rows; no filtered frames are built.
     rows: list[dict[str, int | str]] = []
-
-    def add_step(label: str, current: pd.DataFrame) -> None:
-        subject_col = "subject_pk" if "subject_pk" in current.columns else "subject_id"
+    keep = np.ones(len(samples), dtype=bool)
+    for label, mask in steps:
+        keep &= mask
         rows.append(
             {
                 "step": label,
-                "n_samples": int(current["sample_id"].nunique()),
-                "n_subjects": int(current[subject_col].nunique()),
+                "n_samples": int(keep.sum()),
+                "n_subjects": int(np.count_nonzero(np.bincount(subject_codes[keep], minlength=len(subjects)))),
             }
         )
-
-    add_step("All samples", frame)
-
-    frame = cast(pd.DataFrame, frame.loc[frame["condition"].str.lower() == condition.lower()].copy())
-    add_step(f"Condition={condition}", frame)
-
-    frame = cast(pd.DataFrame, frame.loc[frame["sample_type"].str.lower() == sample_type.lower()].copy())
-    add_step(f"SampleType={sample_type}", frame)
-
-    frame = cast(pd.DataFrame, frame.loc[frame["treatment"].str.lower() == treatment.lower()].copy())
-    add_step(f"Treatment={treatment}", frame)
-
-    if time_filter == "baseline_only":
-        frame = cast(pd.DataFrame, frame.loc[frame["visit_time"] == 0].copy())
-        add_step("Time=Baseline", frame)
-    else:
-        add_step("Time=All", frame)
-
-    if sex != "all":
-        frame = cast(pd.DataFrame, frame.loc[frame["sex"] == sex].copy())
-        add_step(f"Sex={sex}", frame)
-
-    if response != "all":
-        frame = cast(pd.DataFrame, frame.loc[frame["response"] == response.lower()].copy())
-        add_step(f"Response={response}", frame)
-
     return pd.DataFrame(rows)
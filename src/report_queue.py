@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import threading
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any
+
+import pandas as pd
+
+from src.config import REPORT_CACHE_DIR, REPORT_CACHE_SIZE, REPORT_WORKERS
+from src.reporting import build_html_report, build_pdf_report
+
+REPORT_KINDS = ("html", "pdf")
+# "missing" means no build is queued and nothing is cached under the key, e.g. after the cache pruned it.
+REPORT_STATES = ("pending", "ready", "failed", "missing")
+
+_executor: ThreadPoolExecutor | None = None
+_jobs: dict[str, Future[str]] = {}
+# Build callables of queued and failed jobs, so a failed report can be retried under its key.
+_builds: dict[str, Callable[[], bytes]] = {}
+_jobs_lock = threading.Lock()
+
+
+def _figure_identity(fig: Any) -> str:
+    # The plotted values come from the same cohort as the statistics, so the traces' kind, name and
+    # point mode plus the axis labels identify a figure without serialising its data.
+    traces = [(trace.type, trace.name, getattr(trace, "boxpoints", None)) for trace in fig.data]
+    titles = (fig.layout.title.text, fig.layout.xaxis.title.text, fig.layout.yaxis.title.text)
+    return json.dumps([traces, titles], default=str)
+
+
+def report_key(
+    kind: str,
+    filters_text: str,
+    cohort_counts: dict[str, int],
+    summary: dict[str, str],
+    stats_df: pd.DataFrame,
+    fig: Any = None,
+) -> str:
+    # The key is computed on every dashboard rerun, so it hashes what a report is derived from rather
+    # than the report inputs in full: the cohort flow follows from the filters and counts.
+    if kind not in REPORT_KINDS:
+        raise ValueError(f"Unknown report kind: {kind}")
+    digest = hashlib.sha256()
+    parts = [kind, filters_text, json.dumps(cohort_counts, sort_keys=True), json.dumps(summary, sort_keys=True)]
+    # One row per population, so the statistics' CSV text is a cheap, exact identity.
+    parts.append(stats_df.to_csv(index=False))
+    if fig is not None:
+        parts.append(_figure_identity(fig))
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return f"{kind}-{digest.hexdigest()}"
+
+
+def _report_path(key: str) -> str:
+    kind = key.split("-", 1)[0]
+    return os.path.join(REPORT_CACHE_DIR, f"{key}.{kind}")
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=REPORT_WORKERS, thread_name_prefix="report")
+    return _executor
+
+
+def _prune_cache() -> None:
+    paths = [os.path.join(REPORT_CACHE_DIR, name) for name in os.listdir(REPORT_CACHE_DIR)]
+    reports = sorted((path for path in paths if not path.endswith(".tmp")), key=os.path.getmtime, reverse=True)
+    for path in reports[REPORT_CACHE_SIZE:]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _run_job(key: str, build: Callable[[], bytes]) -> str:
+    path = _report_path(key)
+    staging = f"{path}.{threading.get_ident()}.tmp"
+    with open(staging, "wb") as handle:
+        _ = handle.write(build())
+    # Readers only ever see complete reports: the file appears under its final name in one step.
+    os.replace(staging, path)
+    _prune_cache()
+    return path
+
+
+def _failed(job: Future[str]) -> bool:
+    return job.done() and job.exception() is not None
+
+
+def submit_report(key: str, build: Callable[[], bytes]) -> Future[str]:
+    os.makedirs(REPORT_CACHE_DIR, exist_ok=True)
+    path = _report_path(key)
+    with _jobs_lock:
+        job = _jobs.get(key)
+        if job is not None and not _failed(job):
+            return job
+        # Submitting a key whose build failed starts a fresh attempt.
+        _ = _jobs.pop(key, None)
+        _ = _builds.pop(key, None)
+        if os.path.exists(path):
+            # Repeat requests are answered from disk without touching the pool.
+            done: Future[str] = Future()
+            done.set_result(path)
+            return done
+        job = _get_executor().submit(_run_job, key, build)
+        _jobs[key] = job
+        _builds[key] = build
+        return job
+
+
+def retry_report(key: str) -> bool:
+    # False when no build is recorded for the key; the caller has to submit the report again.
+    with _jobs_lock:
+        build = _builds.get(key)
+    if build is None:
+        return False
+    _ = submit_report(key, build)
+    return True
+
+
+def submit_html_report(
+    filters_text: str,
+    cohort_counts: dict[str, int],
+    summary: dict[str, str],
+    stats_df: pd.DataFrame,
+    flow_df: pd.DataFrame,
+    fig: Any,
+) -> str:
+    # Queued reports are downloaded as a single file, so they embed plotly.js rather than using the
+    # lean archive layout.
+    key = report_key("html", filters_text, cohort_counts, summary, stats_df, fig)
+    _ = submit_report(key, lambda: build_html_report(filters_text, cohort_counts, summary, stats_df, flow_df, fig))
+    return key
+
+
+def submit_pdf_report(
+    filters_text: str,
+    cohort_counts: dict[str, int],
+    summary: dict[str, str],
+    stats_df: pd.DataFrame,
+    flow_df: pd.DataFrame,
+) -> str:
+    key = report_key("pdf", filters_text, cohort_counts, summary, stats_df)
+    _ = submit_report(key, lambda: build_pdf_report(filters_text, cohort_counts, summary, stats_df, flow_df))
+    return key
+
+
+def report_status(key: str) -> str:
+    with _jobs_lock:
+        job = _jobs.get(key)
+    if job is not None and not job.done():
+        return "pending"
+    if job is not None and _failed(job):
+        return "failed"
+    return "ready" if os.path.exists(_report_path(key)) else "missing"
+
+
+def report_result(key: str, timeout: float | None = 0) -> bytes | None:
+    # None while the report is still being built or when nothing is cached for the key. A failed build
+    # stays recorded and re-raises its exception on every call until the report is resubmitted.
+    with _jobs_lock:
+        job = _jobs.get(key)
+    if job is not None:
+        try:
+            _ = job.result(timeout=timeout)
+        except TimeoutError:
+            return None
+        with _jobs_lock:
+            if _jobs.get(key) is job:
+                _ = _jobs.pop(key)
+                _ = _builds.pop(key, None)
+    path = _report_path(key)
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as handle:
+        return handle.read()
@@ -1,10 +1,104 @@
+import os
+import threading
 from datetime import UTC, datetime
 from io import BytesIO
 from typing import Any
 
+import numpy as np
 import pandas as pd
+import plotly
+import plotly.graph_objects as go
 import plotly.io as pio
 
+# Lean reports load plotly.js from this file next to them instead of embedding the ~4.8 MB bundle.
+# The name carries the plotly version, so reports written after an upgrade never pick up an older
+# bundle that cannot render their figure JSON.
+PLOTLY_ASSET = f"plotly-{plotly.__version__}.min.js"
+# Box traces with at least this many points are drawn from precomputed quartiles in lean reports.
+BOX_SUMMARY_MIN_POINTS = 200
+# A4 landscape pages of at most this many table rows. Monospace glyphs advance 0.6 em (Courier,
+# DejaVu Sans Mono); the margin absorbs rounding.
+PDF_TABLE_ROWS_PER_PAGE = 40
+_PDF_PAGE_SIZE = (11.69, 8.27)
+_MONOSPACE_ADVANCE = 0.62
+_COLUMN_GAP = 3
+# Courier and Helvetica from the 14 standard PDF fonts: no glyph embedding or TrueType layout, which
+# makes long tables several times faster to write. They only cover cp1252 text, and their only weight
+# is "medium".
+_CORE_FONT_RC = {
+    "pdf.use14corefonts": True,
+    "font.family": "sans-serif",
+    "font.sans-serif": ["Helvetica"],
+    "font.monospace": ["Courier"],
+    "font.weight": "medium",
+    "figure.titleweight": "medium",
+}
+# rcParams are process-global, so PDF builds, which may switch fonts, run one at a time.
+_pdf_lock = threading.Lock()
+_BOX_STYLE = (
+    "name",
+    "legendgroup",
+    "offsetgroup",
+    "alignmentgroup",
+    "showlegend",
+    "marker",
+    "line",
+    "fillcolor",
+    "notched",
+    "orientation",
+    "xaxis",
+    "yaxis",
+)
+
+
+def write_plotly_asset(directory: str) -> str:
+    path = os.path.join(directory, PLOTLY_ASSET)
+    if not os.path.exists(path):
+        from plotly.offline import get_plotlyjs
+
+        os.makedirs(directory, exist_ok=True)
+        staging = f"{path}.{os.getpid()}.tmp"
+        with open(staging, "w", encoding="utf-8") as handle:
+            _ = handle.write(get_plotlyjs())
+        os.replace(staging, path)
+    return path
+
+
+def _box_summary(x: np.ndarray, y: np.ndarray) -> dict[str, list[Any]]:
+    keep = ~np.isnan(y)
+    codes, categories = pd.factorize(x[keep])
+    values = y[keep]
+    columns: dict[str, list[Any]] = {key: [] for key in ("x", "q1", "median", "q3", "lowerfence", "upperfence", "mean")}
+    for code, category in enumerate(categories):
+        group = values[codes == code]
+        q1, median, q3 = np.percentile(group, [25, 50, 75])
+        # Whiskers follow plotly's rule: the most extreme points within 1.5 IQR of the box.
+        iqr = q3 - q1
+        columns["x"].append(category)
+        columns["q1"].append(float(q1))
+        columns["median"].append(float(median))
+        columns["q3"].append(float(q3))
+        columns["lowerfence"].append(float(group[group >= q1 - 1.5 * iqr].min()))
+        columns["upperfence"].append(float(group[group <= q3 + 1.5 * iqr].max()))
+        columns["mean"].append(float(group.mean()))
+    return columns
+
+
+def summarize_box_traces(fig: Any, min_points: int = BOX_SUMMARY_MIN_POINTS) -> Any:
+    # Large box traces carry every unit-level value; the summary keeps a few numbers per box, so the
+    # serialized figure no longer grows with the cohort.
+    traces = []
+    for trace in fig.data:
+        if trace.type != "box" or trace.y is None or len(trace.y) < min_points:
+            traces.append(trace)
+            continue
+        y = np.asarray(trace.y, dtype=float)
+        x = np.asarray(trace.x if trace.x is not None else [trace.name] * len(y))
+        # Only styling is carried over; copying the trace itself would deep-copy the raw points.
+        style = {key: trace[key] for key in _BOX_STYLE if trace[key] is not None}
+        traces.append(go.Box(style, boxpoints=False, **_box_summary(x, y)))
+    return go.Figure(data=traces, layout=fig.layout)
+
 
 def build_html_report(
     filters_text: str,
@@ -13,11 +107,16 @@ def build_html_report(
     stats_df: pd.DataFrame,
     flow_df: pd.DataFrame,
     fig: Any,
+    lean: bool = False,
 ) -> bytes:
     generated_at = datetime.now(UTC).isoformat()
     stats_html = stats_df.to_html(index=False)
     flow_html = flow_df.to_html(index=False)
-    fig_html = pio.to_html(fig, full_html=False, include_plotlyjs=True)
+    if lean:
+        # Only renders next to PLOTLY_ASSET; write_html_archive keeps the two together.
+        fig_html = pio.to_html(summarize_box_traces(fig), full_html=False, include_plotlyjs=PLOTLY_ASSET)
+    else:
+        fig_html = pio.to_html(fig, full_html=False, include_plotlyjs=True)
 
     html = f"""
 <html>
@@ -54,6 +153,75 @@ def build_html_report(
     return html.encode("utf-8")
 
 
+def write_html_archive(
+    directory: str,
+    name: str,
+    filters_text: str,
+    cohort_counts: dict[str, int],
+    summary: dict[str, str],
+    stats_df: pd.DataFrame,
+    flow_df: pd.DataFrame,
+    fig: Any,
+) -> str:
+    # Archived reports are lean and share the directory's one copy of plotly.js, so every report in
+    # the directory opens offline from disk at a fraction of a self-contained report's size.
+    _ = write_plotly_asset(directory)
+    path = os.path.join(directory, f"{name}.html")
+    staging = f"{path}.{os.getpid()}.tmp"
+    with open(staging, "wb") as handle:
+        _ = handle.write(build_html_report(filters_text, cohort_counts, summary, stats_df, flow_df, fig, lean=True))
+    os.replace(staging, path)
+    return path
+
+
+def _format_column(values: pd.Series) -> list[str]:
+    # Missing values print as blanks; floats are shortened so wide tables still fit the page.
+    if pd.api.types.is_float_dtype(values.dtype):
+        return ["" if pd.isna(value) else f"{value:.6g}" for value in values.tolist()]
+    return ["" if pd.isna(value) else str(value) for value in values.tolist()]
+
+
+def _core_font_text(filters_text: str, summary: dict[str, str], *frames: pd.DataFrame) -> bool:
+    parts = [filters_text, *summary.values()]
+    for frame in frames:
+        parts.extend(str(column) for column in frame.columns)
+        # Only text columns can hold characters outside cp1252; numbers always encode.
+        for column in frame.select_dtypes(exclude="number").columns:
+            parts.extend(str(value) for value in pd.unique(frame[column]))
+    try:
+        _ = "\n".join(parts).encode("cp1252")
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def _write_table_pages(pdf: Any, frame: pd.DataFrame, title: str, fontsize: float) -> None:
+    from matplotlib.figure import Figure
+
+    columns = [[str(column), *_format_column(frame[column])] for column in frame.columns]
+    n_pages = max(1, -(-len(frame) // PDF_TABLE_ROWS_PER_PAGE))
+    for page in range(n_pages):
+        start = 1 + page * PDF_TABLE_ROWS_PER_PAGE
+        blocks = [[column[0], *column[start : start + PDF_TABLE_ROWS_PER_PAGE]] for column in columns]
+        widths = [max(len(value) for value in block) for block in blocks]
+        # One monospace text artist per column keeps layout cost linear in rows, where ax.table
+        # lays out every cell separately; the font shrinks until the widest page fits.
+        page_width = _PDF_PAGE_SIZE[0] * 72 * 0.96
+        size = min(fontsize, page_width / (_MONOSPACE_ADVANCE * max(1, sum(widths) + _COLUMN_GAP * len(widths))))
+        fig = Figure(figsize=_PDF_PAGE_SIZE)
+        title_suffix = f" (page {page + 1} of {n_pages})" if n_pages > 1 else ""
+        _ = fig.suptitle(f"{title}{title_suffix}", fontsize=12)
+        x = 0.02
+        for block, width in zip(blocks, widths):
+            lines = [block[0], "-" * width, *block[1:]]
+            _ = fig.text(
+                x, 0.92, "\n".join(lines), va="top", family="monospace", fontsize=size, linespacing=1.3, parse_math=False
+            )
+            x += (width + _COLUMN_GAP) * _MONOSPACE_ADVANCE * size / (_PDF_PAGE_SIZE[0] * 72)
+        # Each page is written and released before the next one is laid out.
+        pdf.savefig(fig)
+
+
 def build_pdf_report(
     filters_text: str,
     cohort_counts: dict[str, int],
@@ -61,13 +229,16 @@ def build_pdf_report(
     stats_df: pd.DataFrame,
     flow_df: pd.DataFrame,
 ) -> bytes:
-    import matplotlib.pyplot as plt
+    import matplotlib
     from matplotlib.backends.backend_pdf import PdfPages
+    from matplotlib.figure import Figure
 
     buffer = BytesIO()
-    with PdfPages(buffer) as pdf:
-        fig1, ax1 = plt.subplots(figsize=(8.27, 11.69))
-        ax1.axis("off")
+    rc = _CORE_FONT_RC if _core_font_text(filters_text, summary, stats_df, flow_df) else {}
+    with _pdf_lock, matplotlib.rc_context(rc), PdfPages(buffer) as pdf:
+        # Figures are built without pyplot, whose global figure registry is not safe to use from
+        # the report queue's worker threads.
+        fig1 = Figure(figsize=(8.27, 11.69))
 
         lines = [
             "Loblaw Bio Clinical Trial Report",
@@ -80,9 +251,8 @@ def build_pdf_report(
                 f"| Unit={summary['unit']} | Metric={summary['metric']} | Transform={summary['transform_label']}"
             ),
         ]
-        ax1.text(0.02, 0.98, "\n".join(lines), va="top", family="monospace", fontsize=10)
+        _ = fig1.text(0.02, 0.98, "\n".join(lines), va="top", family="monospace", fontsize=10)
         pdf.savefig(fig1, bbox_inches="tight")
-        plt.close(fig1)
 
         stats_cols = [
             "cell_type",
@@ -97,39 +267,9 @@ def build_pdf_report(
             "q_value",
             "significant",
         ]
-        stats_table = stats_df.reindex(columns=stats_cols).copy()
-        if len(stats_table) == 0:
-            stats_table = pd.DataFrame({col: [] for col in stats_cols})
-        stats_table = stats_table.fillna("")
-
-        fig2, ax2 = plt.subplots(figsize=(11.69, 8.27))
-        ax2.axis("off")
-        table = ax2.table(
-            cellText=stats_table.astype(str).values.tolist(),
-            colLabels=stats_table.columns.tolist(),
-            loc="center",
-        )
-        table.auto_set_font_size(False)
-        table.set_fontsize(8)
-        table.scale(1, 1.2)
-        ax2.set_title("Part 3 Statistical Results", fontsize=12)
-        pdf.savefig(fig2, bbox_inches="tight")
-        plt.close(fig2)
-
-        flow_table = flow_df.fillna("")
-        fig3, ax3 = plt.subplots(figsize=(11.69, 8.27))
-        ax3.axis("off")
-        flow = ax3.table(
-            cellText=flow_table.astype(str).values.tolist(),
-            colLabels=flow_table.columns.tolist(),
-            loc="center",
-        )
-        flow.auto_set_font_size(False)
-        flow.set_fontsize(9)
-        flow.scale(1, 1.3)
-        ax3.set_title("Cohort Flow", fontsize=12)
-        pdf.savefig(fig3, bbox_inches="tight")
-        plt.close(fig3)
+        stats_table = stats_df.reindex(columns=stats_cols)
+        _write_table_pages(pdf, stats_table, "Part 3 Statistical Results", fontsize=8)
+        _write_table_pages(pdf, flow_df, "Cohort Flow", fontsize=9)
 
     buffer.seek(0)
     return buffer.getvalue()
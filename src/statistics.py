@@ -1,3 +1,6 @@
+import warnings
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
 from typing import cast
 
 import numpy as np
@@ -6,6 +9,12 @@ from scipy import stats
 
 from src.analysis import apply_clr_transform, get_filtered_data, prepare_unit_level_data
 
+# Shuffles are drawn in fixed-size batches, each from its own SeedSequence child, so permutation
+# p-values depend only on the seed and never on how batches are spread across workers.
+PERMUTATION_BATCH_SIZE = 1000
+
+_TEST_LABELS = {"mannwhitney": "Mann-Whitney U", "welch_t": "Welch t-test", "permutation": "Permutation (rank-sum)"}
+
 
 def _bh_fdr_adjust(p_values: list[float | None]) -> list[float | None]:
     indexed = [(idx, p) for idx, p in enumerate(p_values) if p is not None]
@@ -33,14 +42,12 @@ def _cliffs_delta(group_yes: list[float], group_no: list[float]) -> float:
     total = len(group_yes) * len(group_no)
     if total == 0:
         return 0.0
-    gt = 0
-    lt = 0
-    for a in group_yes:
-        for b in group_no:
-            if a > b:
-                gt += 1
-            elif a < b:
-                lt += 1
+    yes = np.asarray(group_yes, dtype=float)
+    no = np.sort(np.asarray(group_no, dtype=float))
+    # For each responder value, searchsorted counts the non-responder values strictly below
+    # (left edge) and at-or-below (right edge); ties fall between the two and count for neither.
+    gt = int(np.searchsorted(no, yes, side="left").sum())
+    lt = int((no.size - np.searchsorted(no, yes, side="right")).sum())
     return (gt - lt) / total
 
 
@@ -51,142 +58,367 @@ def _bootstrap_diff_ci(
     statistic: str,
     iterations: int,
     seed: int,
+    max_memory_mb: float = 64.0,
 ) -> tuple[float | None, float | None]:
+    if max_memory_mb <= 0:
+        raise ValueError("max_memory_mb must be positive")
     if not group_yes or not group_no or iterations <= 0:
         return None, None
 
-    yes = np.array(group_yes, dtype=float)
-    no = np.array(group_no, dtype=float)
-    rng = np.random.default_rng(seed)
+    yes = np.asarray(group_yes, dtype=float)
+    no = np.asarray(group_no, dtype=float)
+    reduce = np.mean if statistic == "mean" else np.median
+
+    # Each arm draws from its own stream so the resamples do not depend on the chunk size.
+    yes_rng, no_rng = (np.random.default_rng(child) for child in np.random.SeedSequence(seed).spawn(2))
+
+    # A resample row holds an int64 index, the gathered float64 value and the median's partition copy.
+    row_bytes = (yes.size + no.size) * 24
+    chunk_size = int(min(iterations, max(1, (max_memory_mb * 1024 * 1024) // row_bytes)))
 
     boot = np.empty(iterations, dtype=float)
-    for idx in range(iterations):
-        yes_sample = rng.choice(yes, size=yes.size, replace=True)
-        no_sample = rng.choice(no, size=no.size, replace=True)
-        if statistic == "mean":
-            boot[idx] = float(yes_sample.mean() - no_sample.mean())
-        else:
-            boot[idx] = float(np.median(yes_sample) - np.median(no_sample))
+    for start in range(0, iterations, chunk_size):
+        stop = min(start + chunk_size, iterations)
+        yes_idx = yes_rng.integers(0, yes.size, size=(stop - start, yes.size))
+        no_idx = no_rng.integers(0, no.size, size=(stop - start, no.size))
+        boot[start:stop] = reduce(yes[yes_idx], axis=1) - reduce(no[no_idx], axis=1)
 
     lower = float(np.quantile(boot, 0.025))
     upper = float(np.quantile(boot, 0.975))
     return lower, upper
 
 
-def compare_responders(
-    condition: str = "melanoma",
-    treatment: str = "miraclib",
-    sample_type: str = "PBMC",
-    time_filter: str = "baseline_only",
-    unit: str = "subject",
-    metric: str = "percentage",
-    transform: str = "none",
-    test: str = "mannwhitney",
-    correction: str = "bh_fdr",
-    bootstrap_iterations: int = 1000,
-    bootstrap_seed: int = 42,
-) -> tuple[pd.DataFrame, pd.DataFrame, dict[str, str]]:
-    df = get_filtered_data(condition, treatment, sample_type, time_filter=time_filter)
-    plot_df = prepare_unit_level_data(df, unit=unit, metric=metric)
-    if transform == "clr":
-        plot_df = apply_clr_transform(plot_df)
-    plot_df = cast(pd.DataFrame, plot_df)
-    plot_df = cast(pd.DataFrame, plot_df.loc[plot_df["response"].isin(["yes", "no"])].copy())
-
-    results = []
-    cell_series = cast(pd.Series, plot_df.loc[:, "cell_type"])
-    cell_types = sorted(set(cell_series.dropna().astype(str).tolist()))
-    ci_stat = "mean" if test == "welch_t" else "median"
+def _resample_reduce(sampled: np.ndarray, padded: bool, statistic: str) -> np.ndarray:
+    # sampled is (cell types x resamples x units); reducing the contiguous last axis gives
+    # (cell types x resamples).
+    if not padded:
+        return np.mean(sampled, axis=2) if statistic == "mean" else np.median(sampled, axis=2)
 
-    for cell_idx, cell in enumerate(cell_types):
-        subset = cast(pd.DataFrame, plot_df.loc[plot_df.loc[:, "cell_type"] == cell].copy())
-        group_yes = cast(pd.Series, subset.loc[subset["response"] == "yes", "metric_value"]).tolist()
-        group_no = cast(pd.Series, subset.loc[subset["response"] == "no", "metric_value"]).tolist()
-
-        n_yes = len(group_yes)
-        n_no = len(group_no)
-        median_yes = float(pd.Series(group_yes).median()) if group_yes else None
-        median_no = float(pd.Series(group_no).median()) if group_no else None
-        mean_yes = float(pd.Series(group_yes).mean()) if group_yes else None
-        mean_no = float(pd.Series(group_no).mean()) if group_no else None
-
-        median_diff = None
-        mean_diff = None
-        direction = "undetermined"
-        if median_yes is not None and median_no is not None:
-            median_diff = float(median_yes - median_no)
-            if median_diff > 0:
-                direction = "higher_in_responders"
-            elif median_diff < 0:
-                direction = "higher_in_non_responders"
-            else:
-                direction = "no_difference"
-        if mean_yes is not None and mean_no is not None:
-            mean_diff = float(mean_yes - mean_no)
-
-        ci_low, ci_high = _bootstrap_diff_ci(
-            group_yes,
-            group_no,
-            statistic=ci_stat,
-            iterations=bootstrap_iterations,
-            seed=bootstrap_seed + cell_idx,
+    # Columns with missing values are padded with NaN up to the arm size; the padding is masked out,
+    # so each column reduces over exactly its own measured units.
+    valid = ~np.isnan(sampled)
+    n_valid = valid.sum(axis=2, keepdims=True)
+    if statistic == "mean":
+        return np.where(valid, sampled, 0.0).sum(axis=2) / n_valid[..., 0]
+    ordered = np.sort(np.where(valid, sampled, np.inf), axis=2)
+    lower = np.take_along_axis(ordered, (n_valid - 1) // 2, axis=2)[..., 0]
+    upper = np.take_along_axis(ordered, n_valid // 2, axis=2)[..., 0]
+    return (lower + upper) / 2
+
+
+def _draw_resamples(values: np.ndarray, rngs: list[np.random.Generator], size: int) -> tuple[np.ndarray, bool]:
+    # Each column draws from its own generator over its own measured rows, exactly as a per-column
+    # _bootstrap_diff_ci call would; slots past a column's measured count are NaN padding.
+    n_units, n_columns = values.shape
+    sampled = np.full((n_columns, size, n_units), np.nan)
+    padded = False
+    for column, rng in enumerate(rngs):
+        measured = values[~np.isnan(values[:, column]), column]
+        sampled[column, :, : measured.size] = measured[rng.integers(0, measured.size, size=(size, measured.size))]
+        padded = padded or measured.size < n_units
+    return sampled, padded
+
+
+def _bootstrap_diff_ci_columns(
+    yes: np.ndarray,
+    no: np.ndarray,
+    *,
+    statistic: str,
+    iterations: int,
+    seed: int,
+    max_memory_mb: float = 64.0,
+) -> tuple[np.ndarray, np.ndarray]:
+    # Column idx uses seed + idx, so every population gets an independent stream and the interval
+    # _bootstrap_diff_ci gives its measured values with that seed; only the reductions are batched.
+    if max_memory_mb <= 0:
+        raise ValueError("max_memory_mb must be positive")
+    low = np.full(yes.shape[1], np.nan)
+    high = np.full(yes.shape[1], np.nan)
+    present = (~np.isnan(yes)).any(axis=0) & (~np.isnan(no)).any(axis=0)
+    if iterations <= 0 or not present.any():
+        return low, high
+
+    # A column block holds, per resample, unit and cell type, the gathered float64 value, its
+    # validity mask and the masked and sorted copies the median takes. Every column draws all of its
+    # resamples in one call, so splitting the columns into blocks does not change the draws.
+    column_bytes = (yes.shape[0] + no.shape[0]) * iterations * 25
+    block_size = int(max(1, (max_memory_mb * 1024 * 1024) // column_bytes))
+
+    columns = np.flatnonzero(present)
+    for start in range(0, columns.size, block_size):
+        block = columns[start : start + block_size]
+        streams = [np.random.SeedSequence(seed + int(column)).spawn(2) for column in block]
+        yes_stat, no_stat = (
+            _resample_reduce(
+                *_draw_resamples(values[:, block], [np.random.default_rng(s[arm]) for s in streams], iterations),
+                statistic,
+            )
+            for arm, values in enumerate((yes, no))
         )
+        boot = yes_stat - no_stat
+        low[block] = np.quantile(boot, 0.025, axis=1)
+        high[block] = np.quantile(boot, 0.975, axis=1)
+    return low, high
 
-        if group_yes and group_no:
-            if test == "welch_t":
-                test_result = stats.ttest_ind(group_yes, group_no, equal_var=False)
-                p_value = cast(float, test_result[1])
-                stat_score = cast(float, test_result[0])
-                effect = float(pd.Series(group_yes).mean() - pd.Series(group_no).mean())
-                effect_label = "mean_diff"
-            else:
-                stat, p_val = stats.mannwhitneyu(group_yes, group_no, alternative="two-sided")
-                p_value = float(p_val)
-                stat_score = float(stat)
-                effect = float((2 * stat_score) / (n_yes * n_no) - 1)
-                effect_label = "rank_biserial"
-            cliffs = _cliffs_delta(group_yes, group_no)
+
+def _pivot_by_response(plot_df: pd.DataFrame) -> tuple[list[str], np.ndarray, np.ndarray]:
+    frame = cast(pd.DataFrame, plot_df.loc[plot_df["cell_type"].notna()])
+    wide = cast(
+        pd.DataFrame,
+        frame.pivot(index=["unit_id", "response"], columns="cell_type", values="metric_value"),
+    )
+    wide.columns = wide.columns.astype(str)
+    wide = wide.reindex(columns=sorted(wide.columns))
+    values = wide.to_numpy(dtype=float)
+    is_yes = np.asarray(wide.index.get_level_values("response") == "yes")
+    return wide.columns.tolist(), values[is_yes], values[~is_yes]
+
+
+def _mannwhitney_columns(yes: np.ndarray, no: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    if np.isnan(yes).any() or np.isnan(no).any():
+        result = stats.mannwhitneyu(yes, no, alternative="two-sided", axis=0, nan_policy="omit")
+        return np.asarray(result.statistic, dtype=float), np.asarray(result.pvalue, dtype=float)
+
+    if yes.shape[0] > 8 and no.shape[0] > 8:
+        result = stats.mannwhitneyu(yes, no, alternative="two-sided", axis=0, method="asymptotic")
+        return np.asarray(result.statistic, dtype=float), np.asarray(result.pvalue, dtype=float)
+
+    # scipy's "auto" method looks for ties across the whole batch, so small arms are split by
+    # per-column ties to pick the same exact/asymptotic method a per-column call would.
+    ordered = np.sort(np.vstack([yes, no]), axis=0)
+    tied = (np.diff(ordered, axis=0) == 0).any(axis=0)
+    stat = np.empty(yes.shape[1], dtype=float)
+    p_value = np.empty(yes.shape[1], dtype=float)
+    for method, columns in (("asymptotic", tied), ("exact", ~tied)):
+        if columns.any():
+            result = stats.mannwhitneyu(
+                yes[:, columns], no[:, columns], alternative="two-sided", axis=0, method=method
+            )
+            stat[columns] = result.statistic
+            p_value[columns] = result.pvalue
+    return stat, p_value
+
+
+def _abs_rank_biserial(ranks: np.ndarray, valid: np.ndarray, labels: np.ndarray) -> np.ndarray:
+    # labels is (permutations x units) with 1 for responders; one matrix product per term gives
+    # every permutation's rank sum and arm size for all cell types at once.
+    n_yes = labels @ valid
+    n_no = valid.sum(axis=0) - n_yes
+    u_yes = labels @ ranks - n_yes * (n_yes + 1) / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.abs((2 * u_yes) / (n_yes * n_no) - 1)
+
+
+def _permutation_exceedances(
+    ranks: np.ndarray,
+    valid: np.ndarray,
+    n_yes: int,
+    observed: np.ndarray,
+    seed: np.random.SeedSequence,
+    size: int,
+    max_memory_mb: float,
+) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    # A shuffle row holds the float64 labels and their permuted copy per unit plus a handful of
+    # float64 per-cell-type sums. Rows are shuffled one after another from the same generator, so
+    # splitting a batch into memory-bounded chunks does not change the draws.
+    row_bytes = ranks.shape[0] * 16 + ranks.shape[1] * 48
+    chunk_size = int(min(size, max(1, (max_memory_mb * 1024 * 1024) // row_bytes)))
+
+    exceedances = np.zeros(ranks.shape[1], dtype=np.int64)
+    for start in range(0, size, chunk_size):
+        labels = np.zeros((min(chunk_size, size - start), ranks.shape[0]))
+        labels[:, :n_yes] = 1.0
+        permuted = _abs_rank_biserial(ranks, valid, rng.permuted(labels, axis=1))
+        # Shuffles that leave an arm empty (only possible with missing values) count as extreme.
+        exceedances += np.count_nonzero(~(permuted < observed - 1e-12), axis=0)
+    return exceedances
+
+
+def _permutation_columns(
+    yes: np.ndarray,
+    no: np.ndarray,
+    *,
+    iterations: int,
+    seed: int,
+    workers: int | None,
+    max_memory_mb: float = 64.0,
+) -> tuple[np.ndarray, np.ndarray]:
+    if iterations <= 0:
+        raise ValueError("permutation_iterations must be positive")
+
+    # Ranks of the pooled values do not change when labels are shuffled, so they are computed once
+    # and each permutation only re-sums them.
+    pooled = np.vstack([yes, no])
+    valid = (~np.isnan(pooled)).astype(float)
+    ranks = np.nan_to_num(stats.rankdata(pooled, axis=0, nan_policy="omit"))
+    labels = np.zeros((1, pooled.shape[0]))
+    labels[0, : yes.shape[0]] = 1.0
+    observed = _abs_rank_biserial(ranks, valid, labels)[0]
+    n_yes = valid[: yes.shape[0]].sum(axis=0)
+    u_yes = ranks[: yes.shape[0]].sum(axis=0) - n_yes * (n_yes + 1) / 2
+
+    sizes = [min(PERMUTATION_BATCH_SIZE, iterations - start) for start in range(0, iterations, PERMUTATION_BATCH_SIZE)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    batch_args = (
+        [ranks] * len(sizes),
+        [valid] * len(sizes),
+        [yes.shape[0]] * len(sizes),
+        [observed] * len(sizes),
+        seeds,
+        sizes,
+        [max_memory_mb] * len(sizes),
+    )
+    if workers != 1 and len(sizes) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            exceedances = sum(pool.map(_permutation_exceedances, *batch_args))
+    else:
+        exceedances = sum(map(_permutation_exceedances, *batch_args))
+
+    # The observed labelling counts as one of the permutations, so p is never exactly zero.
+    return u_yes, (1 + np.asarray(exceedances)) / (1 + iterations)
+
+
+def _cliffs_delta_columns(yes: np.ndarray, no: np.ndarray) -> np.ndarray:
+    n_yes = np.count_nonzero(~np.isnan(yes), axis=0)
+    n_no = np.count_nonzero(~np.isnan(no), axis=0)
+    ranks = stats.rankdata(np.vstack([yes, no]), axis=0, nan_policy="omit")
+    u_yes = np.nansum(ranks[: yes.shape[0]], axis=0) - n_yes * (n_yes + 1) / 2
+    return (2 * u_yes) / (n_yes * n_no) - 1
+
+
+def _optional(values: np.ndarray, present: np.ndarray) -> list[float | None]:
+    return [float(value) if keep else None for value, keep in zip(values.tolist(), present.tolist())]
+
+
+def _compare_matrices(
+    cell_types: list[str],
+    yes: np.ndarray,
+    no: np.ndarray,
+    *,
+    test: str,
+    ci_stat: str,
+    bootstrap_iterations: int,
+    bootstrap_seed: int,
+    bootstrap_max_memory_mb: float,
+    permutation_iterations: int = 10_000,
+    permutation_seed: int = 42,
+    permutation_workers: int | None = 1,
+    permutation_max_memory_mb: float = 64.0,
+) -> pd.DataFrame:
+    if not cell_types:
+        return pd.DataFrame([])
+
+    n_yes = np.count_nonzero(~np.isnan(yes), axis=0)
+    n_no = np.count_nonzero(~np.isnan(no), axis=0)
+    has_yes = n_yes > 0
+    has_no = n_no > 0
+    testable = has_yes & has_no
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        median_yes = np.nanmedian(yes, axis=0)
+        median_no = np.nanmedian(no, axis=0)
+        mean_yes = np.nanmean(yes, axis=0)
+        mean_no = np.nanmean(no, axis=0)
+    median_diff = median_yes - median_no
+    mean_diff = mean_yes - mean_no
+    direction = np.where(
+        testable,
+        np.select(
+            [median_diff > 0, median_diff < 0],
+            ["higher_in_responders", "higher_in_non_responders"],
+            default="no_difference",
+        ),
+        "undetermined",
+    )
+
+    p_value = np.full(len(cell_types), np.nan)
+    stat_score = np.full(len(cell_types), np.nan)
+    effect = np.full(len(cell_types), np.nan)
+    cliffs = np.full(len(cell_types), np.nan)
+    if testable.any():
+        yes_testable = yes[:, testable]
+        no_testable = no[:, testable]
+        if test == "welch_t":
+            result = stats.ttest_ind(yes_testable, no_testable, axis=0, equal_var=False, nan_policy="omit")
+            stat_score[testable] = result.statistic
+            p_value[testable] = result.pvalue
+            effect[testable] = mean_diff[testable]
         else:
-            p_value = None
-            stat_score = None
-            effect = None
-            cliffs = None
-            effect_label = "rank_biserial" if test == "mannwhitney" else "mean_diff"
-
-        results.append(
-            {
-                "cell_type": cell,
-                "n_yes": n_yes,
-                "n_no": n_no,
-                "p_value": p_value,
-                "stat_score": stat_score,
-                "median_yes": median_yes,
-                "median_no": median_no,
-                "median_diff": median_diff,
-                "mean_diff": mean_diff,
-                "direction": direction,
-                "ci_target": f"{ci_stat}_diff",
-                "ci_95_low": ci_low,
-                "ci_95_high": ci_high,
-                "effect": effect,
-                "effect_label": effect_label,
-                "cliffs_delta": cliffs,
-                "avg_responder": mean_yes,
-                "avg_non_responder": mean_no,
-            }
-        )
+            if test == "permutation":
+                stat, p_val = _permutation_columns(
+                    yes_testable,
+                    no_testable,
+                    iterations=permutation_iterations,
+                    seed=permutation_seed,
+                    workers=permutation_workers,
+                    max_memory_mb=permutation_max_memory_mb,
+                )
+            else:
+                stat, p_val = _mannwhitney_columns(yes_testable, no_testable)
+            stat_score[testable] = stat
+            p_value[testable] = p_val
+            effect[testable] = (2 * stat) / (n_yes[testable] * n_no[testable]) - 1
+        cliffs[testable] = _cliffs_delta_columns(yes_testable, no_testable)
 
-    stats_df = pd.DataFrame(results)
-    if len(stats_df) == 0:
-        summary = {
-            "test_label": "Welch t-test" if test == "welch_t" else "Mann-Whitney U",
-            "correction_label": "None" if correction == "none" else "BH-FDR",
-            "unit": unit,
-            "metric": metric,
-            "transform_label": "CLR" if transform == "clr" else "Raw",
-            "bootstrap_ci": f"95% bootstrap CI on {ci_stat} difference ({bootstrap_iterations} resamples)",
+    ci_low, ci_high = _bootstrap_diff_ci_columns(
+        yes,
+        no,
+        statistic=ci_stat,
+        iterations=bootstrap_iterations,
+        seed=bootstrap_seed,
+        max_memory_mb=bootstrap_max_memory_mb,
+    )
+
+    return pd.DataFrame(
+        {
+            "cell_type": cell_types,
+            "n_yes": n_yes.tolist(),
+            "n_no": n_no.tolist(),
+            "p_value": _optional(p_value, testable),
+            "stat_score": _optional(stat_score, testable),
+            "median_yes": _optional(median_yes, has_yes),
+            "median_no": _optional(median_no, has_no),
+            "median_diff": _optional(median_diff, testable),
+            "mean_diff": _optional(mean_diff, testable),
+            "direction": direction.tolist(),
+            "ci_target": f"{ci_stat}_diff",
+            "ci_95_low": _optional(ci_low, ~np.isnan(ci_low)),
+            "ci_95_high": _optional(ci_high, ~np.isnan(ci_high)),
+            "effect": _optional(effect, testable),
+            "effect_label": "mean_diff" if test == "welch_t" else "rank_biserial",
+            "cliffs_delta": _optional(cliffs, testable),
+            "avg_responder": _optional(mean_yes, has_yes),
+            "avg_non_responder": _optional(mean_no, has_no),
         }
-        return stats_df, cast(pd.DataFrame, plot_df), summary
+    )
+
+
+def _summary(
+    *,
+    test: str,
+    correction: str,
+    unit: str,
+    metric: str,
+    transform: str,
+    bootstrap_iterations: int,
+) -> dict[str, str]:
+    ci_stat = "mean" if test == "welch_t" else "median"
+    return {
+        "test_label": _TEST_LABELS.get(test, _TEST_LABELS["mannwhitney"]),
+        "correction_label": "None" if correction == "none" else "BH-FDR",
+        "unit": unit,
+        "metric": metric,
+        "transform_label": "CLR" if transform == "clr" else "Raw",
+        "bootstrap_ci": f"95% bootstrap CI on {ci_stat} difference ({bootstrap_iterations} resamples)",
+    }
+
+
+def _apply_correction(stats_df: pd.DataFrame, correction: str) -> pd.DataFrame:
+    stats_df = stats_df.copy()
+    if len(stats_df) == 0:
+        return stats_df
 
     if correction == "none":
         stats_df["q_value"] = stats_df["p_value"]
@@ -194,15 +426,108 @@ def compare_responders(
         stats_df["q_value"] = _bh_fdr_adjust(stats_df["p_value"].tolist())
 
     stats_df["significant"] = stats_df["q_value"].apply(lambda q: bool(q is not None and q < 0.05))
-    stats_df = stats_df.sort_values(by=["q_value", "p_value"], na_position="last").reset_index(drop=True)
+    return stats_df.sort_values(by=["q_value", "p_value"], na_position="last").reset_index(drop=True)
 
-    summary = {
-        "test_label": "Welch t-test" if test == "welch_t" else "Mann-Whitney U",
-        "correction_label": "None" if correction == "none" else "BH-FDR",
-        "unit": unit,
-        "metric": metric,
-        "transform_label": "CLR" if transform == "clr" else "Raw",
-        "bootstrap_ci": f"95% bootstrap CI on {'mean' if test == 'welch_t' else 'median'} difference ({bootstrap_iterations} resamples)",
-    }
 
-    return stats_df, cast(pd.DataFrame, plot_df), summary
+def compare_responders_scenarios(
+    scenarios: Sequence[tuple[str, str, str, str, str]],
+    condition: str = "melanoma",
+    treatment: str = "miraclib",
+    sample_type: str = "PBMC",
+    metric: str = "percentage",
+    bootstrap_iterations: int = 1000,
+    bootstrap_seed: int = 42,
+    bootstrap_max_memory_mb: float = 64.0,
+    permutation_iterations: int = 10_000,
+    permutation_seed: int = 42,
+    permutation_workers: int | None = 1,
+    permutation_max_memory_mb: float = 64.0,
+) -> list[tuple[pd.DataFrame, pd.DataFrame, dict[str, str]]]:
+    # Scenarios are (time_filter, test, correction, unit, transform). The cohort is fetched once and
+    # unit-level matrices / uncorrected statistics are shared by scenarios that only differ later on.
+    time_filters = {scenario[0] for scenario in scenarios}
+    fetch_filter = time_filters.pop() if len(time_filters) == 1 else "all"
+    cohort = get_filtered_data(condition, treatment, sample_type, time_filter=fetch_filter)
+
+    frames: dict[str, pd.DataFrame] = {fetch_filter: cohort}
+    unit_frames: dict[tuple[str, str, str], tuple[pd.DataFrame, list[str], np.ndarray, np.ndarray]] = {}
+    raw_stats: dict[tuple[str, str, str, str], pd.DataFrame] = {}
+    results: list[tuple[pd.DataFrame, pd.DataFrame, dict[str, str]]] = []
+
+    for time_filter, test, correction, unit, transform in scenarios:
+        if time_filter not in frames:
+            is_baseline = time_filter == "baseline_only"
+            frames[time_filter] = cast(pd.DataFrame, cohort.loc[cohort["visit_time"] == 0]) if is_baseline else cohort
+
+        unit_key = (time_filter, unit, transform)
+        if unit_key not in unit_frames:
+            plot_df = prepare_unit_level_data(frames[time_filter], unit=unit, metric=metric)
+            if transform == "clr":
+                plot_df = apply_clr_transform(plot_df)
+            plot_df = cast(pd.DataFrame, plot_df.loc[plot_df["response"].isin(["yes", "no"])].copy())
+            unit_frames[unit_key] = (plot_df, *_pivot_by_response(plot_df))
+        plot_df, cell_types, yes_matrix, no_matrix = unit_frames[unit_key]
+
+        ci_stat = "mean" if test == "welch_t" else "median"
+        stats_key = (time_filter, unit, transform, test)
+        if stats_key not in raw_stats:
+            raw_stats[stats_key] = _compare_matrices(
+                cell_types,
+                yes_matrix,
+                no_matrix,
+                test=test,
+                ci_stat=ci_stat,
+                bootstrap_iterations=bootstrap_iterations,
+                bootstrap_seed=bootstrap_seed,
+                bootstrap_max_memory_mb=bootstrap_max_memory_mb,
+                permutation_iterations=permutation_iterations,
+                permutation_seed=permutation_seed,
+                permutation_workers=permutation_workers,
+                permutation_max_memory_mb=permutation_max_memory_mb,
+            )
+
+        summary = _summary(
+            test=test,
+            correction=correction,
+            unit=unit,
+            metric=metric,
+            transform=transform,
+            bootstrap_iterations=bootstrap_iterations,
+        )
+        results.append((_apply_correction(raw_stats[stats_key], correction), plot_df, summary))
+
+    return results
+
+
+def compare_responders(
+    condition: str = "melanoma",
+    treatment: str = "miraclib",
+    sample_type: str = "PBMC",
+    time_filter: str = "baseline_only",
+    unit: str = "subject",
+    metric: str = "percentage",
+    transform: str = "none",
+    test: str = "mannwhitney",
+    correction: str = "bh_fdr",
+    bootstrap_iterations: int = 1000,
+    bootstrap_seed: int = 42,
+    bootstrap_max_memory_mb: float = 64.0,
+    permutation_iterations: int = 10_000,
+    permutation_seed: int = 42,
+    permutation_workers: int | None = 1,
+    permutation_max_memory_mb: float = 64.0,
+) -> tuple[pd.DataFrame, pd.DataFrame, dict[str, str]]:
+    return compare_responders_scenarios(
+        [(time_filter, test, correction, unit, transform)],
+        condition=condition,
+        treatment=treatment,
+        sample_type=sample_type,
+        metric=metric,
+        bootstrap_iterations=bootstrap_iterations,
+        bootstrap_seed=bootstrap_seed,
+        bootstrap_max_memory_mb=bootstrap_max_memory_mb,
+        permutation_iterations=permutation_iterations,
+        permutation_seed=permutation_seed,
+        permutation_workers=permutation_workers,
+        permutation_max_memory_mb=permutation_max_memory_mb,
+    )[0]
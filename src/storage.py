@@ -0,0 +1,199 @@
+import functools
+import glob
+import operator
+import os
+import shutil
+import threading
+from collections.abc import Callable
+from typing import cast
+from urllib.parse import unquote
+
+import numpy as np
+import pandas as pd
+
+from src.config import MATRIX_DIR, PARQUET_DIR, STORAGE_BACKEND
+from src.database import get_data_version
+from src.matrix_cache import (
+    CountMatrix,
+    cohort_rows,
+    long_frame,
+    read_count_matrix,
+    write_count_matrix,
+)
+
+STORAGE_BACKENDS = ("sqlite", "parquet", "matrix")
+
+PARTITION_COLUMNS = ["project_id", "condition"]
+
+# Column order of the frequency frame before `percentage` is derived; the Parquet dataset stores
+# exactly these columns, with the partition keys encoded in the directory names.
+FREQUENCY_COLUMNS = [
+    "sample_id",
+    "subject_pk",
+    "subject_id",
+    "project_id",
+    "treatment",
+    "response",
+    "condition",
+    "sex",
+    "sample_type",
+    "visit_time",
+    "cell_type",
+    "count",
+    "total_count",
+]
+
+
+def _backend() -> str:
+    if STORAGE_BACKEND not in STORAGE_BACKENDS:
+        raise ValueError(f"Unknown storage backend: {STORAGE_BACKEND}")
+    return STORAGE_BACKEND
+
+
+def storage_backend() -> str:
+    return _backend()
+
+
+def _snapshot_dir() -> str:
+    return PARQUET_DIR if _backend() == "parquet" else MATRIX_DIR
+
+
+def uses_snapshot() -> bool:
+    # Non-SQLite backends serve reads from a snapshot that load_data.py rewrites after each load. Until
+    # one exists (or after a failed export removed it), reads fall back to SQLite.
+    return _backend() != "sqlite" and os.path.isdir(_snapshot_dir())
+
+
+def uses_count_matrix() -> bool:
+    return _backend() == "matrix" and os.path.isdir(MATRIX_DIR)
+
+
+def remove_snapshot() -> None:
+    directory = _snapshot_dir()
+    for path in (directory, f"{directory}.tmp", f"{directory}.old"):
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def data_version() -> tuple[str, int, int]:
+    if not uses_snapshot():
+        return get_data_version()
+    # Each export swaps in a freshly written directory, so its inode and mtime identify the snapshot.
+    directory = _snapshot_dir()
+    stat = os.stat(directory)
+    return directory, stat.st_ino, stat.st_mtime_ns
+
+
+def _replace_directory(target: str, write: Callable[[str], None]) -> None:
+    staging = f"{target}.tmp"
+    previous = f"{target}.old"
+    for path in (staging, previous):
+        shutil.rmtree(path, ignore_errors=True)
+    write(staging)
+
+    # Readers see either the old or the new snapshot, never a half-written directory.
+    if os.path.exists(target):
+        os.rename(target, previous)
+    os.rename(staging, target)
+    shutil.rmtree(previous, ignore_errors=True)
+
+
+def _write_parquet_dataset(frame: pd.DataFrame, directory: str) -> None:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    # Sorting clusters rows by the non-partition filter columns, so row-group min/max statistics
+    # let baseline and sample-type filters skip whole row groups.
+    ordered = frame.loc[:, FREQUENCY_COLUMNS].sort_values(["sample_type", "treatment", "visit_time", "sample_id"])
+    table = pa.Table.from_pandas(ordered, preserve_index=False)
+    partitioning = ds.partitioning(pa.schema([(column, pa.string()) for column in PARTITION_COLUMNS]), flavor="hive")
+    ds.write_dataset(table, directory, format="parquet", partitioning=partitioning)
+
+
+def snapshot_errors() -> tuple[type[Exception], ...]:
+    # Failures a snapshot export is expected to hit: I/O errors, pyarrow's own errors and, for the
+    # Parquet backend, pyarrow not being installed. pyarrow is optional, so its base class is looked up
+    # only once an export has failed.
+    try:
+        import pyarrow as pa
+    except ImportError:
+        return (OSError, ImportError)
+    return (OSError, ImportError, pa.ArrowException)
+
+
+def write_frequency_snapshot(frame: pd.DataFrame) -> None:
+    _replace_directory(PARQUET_DIR, lambda staging: _write_parquet_dataset(frame, staging))
+    print(f"Parquet dataset written to {PARQUET_DIR}")
+
+
+def write_count_snapshot(samples: pd.DataFrame, counts: np.ndarray, cell_types: list[str]) -> None:
+    _replace_directory(MATRIX_DIR, lambda staging: write_count_matrix(samples, counts, cell_types, staging))
+    print(f"Count matrix written to {MATRIX_DIR}")
+
+
+def _partition_values(column: str) -> list[str]:
+    levels = ["*"] * PARTITION_COLUMNS.index(column)
+    paths = glob.glob(os.path.join(PARQUET_DIR, *levels, f"{column}=*"))
+    return sorted({unquote(os.path.basename(path).split("=", 1)[1]) for path in paths})
+
+
+def _read_parquet_dataset(
+    condition: str = "all",
+    treatment: str = "all",
+    sample_type: str = "all",
+    time_filter: str = "all",
+    columns: list[str] | None = None,
+) -> pd.DataFrame:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+
+    # Explicit string types stop hive discovery from inferring e.g. numeric project ids as integers.
+    partitioning = ds.partitioning(pa.schema([(column, pa.string()) for column in PARTITION_COLUMNS]), flavor="hive")
+    dataset = ds.dataset(PARQUET_DIR, format="parquet", partitioning=partitioning)
+
+    terms = []
+    if condition and condition != "all":
+        # Matching against the partition directory names keeps case-insensitive filtering while
+        # still pruning whole partitions before any file is opened.
+        matches = [value for value in _partition_values("condition") if value.lower() == condition.lower()]
+        terms.append(ds.field("condition").isin(pa.array(matches, type=pa.string())))
+    # Categorical frame columns are stored dictionary-encoded, which the string kernels need decoded.
+    if treatment and treatment != "all":
+        terms.append(pc.utf8_lower(ds.field("treatment").cast(pa.string())) == treatment.lower())
+    if sample_type and sample_type != "all":
+        terms.append(pc.utf8_lower(ds.field("sample_type").cast(pa.string())) == sample_type.lower())
+    if time_filter == "baseline_only":
+        terms.append(ds.field("visit_time") == 0.0)
+
+    predicate = functools.reduce(operator.and_, terms) if terms else None
+    table = dataset.to_table(columns=columns or FREQUENCY_COLUMNS, filter=predicate)
+    return cast(pd.DataFrame, table.to_pandas())
+
+
+_matrix_lock = threading.Lock()
+_matrix: tuple[tuple[str, int, int], CountMatrix] | None = None
+
+
+def get_count_matrix() -> CountMatrix:
+    # The memory maps are reopened only when a load swaps in a new snapshot.
+    global _matrix
+    version = data_version()
+    with _matrix_lock:
+        if _matrix is None or _matrix[0] != version:
+            _matrix = (version, read_count_matrix(MATRIX_DIR))
+        return _matrix[1]
+
+
+def read_frequency_snapshot(
+    condition: str = "all",
+    treatment: str = "all",
+    sample_type: str = "all",
+    time_filter: str = "all",
+) -> pd.DataFrame:
+    directory = _snapshot_dir()
+    if not os.path.exists(directory):
+        raise FileNotFoundError(f"{directory} not found. Run load_data.py with STORAGE_BACKEND = '{_backend()}'.")
+    if _backend() == "parquet":
+        return _read_parquet_dataset(condition, treatment, sample_type, time_filter)
+    matrix = get_count_matrix()
+    return long_frame(matrix, cohort_rows(matrix, condition, treatment, sample_type, time_filter))
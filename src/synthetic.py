@@ -0,0 +1,175 @@
+import math
+from collections.abc import Iterable, Iterator, Sequence
+
+import numpy as np
+import pandas as pd
+
+from src.config import CELL_TYPES
+
+# Subject mix and per-population mean shares of the bundled cell-count.csv; populations beyond the
+# bundled panel get log-uniform shares between rare and common.
+CONDITIONS = {"melanoma": 0.49, "carcinoma": 0.37, "healthy": 0.14}
+TREATMENTS = ["miraclib", "phauximab"]
+SAMPLE_TYPES = {"PBMC": 0.71, "WB": 0.29}
+BUNDLED_SHARES = {"b_cell": 0.10, "cd8_t_cell": 0.25, "cd4_t_cell": 0.30, "nk_cell": 0.15, "monocyte": 0.20}
+DEFAULT_VISITS = (0, 7, 14)
+DEFAULT_CHUNK_SAMPLES = 1_000_000
+# Sample totals and between-sample spread of the log shares, also taken from the bundled file.
+TOTAL_COUNT_MEAN = 100_000
+TOTAL_COUNT_SD = 6_000
+LOG_SHARE_SD = 0.2
+
+
+def population_names(n_populations: int) -> list[str]:
+    if n_populations <= len(CELL_TYPES):
+        return CELL_TYPES[:n_populations]
+    width = len(str(n_populations - len(CELL_TYPES) - 1))
+    return CELL_TYPES + [f"gated_{i:0{width}d}" for i in range(n_populations - len(CELL_TYPES))]
+
+
+def _base_log_shares(populations: Sequence[str], rng: np.random.Generator) -> np.ndarray:
+    extra = np.exp(rng.uniform(np.log(0.002), np.log(0.05), len(populations)))
+    shares = np.array([BUNDLED_SHARES.get(name, extra[i]) for i, name in enumerate(populations)])
+    return np.log(shares / shares.sum())
+
+
+def _padded_ids(prefix: str, indices: np.ndarray, width: int) -> pd.Series:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    # Arrow builds the ids in C++ and pandas wraps the result without copying, so 10M ids take
+    # a fraction of a second rather than a Python-level format per row.
+    digits = pc.utf8_lpad(pc.cast(pa.array(indices), pa.string()), width, "0")
+    ids = pc.binary_join_element_wise(prefix, digits, "")
+    return pd.Series(ids, dtype=pd.ArrowDtype(pa.string()))
+
+
+def _labels(choices: Sequence[str], codes: np.ndarray) -> pd.Categorical:
+    # Negative codes are missing values, as for the response of untreated subjects.
+    return pd.Categorical.from_codes(codes, categories=list(choices))
+
+
+def _cohort_chunk(
+    rng: np.random.Generator,
+    start: int,
+    stop: int,
+    *,
+    n_samples: int,
+    projects: int,
+    visits: Sequence[int],
+    populations: Sequence[str],
+    base_log_shares: np.ndarray,
+    response_rate: float,
+    effect_size: float,
+    effect_mask: np.ndarray,
+    zero_fraction: float,
+) -> pd.DataFrame:
+    sample_idx = np.arange(start, stop)
+    subject_idx = sample_idx // len(visits)
+    # Chunks start on a subject boundary, so per-subject attributes are drawn once per chunk subject.
+    first_subject = int(subject_idx[0])
+    local_subject = subject_idx - first_subject
+    n_subjects = int(local_subject[-1]) + 1
+
+    condition = rng.choice(len(CONDITIONS), n_subjects, p=list(CONDITIONS.values()))
+    healthy = condition == list(CONDITIONS).index("healthy")
+    treatment = np.where(healthy, len(TREATMENTS), rng.integers(0, len(TREATMENTS), n_subjects))
+    responder = (rng.random(n_subjects) < response_rate) & ~healthy
+    response = np.where(healthy, -1, np.where(responder, 0, 1))
+    sample_type = rng.choice(len(SAMPLE_TYPES), n_subjects, p=list(SAMPLE_TYPES.values()))
+
+    n_rows = len(sample_idx)
+    # Log-normal compositions around the panel's mean shares; responders' effect populations are
+    # shifted by effect_size on the log scale before renormalizing.
+    log_shares = base_log_shares + rng.normal(0.0, LOG_SHARE_SD, (n_rows, len(populations)))
+    log_shares += np.outer(responder[local_subject] * effect_size, effect_mask)
+    shares = np.exp(log_shares - log_shares.max(axis=1, keepdims=True))
+    shares /= shares.sum(axis=1, keepdims=True)
+    totals = np.maximum(rng.normal(TOTAL_COUNT_MEAN, TOTAL_COUNT_SD, n_rows), 1.0)
+    counts = np.rint(shares * totals[:, None]).astype(np.int64)
+    if zero_fraction:
+        counts[rng.random(counts.shape) < zero_fraction] = 0
+
+    subject_width = max(3, len(str(math.ceil(n_samples / len(visits)) - 1)))
+    sample_width = max(5, len(str(n_samples - 1)))
+    project = rng.integers(0, projects, n_subjects)
+    frame = pd.DataFrame(
+        {
+            "project": _labels([f"prj{i + 1}" for i in range(projects)], project[local_subject]),
+            "subject": _padded_ids("sbj", subject_idx, subject_width),
+            "condition": _labels(list(CONDITIONS), condition[local_subject]),
+            "age": rng.integers(20, 90, n_subjects)[local_subject],
+            "sex": _labels(["M", "F"], rng.integers(0, 2, n_subjects)[local_subject]),
+            "treatment": _labels([*TREATMENTS, "none"], treatment[local_subject]),
+            "response": _labels(["yes", "no"], response[local_subject]),
+            "sample": _padded_ids("sample", sample_idx, sample_width),
+            "sample_type": _labels(list(SAMPLE_TYPES), sample_type[local_subject]),
+            "time_from_treatment_start": np.asarray(visits)[sample_idx % len(visits)],
+        }
+    )
+    return pd.concat([frame, pd.DataFrame(counts, columns=list(populations))], axis=1)
+
+
+def generate_cohort(
+    n_samples: int,
+    *,
+    projects: int = 3,
+    visits: Sequence[int] = DEFAULT_VISITS,
+    populations: Sequence[str] = CELL_TYPES,
+    response_rate: float = 0.5,
+    effect_size: float = 0.0,
+    effect_populations: Sequence[str] | None = None,
+    zero_fraction: float = 0.0,
+    chunk_samples: int = DEFAULT_CHUNK_SAMPLES,
+    seed: int = 0,
+) -> Iterator[pd.DataFrame]:
+    # Frames in the cell-count.csv schema, one chunk of whole subjects at a time, so memory stays flat
+    # at any size. Output is determined by the arguments, including chunk_samples and seed.
+    if n_samples <= 0:
+        return
+    effect_populations = list(populations[:1] if effect_populations is None else effect_populations)
+    unknown = sorted(set(effect_populations) - set(populations))
+    if unknown:
+        raise ValueError(f"Unknown effect populations: {', '.join(unknown)}")
+
+    base_log_shares = _base_log_shares(populations, np.random.default_rng(seed))
+    effect_mask = np.isin(np.asarray(populations), effect_populations).astype(float)
+    step = max(len(visits), chunk_samples - chunk_samples % len(visits))
+    starts = range(0, n_samples, step)
+    for start, chunk_seed in zip(starts, np.random.SeedSequence(seed).spawn(len(starts))):
+        yield _cohort_chunk(
+            np.random.default_rng(chunk_seed),
+            start,
+            min(start + step, n_samples),
+            n_samples=n_samples,
+            projects=projects,
+            visits=visits,
+            populations=populations,
+            base_log_shares=base_log_shares,
+            response_rate=response_rate,
+            effect_size=effect_size,
+            effect_mask=effect_mask,
+            zero_fraction=zero_fraction,
+        )
+
+
+def write_cohort_csv(path: str, frames: Iterable[pd.DataFrame]) -> int:
+    import pyarrow as pa
+    import pyarrow.csv as pcsv
+
+    # Arrow's multi-threaded CSV writer is several times faster than DataFrame.to_csv; the header is
+    # written by hand because Arrow quotes header names.
+    n_rows = 0
+    with open(path, "wb") as handle:
+        writer: pcsv.CSVWriter | None = None
+        for frame in frames:
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if writer is None:
+                _ = handle.write((",".join(frame.columns) + "\n").encode("utf-8"))
+                write_options = pcsv.WriteOptions(include_header=False, quoting_style="none")
+                writer = pcsv.CSVWriter(handle, table.schema, write_options=write_options)
+            writer.write_table(table)
+            n_rows += len(frame)
+        if writer is not None:
+            writer.close()
+    return n_rows
@@ -0,0 +1,40 @@
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from load_data import load_csv_to_db
+
+
+@pytest.fixture
+def temp_db(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Callable[..., dict[str, dict[str, int]] | None]:
+    # Points the loader and every reader at tmp_path/<name> and loads it with load_csv_to_db(*args,
+    # **options). load=False only switches databases, e.g. before load_csv_files or load_frames_to_db.
+    def use(name: str, *args: Any, load: bool = True, **options: Any) -> dict[str, dict[str, int]] | None:
+        monkeypatch.setattr("src.database.DB_PATH", str(tmp_path / name))
+        return load_csv_to_db(*args, **options) if load else None
+
+    return use
+
+
+@pytest.fixture
+def storage_backend(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Callable[[str], Path]:
+    # Selects a storage backend with its snapshot directories under tmp_path and returns the snapshot
+    # directory the backend reads from.
+    snapshot_dirs = {"parquet": tmp_path / "frequency_parquet", "matrix": tmp_path / "count_matrix"}
+    monkeypatch.setattr("src.storage.PARQUET_DIR", str(snapshot_dirs["parquet"]))
+    monkeypatch.setattr("src.storage.MATRIX_DIR", str(snapshot_dirs["matrix"]))
+
+    def use(backend: str) -> Path:
+        monkeypatch.setattr("src.storage.STORAGE_BACKEND", backend)
+        return snapshot_dirs.get(backend, tmp_path)
+
+    return use
+
+
+@pytest.fixture
+def report_cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    cache_dir = tmp_path / "reports"
+    monkeypatch.setattr("src.report_queue.REPORT_CACHE_DIR", str(cache_dir))
+    return cache_dir
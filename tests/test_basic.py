@@ -1,25 +1,428 @@
+import re
+import threading
+from concurrent.futures import wait
 from typing import cast
 
+import numpy as np
 import pandas as pd
+import plotly
 import plotly.express as px
+import pytest
+from scipy import stats
 
 import run_analysis
-from load_data import load_csv_to_db
-from src.analysis import get_cell_frequency_data, get_part2_frequency_table
-from src.queries import get_subset_stats
-from src.reporting import build_html_report, build_pdf_report
-from src.statistics import compare_responders
+from load_data import load_csv_files, load_csv_to_db, load_frames_to_db
+from src.analysis import (
+    get_cell_frequency_data,
+    get_cell_types,
+    get_cohort_count_matrix,
+    get_filtered_data,
+    get_part2_frequency_table,
+)
+from src.config import CELL_TYPES, CSV_FILE
+from src.database import (
+    bump_data_version,
+    cell_count_layout,
+    get_db_connection,
+    migrate_cell_count_layout,
+    read_connection,
+    writer_connection,
+)
+from src.queries import (
+    build_cohort_flow,
+    get_subset_stats,
+)
+from src.report_queue import (
+    report_key,
+    report_result,
+    report_status,
+    retry_report,
+    submit_pdf_report,
+    submit_report,
+)
+from src.reporting import (
+    PDF_TABLE_ROWS_PER_PAGE,
+    PLOTLY_ASSET,
+    build_html_report,
+    build_pdf_report,
+    summarize_box_traces,
+    write_html_archive,
+    write_plotly_asset,
+)
+from src.statistics import (
+    _bootstrap_diff_ci,
+    _bootstrap_diff_ci_columns,
+    _cliffs_delta,
+    _compare_matrices,
+    compare_responders,
+    compare_responders_scenarios,
+)
+from src.storage import write_frequency_snapshot
+from src.synthetic import generate_cohort, population_names, write_cohort_csv
 
 
 def setup_module() -> None:
     load_csv_to_db()
 
 
+def _table_snapshot() -> dict[str, list[tuple[object, ...]]]:
+    conn = get_db_connection()
+    snapshot = {
+        "subjects": [tuple(row) for row in conn.execute("SELECT * FROM subjects ORDER BY subject_pk")],
+        "samples": [tuple(row) for row in conn.execute("SELECT * FROM samples ORDER BY sample_id")],
+        "cell_counts": [
+            tuple(row)
+            for row in conn.execute(
+                """
+                SELECT c.sample_id, ct.code, c.count
+                FROM cell_counts c
+                JOIN dim_cell_type ct ON ct.id = c.cell_type_id
+                ORDER BY c.sample_id, ct.code
+                """
+            )
+        ],
+    }
+    conn.close()
+    return snapshot
+
+
+def test_streaming_load_matches_full_load(temp_db) -> None:
+    _ = temp_db("streamed.db", chunksize=777)
+    streamed = _table_snapshot()
+
+    _ = temp_db("full.db")
+    full = _table_snapshot()
+
+    assert len(full["samples"]) > 0
+    assert streamed == full
+
+
+def test_bulk_load_defers_indexes_and_matches_default_load(temp_db) -> None:
+    _ = temp_db("bulk.db", chunksize=3000, bulk=True)
+    bulk = _table_snapshot()
+
+    conn = get_db_connection()
+    index_names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    analyzed = conn.execute("SELECT COUNT(*) FROM sqlite_stat1").fetchone()[0]
+    conn.close()
+    assert {"idx_samples_type_time", "idx_cell_counts_sample", "idx_subjects_condition_treatment"} <= index_names
+    # The WAL journal is only for the load; the file goes back to its previous (default) mode.
+    assert journal_mode == "delete"
+    assert analyzed > 0
+
+    _ = temp_db("default.db")
+    assert bulk == _table_snapshot()
+
+
+def test_bulk_load_pragmas_are_reset_on_the_pooled_writer(temp_db) -> None:
+    _ = temp_db("bulk_pragmas.db", bulk=True)
+
+    with writer_connection() as conn:
+        pragmas = {
+            name: conn.execute(f"PRAGMA {name}").fetchone()[0]
+            for name in ("foreign_keys", "synchronous", "cache_size", "temp_store")
+        }
+    # synchronous 2 is FULL and temp_store 0 is DEFAULT, SQLite's defaults.
+    assert pragmas == {"foreign_keys": 1, "synchronous": 2, "cache_size": -2000, "temp_store": 0}
+
+
+def test_wide_layout_and_migration_match_long_layout(temp_db) -> None:
+    _ = temp_db("long.db")
+    long = _table_snapshot()
+    long_frame = get_cell_frequency_data()
+    long_subset = get_subset_stats("melanoma", "miraclib", "PBMC", "all")
+
+    _ = temp_db("wide.db", chunksize=4000, layout="wide")
+    with read_connection() as conn:
+        assert cell_count_layout(conn) == "wide"
+    assert long == _table_snapshot()
+
+    sort_cols = ["sample_id", "cell_type"]
+    pd.testing.assert_frame_equal(
+        get_cell_frequency_data().sort_values(sort_cols).reset_index(drop=True),
+        long_frame.sort_values(sort_cols).reset_index(drop=True),
+    )
+    wide_subset = get_subset_stats("melanoma", "miraclib", "PBMC", "all")
+    assert wide_subset["n_samples"] == long_subset["n_samples"]
+    assert wide_subset["avg_b_cell_male_responders"] == pytest.approx(long_subset["avg_b_cell_male_responders"])
+
+    migrate_cell_count_layout("long")
+    assert long == _table_snapshot()
+    migrate_cell_count_layout("wide")
+    assert long == _table_snapshot()
+
+
+def test_parquet_backend_matches_sqlite_frames(temp_db, storage_backend) -> None:
+    parquet_dir = storage_backend("parquet")
+    _ = temp_db("parquet_source.db")
+    assert (parquet_dir / "project_id=prj1").is_dir()
+    parquet_full = get_cell_frequency_data()
+    parquet_cohort = get_filtered_data("MELANOMA", "miraclib", "pbmc", time_filter="baseline_only")
+
+    _ = storage_backend("sqlite")
+    sort_cols = ["sample_id", "cell_type"]
+    for parquet, sqlite in (
+        (parquet_full, get_cell_frequency_data()),
+        (parquet_cohort, get_filtered_data("MELANOMA", "miraclib", "pbmc", time_filter="baseline_only")),
+    ):
+        assert len(parquet) > 0
+        pd.testing.assert_frame_equal(
+            parquet.sort_values(sort_cols).reset_index(drop=True),
+            sqlite.sort_values(sort_cols).reset_index(drop=True),
+        )
+
+
+def test_failed_snapshot_export_keeps_load_and_falls_back_to_sqlite(temp_db, storage_backend, monkeypatch) -> None:
+    parquet_dir = storage_backend("parquet")
+    _ = temp_db("snapshot_source.db")
+    assert parquet_dir.is_dir()
+
+    def fail(*_args: object) -> None:
+        raise OSError("disk full")
+
+    monkeypatch.setattr("load_data.write_frequency_snapshot", fail)
+    report = load_csv_to_db()
+    assert report is not None
+    assert not parquet_dir.exists()
+    fallback = get_cell_frequency_data()
+
+    _ = storage_backend("sqlite")
+    pd.testing.assert_frame_equal(fallback, get_cell_frequency_data())
+
+    # Anything other than an I/O or pyarrow error is a bug: it propagates to the loader's error
+    # handler, and the stale snapshot is still dropped.
+    _ = storage_backend("parquet")
+    monkeypatch.setattr("load_data.write_frequency_snapshot", write_frequency_snapshot)
+    _ = load_csv_to_db()
+    assert parquet_dir.is_dir()
+    monkeypatch.setattr("load_data.write_frequency_snapshot", lambda *_args: {}["missing"])
+    assert load_csv_to_db() is None
+    assert not parquet_dir.exists()
+
+
+def test_count_matrix_backend_matches_sqlite_and_slices_zero_copy(temp_db, storage_backend) -> None:
+    _ = storage_backend("matrix")
+    _ = temp_db("matrix_source.db")
+    matrix_full = get_cell_frequency_data()
+    matrix_cohort = get_filtered_data("MELANOMA", "miraclib", "pbmc", time_filter="baseline_only")
+    samples, counts, cell_types = get_cohort_count_matrix("melanoma", "Miraclib", "PBMC")
+    # A cohort fixing the leading sort keys is a slice of the read-only memory map, not a copy.
+    assert isinstance(counts, np.memmap)
+    assert not counts.flags.writeable
+
+    _ = storage_backend("sqlite")
+    sort_cols = ["sample_id", "cell_type"]
+    for matrix, sqlite in (
+        (matrix_full, get_cell_frequency_data()),
+        (matrix_cohort, get_filtered_data("MELANOMA", "miraclib", "pbmc", time_filter="baseline_only")),
+    ):
+        assert len(matrix) > 0
+        pd.testing.assert_frame_equal(
+            matrix.sort_values(sort_cols).reset_index(drop=True),
+            sqlite.sort_values(sort_cols).reset_index(drop=True),
+        )
+
+    expected_samples, expected_counts, expected_cell_types = get_cohort_count_matrix("melanoma", "Miraclib", "PBMC")
+    assert cell_types == expected_cell_types
+    order = np.argsort(samples["sample_id"].to_numpy())
+    expected_order = np.argsort(expected_samples["sample_id"].to_numpy())
+    np.testing.assert_array_equal(counts[order], expected_counts[expected_order])
+
+
+def test_wide_panel_is_detected_and_stored_sparse(tmp_path, temp_db, storage_backend) -> None:
+    rng = np.random.default_rng(7)
+    source = pd.read_csv(CSV_FILE)
+    rare = [f"gated_{index:02d}" for index in range(25)]
+    for column in rare:
+        source[column] = np.where(rng.random(len(source)) < 0.9, 0, rng.integers(1, 500, len(source)))
+    # An empty cell means the population was not measured for that sample.
+    source.loc[source.index[:10], "gated_00"] = np.nan
+    csv_path = tmp_path / "panel.csv"
+    source.to_csv(csv_path, index=False)
+
+    matrix_dir = storage_backend("matrix")
+    _ = temp_db("panel.db", str(csv_path))
+    assert (matrix_dir / "counts_data.npy").exists()
+    with read_connection() as conn:
+        assert cell_count_layout(conn) == "wide"
+    assert get_cell_types()[: len(CELL_TYPES)] == CELL_TYPES
+    assert set(get_cell_types()) == {*CELL_TYPES, *rare}
+    matrix_frame = get_cell_frequency_data()
+    _, sparse_counts, matrix_cell_types = get_cohort_count_matrix()
+
+    _ = storage_backend("sqlite")
+    sqlite_frame = get_cell_frequency_data()
+    assert len(sqlite_frame) == len(source) * (len(CELL_TYPES) + len(rare)) - 10
+    sort_cols = ["sample_id", "cell_type"]
+    pd.testing.assert_frame_equal(
+        matrix_frame.sort_values(sort_cols).reset_index(drop=True),
+        sqlite_frame.sort_values(sort_cols).reset_index(drop=True),
+    )
+    samples, dense_counts, cell_types = get_cohort_count_matrix()
+    assert cell_types == matrix_cell_types
+    assert sorted(sparse_counts.toarray().tolist()) == sorted(dense_counts.tolist())
+    assert len(samples) == dense_counts.shape[0]
+
+
+def test_incremental_load_upserts_and_reports_delta(tmp_path, temp_db) -> None:
+    source = pd.read_csv(CSV_FILE)
+    initial_rows = source.iloc[:4000]
+    full_rows = source.copy()
+    changed_subject = initial_rows.iloc[0]
+    changed_mask = (full_rows["project"] == changed_subject["project"]) & (
+        full_rows["subject"] == changed_subject["subject"]
+    )
+    full_rows.loc[changed_mask, "age"] = int(changed_subject["age"]) + 1
+    initial_rows.to_csv(tmp_path / "initial.csv", index=False)
+    full_rows.to_csv(tmp_path / "full.csv", index=False)
+
+    _ = temp_db("incremental.db", str(tmp_path / "initial.csv"))
+    report = load_csv_to_db(str(tmp_path / "full.csv"), chunksize=2500, incremental=True)
+    incremental = _table_snapshot()
+
+    n_initial_subjects = len(initial_rows.drop_duplicates(["project", "subject"]))
+    n_all_subjects = len(full_rows.drop_duplicates(["project", "subject"]))
+    assert report is not None
+    assert report["subjects"] == {
+        "inserted": n_all_subjects - n_initial_subjects,
+        "updated": 1,
+        "skipped": n_initial_subjects - 1,
+    }
+    assert report["samples"] == {"inserted": len(full_rows) - 4000, "updated": 0, "skipped": 4000}
+    assert report["cell_counts"]["skipped"] == 4000 * len(CELL_TYPES)
+
+    _ = temp_db("rebuilt.db", str(tmp_path / "full.csv"))
+    assert incremental == _table_snapshot()
+
+
+def test_parallel_multi_file_load_matches_single_file(tmp_path, temp_db) -> None:
+    source = pd.read_csv(CSV_FILE)
+    drop_dir = tmp_path / "drops"
+    drop_dir.mkdir()
+    for project, project_rows in source.groupby("project"):
+        project_rows.to_csv(drop_dir / f"{project}.csv", index=False)
+
+    _ = temp_db("parallel.db", load=False)
+    file_reports = load_csv_files(str(drop_dir), workers=2)
+    parallel = get_cell_frequency_data()
+
+    assert file_reports is not None
+    assert [report["rows"] for report in file_reports] == source.groupby("project").size().tolist()
+
+    _ = temp_db("single.db")
+    single = get_cell_frequency_data()
+
+    # Subject keys follow file order rather than row order, so compare on natural keys.
+    sort_cols = ["sample_id", "cell_type"]
+    pd.testing.assert_frame_equal(
+        parallel.drop(columns=["subject_pk"]).sort_values(sort_cols).reset_index(drop=True),
+        single.drop(columns=["subject_pk"]).sort_values(sort_cols).reset_index(drop=True),
+    )
+
+
+def test_synthetic_cohort_matches_csv_schema_and_streams_into_database(tmp_path, temp_db) -> None:
+    options = {"chunk_samples": 1_000, "effect_size": 0.5, "seed": 7}
+    csv_path = tmp_path / "synthetic.csv"
+    assert write_cohort_csv(str(csv_path), generate_cohort(3_001, **options)) == 3_001
+    synthetic = pd.read_csv(csv_path)
+    bundled = pd.read_csv(CSV_FILE, nrows=100)
+
+    assert list(synthetic.columns) == list(bundled.columns)
+    assert synthetic.dtypes.equals(bundled.dtypes)
+    assert synthetic["sample"].is_unique
+    assert (synthetic.groupby("subject")["time_from_treatment_start"].nunique() <= 3).all()
+    assert synthetic.loc[synthetic["treatment"] == "none", "response"].isna().all()
+    shares = synthetic["b_cell"] / synthetic[CELL_TYPES].sum(axis=1)
+    by_response = shares.groupby(synthetic["response"]).mean()
+    assert by_response["yes"] > 1.4 * by_response["no"]
+    assert population_names(7) == [*CELL_TYPES, "gated_0", "gated_1"]
+
+    _ = temp_db("from_csv.db", str(csv_path))
+    from_csv = _table_snapshot()
+
+    _ = temp_db("streamed.db", load=False)
+    report = load_frames_to_db(generate_cohort(3_001, **options))
+    assert report is not None and report["samples"]["inserted"] == 3_001
+    assert _table_snapshot() == from_csv
+
+
 def test_cell_frequency_columns() -> None:
     df = get_cell_frequency_data()
     expected = {"sample_id", "cell_type", "count", "total_count", "percentage"}
     assert expected.issubset(set(df.columns))
     assert len(df) > 0
+    assert isinstance(df["condition"].dtype, pd.CategoricalDtype)
+    assert df["count"].dtype == np.int32
+    assert all(label == label.lower() for label in df["response"].cat.categories)
+
+
+def test_frequency_cache_shares_read_only_frame_until_reload() -> None:
+    first = get_cell_frequency_data()
+    second = get_cell_frequency_data()
+    assert np.shares_memory(first["count"].to_numpy(), second["count"].to_numpy())
+    with pytest.raises(ValueError):
+        first.loc[first.index[0], "count"] = -1
+
+    second["scratch"] = 1
+    assert "scratch" not in get_cell_frequency_data().columns
+
+    conn = get_db_connection()
+    _ = bump_data_version(conn)
+    conn.commit()
+    conn.close()
+    reloaded = get_cell_frequency_data()
+    assert not np.shares_memory(first["count"].to_numpy(), reloaded["count"].to_numpy())
+
+
+def test_pooled_connections_are_reused_per_thread_and_follow_rebuilds(tmp_path, temp_db) -> None:
+    with read_connection() as first, read_connection() as second:
+        assert first is second
+
+    other_thread: list[object] = []
+
+    def open_reader() -> None:
+        with read_connection() as conn:
+            other_thread.append(conn)
+
+    worker = threading.Thread(target=open_reader)
+    worker.start()
+    worker.join()
+    assert other_thread[0] is not first
+
+    with writer_connection() as writer:
+        _ = writer.execute("PRAGMA foreign_keys = OFF;")
+    with writer_connection() as writer:
+        assert writer.execute("PRAGMA foreign_keys;").fetchone()[0] == 1
+
+    _ = temp_db("rebuilt.db")
+    with read_connection() as before:
+        pass
+    (tmp_path / "rebuilt.db").unlink()
+    _ = load_csv_to_db()
+    with read_connection() as after:
+        assert after is not before
+        assert after.execute("SELECT COUNT(*) FROM samples").fetchone()[0] > 0
+
+
+def test_filtered_data_matches_in_memory_filtering() -> None:
+    full = get_cell_frequency_data()
+    expected = full.loc[
+        (full["condition"].str.lower() == "melanoma")
+        & (full["treatment"].str.lower() == "miraclib")
+        & (full["sample_type"].str.lower() == "pbmc")
+        & (full["visit_time"] == 0)
+    ]
+    observed = get_filtered_data("MELANOMA", "Miraclib", "pbmc", time_filter="baseline_only")
+
+    sort_cols = ["sample_id", "cell_type"]
+    # A cohort frame only carries the categories its own rows use.
+    expected = expected.apply(lambda column: column.cat.remove_unused_categories() if column.dtype == "category" else column)
+    pd.testing.assert_frame_equal(
+        observed.sort_values(sort_cols).reset_index(drop=True),
+        expected.sort_values(sort_cols).reset_index(drop=True),
+    )
+    assert len(get_filtered_data("not-a-condition", "miraclib", "PBMC")) == 0
 
 
 def test_part2_frequency_table_columns_match_spec() -> None:
@@ -69,6 +472,55 @@ def test_part4_subset_counts_are_consistent() -> None:
     assert n_subjects == int(by_project_subjects.sum())
 
 
+def test_part4_single_pass_matches_frequency_frame() -> None:
+    stats = get_subset_stats("MELANOMA", "miraclib", "pbmc", "all")
+
+    full = get_cell_frequency_data()
+    frame = full.loc[
+        (full["condition"].str.lower() == "melanoma")
+        & (full["treatment"].str.lower() == "miraclib")
+        & (full["sample_type"].str.lower() == "pbmc")
+    ]
+    by_project = frame.groupby("project_id", observed=True)
+    subjects = frame.drop_duplicates("subject_pk")
+    # The frequency frame's columns are categorical, so the tallies are compared as plain dicts.
+    assert cast(pd.Series, stats["by_project_samples"]).to_dict() == by_project["sample_id"].nunique().to_dict()
+    assert cast(pd.Series, stats["by_project_subjects"]).to_dict() == by_project["subject_pk"].nunique().to_dict()
+    assert cast(pd.Series, stats["by_sex"]).to_dict() == subjects.groupby("sex", observed=True).size().to_dict()
+
+    male_responder_b = frame.loc[
+        (frame["sex"] == "M") & (frame["response"] == "yes") & (frame["cell_type"] == "b_cell")
+    ]
+    expected = male_responder_b.groupby("subject_pk")["count"].mean().mean()
+    assert stats["avg_b_cell_male_responders"] == pytest.approx(expected)
+
+
+def test_cohort_flow_matches_sequential_filtering() -> None:
+    full = get_cell_frequency_data()
+    for time_filter, sex, response in (("all", "all", "all"), ("baseline_only", "M", "Yes")):
+        flow = build_cohort_flow("MELANOMA", "miraclib", "pbmc", time_filter, sex=sex, response=response)
+
+        frame = full
+        expected = [(int(frame["sample_id"].nunique()), int(frame["subject_pk"].nunique()))]
+        steps = [
+            frame["condition"].str.lower() == "melanoma",
+            frame["sample_type"].str.lower() == "pbmc",
+            frame["treatment"].str.lower() == "miraclib",
+            frame["visit_time"] == 0 if time_filter == "baseline_only" else frame["visit_time"].notna(),
+        ]
+        if sex != "all":
+            steps.append(frame["sex"] == sex)
+        if response != "all":
+            steps.append(frame["response"] == response.lower())
+        keep = pd.Series(True, index=frame.index)
+        for step in steps:
+            keep &= step
+            expected.append((int(frame.loc[keep, "sample_id"].nunique()), int(frame.loc[keep, "subject_pk"].nunique())))
+
+        assert list(zip(flow["n_samples"], flow["n_subjects"])) == expected
+        assert expected[-1][0] > 0
+
+
 def test_part4_avg_b_cell_is_subject_level() -> None:
     stats = get_subset_stats(
         condition="melanoma",
@@ -105,6 +557,215 @@ def test_compare_responders_clr_transform() -> None:
     assert max_abs_mean < 1e-9
 
 
+def test_bootstrap_ci_is_seeded_and_independent_of_memory_cap() -> None:
+    group_yes = [float(v) for v in range(40)]
+    group_no = [float(v) * 0.5 for v in range(55)]
+
+    wide = _bootstrap_diff_ci(group_yes, group_no, statistic="median", iterations=500, seed=7)
+    repeat = _bootstrap_diff_ci(group_yes, group_no, statistic="median", iterations=500, seed=7)
+    chunked = _bootstrap_diff_ci(
+        group_yes,
+        group_no,
+        statistic="median",
+        iterations=500,
+        seed=7,
+        max_memory_mb=0.01,
+    )
+    assert wide == repeat == chunked
+
+    low, high = _bootstrap_diff_ci(group_yes, group_no, statistic="mean", iterations=500, seed=7)
+    assert low is not None and high is not None
+    assert low < 19.5 - 13.5 < high
+
+
+def test_column_bootstrap_matches_per_column_bootstrap() -> None:
+    rng = np.random.default_rng(17)
+    yes = rng.normal(loc=1.0, size=(30, 5))
+    no = rng.normal(size=(45, 5))
+    # Missing values are skipped per column, and a column with an empty arm has no interval.
+    yes[:3, 1] = np.nan
+    no[40:, 2] = np.nan
+    yes[:, 4] = np.nan
+
+    for statistic in ["median", "mean"]:
+        low, high = _bootstrap_diff_ci_columns(yes, no, statistic=statistic, iterations=400, seed=9)
+        chunked = _bootstrap_diff_ci_columns(
+            yes, no, statistic=statistic, iterations=400, seed=9, max_memory_mb=0.01
+        )
+        np.testing.assert_array_equal(low, chunked[0])
+        np.testing.assert_array_equal(high, chunked[1])
+        for idx in range(yes.shape[1]):
+            # Each population keeps its own seed, bootstrap_seed + column index.
+            expected = _bootstrap_diff_ci(
+                yes[~np.isnan(yes[:, idx]), idx].tolist(),
+                no[~np.isnan(no[:, idx]), idx].tolist(),
+                statistic=statistic,
+                iterations=400,
+                seed=9 + idx,
+            )
+            if expected[0] is None:
+                assert np.isnan(low[idx]) and np.isnan(high[idx])
+                continue
+            assert low[idx] == pytest.approx(expected[0], rel=1e-12, abs=1e-12)
+            assert high[idx] == pytest.approx(expected[1], rel=1e-12, abs=1e-12)
+
+
+def test_compare_responders_cis_are_pinned_to_per_population_seeds() -> None:
+    yes = np.array([[1.0, 4.0], [2.0, 6.0], [3.0, 5.0], [5.0, np.nan], [8.0, 7.0]])
+    no = np.array([[0.5, 3.0], [1.5, 2.0], [2.5, 4.5], [1.0, 1.0]])
+    stats_df = _compare_matrices(
+        ["a", "b"],
+        yes,
+        no,
+        test="mannwhitney",
+        ci_stat="median",
+        bootstrap_iterations=1000,
+        bootstrap_seed=42,
+        bootstrap_max_memory_mb=64.0,
+    )
+    # The intervals of the per-population implementation: seed 42 for "a", 43 for "b".
+    for idx, row in stats_df.iterrows():
+        expected = _bootstrap_diff_ci(
+            yes[~np.isnan(yes[:, idx]), idx].tolist(),
+            no[:, idx].tolist(),
+            statistic="median",
+            iterations=1000,
+            seed=42 + idx,
+        )
+        assert (row["ci_95_low"], row["ci_95_high"]) == pytest.approx(expected, abs=1e-12)
+    assert stats_df["ci_95_low"].tolist() == [-0.5, 0.75]
+    assert stats_df["ci_95_high"].tolist() == [6.75, 5.0]
+
+
+def _nested_loop_cliffs_delta(group_yes: list[float], group_no: list[float]) -> float:
+    total = len(group_yes) * len(group_no)
+    if total == 0:
+        return 0.0
+    gt = 0
+    lt = 0
+    for a in group_yes:
+        for b in group_no:
+            if a > b:
+                gt += 1
+            elif a < b:
+                lt += 1
+    return (gt - lt) / total
+
+
+def test_cliffs_delta_matches_nested_loop_reference() -> None:
+    rng = np.random.default_rng(3)
+    cases = [
+        ([], [1.0]),
+        ([1.0, 2.0, 3.0], [1.0, 2.0, 3.0]),
+        ([5.0, 5.0, 5.0], [5.0, 1.0]),
+        (rng.normal(size=120).tolist(), rng.normal(loc=0.3, size=95).tolist()),
+        # Coarse integer values force many ties between and within groups.
+        (rng.integers(0, 6, size=80).astype(float).tolist(), rng.integers(0, 6, size=70).astype(float).tolist()),
+    ]
+    for group_yes, group_no in cases:
+        assert _cliffs_delta(group_yes, group_no) == _nested_loop_cliffs_delta(group_yes, group_no)
+
+
+def test_matrix_kernel_matches_per_cell_type_tests() -> None:
+    rng = np.random.default_rng(11)
+    # Small arms with ties in some columns exercise scipy's exact/asymptotic method choice.
+    yes = rng.integers(0, 4, size=(6, 4)).astype(float)
+    no = rng.integers(0, 4, size=(7, 4)).astype(float)
+    yes[:, 0] = rng.normal(size=6)
+    no[:, 0] = rng.normal(size=7)
+    yes[2, 3] = np.nan
+    cell_types = ["a", "b", "c", "d"]
+
+    for test in ["mannwhitney", "welch_t"]:
+        stats_df = _compare_matrices(
+            cell_types,
+            yes,
+            no,
+            test=test,
+            ci_stat="median",
+            bootstrap_iterations=0,
+            bootstrap_seed=0,
+            bootstrap_max_memory_mb=64.0,
+        )
+        for idx, row in stats_df.iterrows():
+            group_yes = yes[~np.isnan(yes[:, idx]), idx].tolist()
+            group_no = no[:, idx].tolist()
+            if test == "welch_t":
+                expected = stats.ttest_ind(group_yes, group_no, equal_var=False)
+            else:
+                expected = stats.mannwhitneyu(group_yes, group_no, alternative="two-sided")
+            assert row["n_yes"] == len(group_yes)
+            assert abs(row["p_value"] - float(expected[1])) < 1e-12
+            assert abs(row["stat_score"] - float(expected[0])) < 1e-12
+            assert abs(row["cliffs_delta"] - _cliffs_delta(group_yes, group_no)) < 1e-12
+
+
+def test_permutation_test_matches_exact_distribution_and_ignores_workers_and_memory_cap() -> None:
+    rng = np.random.default_rng(5)
+    yes = rng.integers(0, 6, size=(6, 4)).astype(float)
+    no = rng.integers(0, 6, size=(7, 4)).astype(float)
+    yes[:, 0] += 3
+    yes[2, 3] = np.nan
+
+    def run(workers: int, max_memory_mb: float = 64.0) -> pd.DataFrame:
+        return _compare_matrices(
+            ["a", "b", "c", "d"],
+            yes,
+            no,
+            test="permutation",
+            ci_stat="median",
+            bootstrap_iterations=0,
+            bootstrap_seed=0,
+            bootstrap_max_memory_mb=64.0,
+            permutation_iterations=20_000,
+            permutation_seed=3,
+            permutation_workers=workers,
+            permutation_max_memory_mb=max_memory_mb,
+        )
+
+    stats_df = run(1)
+    pd.testing.assert_frame_equal(stats_df, run(2))
+    pd.testing.assert_frame_equal(stats_df, run(1, max_memory_mb=0.001))
+
+    def abs_rank_biserial(x: np.ndarray, y: np.ndarray) -> float:
+        u = stats.mannwhitneyu(x, y, alternative="two-sided").statistic
+        return abs(2 * u / (len(x) * len(y)) - 1)
+
+    # Without missing values the shuffles sample the exact permutation distribution.
+    for idx in range(3):
+        exact = stats.permutation_test(
+            (yes[:, idx], no[:, idx]), abs_rank_biserial, alternative="greater", n_resamples=np.inf
+        )
+        assert abs(stats_df.loc[idx, "p_value"] - exact.pvalue) < 0.02
+        expected_u = stats.mannwhitneyu(yes[:, idx], no[:, idx]).statistic
+        assert stats_df.loc[idx, "stat_score"] == expected_u
+    assert 0 < stats_df.loc[3, "p_value"] <= 1
+
+
+def test_scenario_batch_matches_individual_calls() -> None:
+    scenarios = [
+        ("baseline_only", "mannwhitney", "bh_fdr", "subject", "none"),
+        ("all", "mannwhitney", "bh_fdr", "subject", "none"),
+        ("baseline_only", "welch_t", "none", "sample", "clr"),
+        ("baseline_only", "mannwhitney", "none", "subject", "none"),
+    ]
+    batched = compare_responders_scenarios(scenarios, bootstrap_iterations=200)
+    assert len(batched) == len(scenarios)
+
+    for (time_filter, test, correction, unit, transform), (stats_df, plot_df, summary) in zip(scenarios, batched):
+        expected_stats, expected_plot, expected_summary = compare_responders(
+            time_filter=time_filter,
+            test=test,
+            correction=correction,
+            unit=unit,
+            transform=transform,
+            bootstrap_iterations=200,
+        )
+        pd.testing.assert_frame_equal(stats_df, expected_stats)
+        pd.testing.assert_frame_equal(plot_df.reset_index(drop=True), expected_plot.reset_index(drop=True))
+        assert summary == expected_summary
+
+
 def test_report_builders_return_valid_bytes() -> None:
     stats_df = pd.DataFrame(
         [
@@ -165,6 +826,149 @@ def test_report_builders_return_valid_bytes() -> None:
     assert pdf_bytes.startswith(b"%PDF")
 
 
+def test_pdf_report_paginates_long_tables_and_falls_back_for_non_latin_text() -> None:
+    summary = {
+        "test_label": "Mann-Whitney U",
+        "correction_label": "BH-FDR",
+        "unit": "sample",
+        "metric": "percentage",
+        "transform_label": "Raw",
+    }
+    n_rows = 2 * PDF_TABLE_ROWS_PER_PAGE + 15
+    stats_df = pd.DataFrame({"cell_type": [f"gated_{i:03d}" for i in range(n_rows)], "q_value": np.linspace(0, 1, n_rows)})
+    flow_df = pd.DataFrame([{"step": "All samples", "n_samples": 10, "n_subjects": 7}])
+    counts = {"n_samples": 10, "n_subjects": 7}
+
+    def pages(pdf_bytes: bytes) -> int:
+        return len(re.findall(rb"/Type /Page\b(?!s)", pdf_bytes))
+
+    latin = build_pdf_report("Indication=melanoma", counts, summary, stats_df, flow_df)
+    # Summary page, three stats pages and the cohort flow page; text uses the standard PDF fonts.
+    assert pages(latin) == 5
+    assert b"/BaseFont /Courier" in latin
+
+    stats_df.loc[0, "cell_type"] = "CD45RA\u207a"
+    embedded = build_pdf_report("Indication=melanoma", counts, summary, stats_df, flow_df)
+    assert pages(embedded) == 5
+    assert b"/BaseFont /Courier" not in embedded
+
+
+def test_lean_html_report_shares_plotly_asset_and_summarizes_large_boxes(tmp_path) -> None:
+    rng = np.random.default_rng(0)
+    plot_df = pd.DataFrame(
+        {
+            "cell_type": np.tile(CELL_TYPES, 400),
+            "metric_value": rng.gamma(2.0, 10.0, 400 * len(CELL_TYPES)),
+            "response": np.repeat(rng.choice(["yes", "no"], 400), len(CELL_TYPES)),
+        }
+    )
+    fig = px.box(plot_df, x="cell_type", y="metric_value", color="response", points="all")
+    summarized = summarize_box_traces(fig)
+
+    for trace in summarized.data:
+        assert trace.y is None and trace.boxpoints is False
+        group = plot_df.loc[plot_df["response"] == trace.name]
+        for cell_type, q1, median, q3 in zip(trace.x, trace.q1, trace.median, trace.q3):
+            values = group.loc[group["cell_type"] == cell_type, "metric_value"]
+            assert np.allclose([q1, median, q3], np.percentile(values, [25, 50, 75]))
+    # Small traces keep their raw points.
+    assert summarize_box_traces(fig, min_points=10_000).data[0].y is not None
+
+    summary = {
+        "test_label": "Mann-Whitney U",
+        "correction_label": "BH-FDR",
+        "unit": "sample",
+        "metric": "percentage",
+        "transform_label": "Raw",
+    }
+    stats_df = pd.DataFrame({"cell_type": CELL_TYPES})
+    flow_df = pd.DataFrame({"step": ["All samples"]})
+    args = ("Indication=melanoma", {"n_samples": 400, "n_subjects": 400}, summary, stats_df, flow_df, fig)
+    full = build_html_report(*args)
+    lean = build_html_report(*args, lean=True)
+    assert f'src="{PLOTLY_ASSET}"'.encode() in lean
+    assert len(lean) < 50_000 < len(full)
+    assert write_plotly_asset(str(tmp_path)) == str(tmp_path / f"plotly-{plotly.__version__}.min.js")
+
+    # Archived reports resolve their script tag to the one asset written next to them.
+    archive = tmp_path / "archive"
+    paths = [write_html_archive(str(archive), name, *args) for name in ("cohort_a", "cohort_b")]
+    for path in paths:
+        with open(path, "rb") as handle:
+            source = re.search(rb'<script[^>]* src="([^"]+)"', handle.read())
+        assert source is not None and (archive / source.group(1).decode()).is_file()
+    assert sorted(p.name for p in archive.iterdir()) == ["cohort_a.html", "cohort_b.html", PLOTLY_ASSET]
+
+
+def test_report_queue_builds_in_background_and_serves_repeats_from_disk(report_cache) -> None:
+    summary = {
+        "test_label": "Mann-Whitney U",
+        "correction_label": "BH-FDR",
+        "unit": "subject",
+        "metric": "percentage",
+        "transform_label": "Raw",
+    }
+    stats_df = pd.DataFrame([{"cell_type": "b_cell", "p_value": 0.03, "q_value": 0.05}])
+    flow_df = pd.DataFrame([{"step": "All samples", "n_samples": 10, "n_subjects": 7}])
+    key_args = ("Indication=melanoma", {"n_samples": 6, "n_subjects": 5}, summary, stats_df)
+
+    assert report_key("pdf", *key_args) == report_key("pdf", *key_args)
+    assert report_key("pdf", *key_args) != report_key("html", *key_args)
+    changed_stats = ("Indication=melanoma", key_args[1], summary, stats_df.assign(q_value=0.06))
+    assert report_key("pdf", *key_args) != report_key("pdf", *changed_stats)
+    box_df = pd.DataFrame({"cell_type": ["b_cell"] * 4, "value": [1, 2, 3, 4]})
+    fig = px.box(box_df, x="cell_type", y="value", points="outliers")
+    assert report_key("html", *key_args, fig) == report_key("html", *key_args, fig)
+    with_points = px.box(box_df, x="cell_type", y="value", points="all")
+    assert report_key("html", *key_args, fig) != report_key("html", *key_args, with_points)
+
+    key = submit_pdf_report(*key_args, flow_df)
+    assert report_result(key, timeout=60).startswith(b"%PDF")
+
+    release = threading.Event()
+    builds: list[int] = []
+
+    def build() -> bytes:
+        _ = release.wait(timeout=60)
+        builds.append(1)
+        return b"report"
+
+    first = submit_report("html-pending", build)
+    assert submit_report("html-pending", build) is first
+    assert report_result("html-pending") is None
+    release.set()
+    assert report_result("html-pending", timeout=60) == b"report"
+    # Finished reports come back from the disk cache without another build.
+    assert submit_report("html-pending", build).result() == str(report_cache / "html-pending.html")
+    assert report_result("html-pending") == b"report"
+    assert builds == [1]
+
+
+def test_report_queue_keeps_failures_until_retried(report_cache) -> None:
+    attempts: list[int] = []
+
+    def build() -> bytes:
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("renderer crashed")
+        return b"report"
+
+    assert report_status("pdf-flaky") == "missing"
+    job = submit_report("pdf-flaky", build)
+    _ = wait([job], timeout=60)
+    assert report_status("pdf-flaky") == "failed"
+    # The failure is reported on every poll instead of turning into a report that never arrives.
+    for _ in range(2):
+        with pytest.raises(RuntimeError, match="renderer crashed"):
+            _ = report_result("pdf-flaky")
+
+    assert retry_report("pdf-flaky")
+    assert report_result("pdf-flaky", timeout=60) == b"report"
+    assert report_status("pdf-flaky") == "ready"
+    assert not retry_report("pdf-flaky")
+    assert attempts == [1, 1]
+
+
 def test_run_analysis_prints_no_significant_message(capsys, monkeypatch, tmp_path) -> None:
     monkeypatch.chdir(tmp_path)
 
@@ -223,6 +1027,11 @@ def test_run_analysis_prints_no_significant_message(capsys, monkeypatch, tmp_pat
 
     monkeypatch.setattr(run_analysis, "get_part2_frequency_table", fake_part2_table)
     monkeypatch.setattr(run_analysis, "compare_responders", fake_compare_responders)
+    monkeypatch.setattr(
+        run_analysis,
+        "compare_responders_scenarios",
+        lambda scenarios, **_: [fake_compare_responders() for _ in scenarios],
+    )
     monkeypatch.setattr(run_analysis, "get_subset_stats", fake_subset_stats)
 
     run_analysis.main()
@@ -289,6 +1098,11 @@ def test_run_analysis_hides_no_significant_message_when_signal_exists(capsys, mo
 
     monkeypatch.setattr(run_analysis, "get_part2_frequency_table", fake_part2_table)
     monkeypatch.setattr(run_analysis, "compare_responders", fake_compare_responders)
+    monkeypatch.setattr(
+        run_analysis,
+        "compare_responders_scenarios",
+        lambda scenarios, **_: [fake_compare_responders() for _ in scenarios],
+    )
     monkeypatch.setattr(run_analysis, "get_subset_stats", fake_subset_stats)
 
     run_analysis.main()